@@ -79,33 +79,84 @@ def ref_sub(x):
     return make_a_href(unescape(x.groups()[0]))
 
 # order matters, a lot.
+# each shortcut is (literal the line must contain, pattern, replacement), the
+# literal lets us skip the regex on lines it can not match.
 shortcuts = [
     # canonical: m > * > ex > i > c
-    (r'[i][c](.*?)[/c][/i]', r'<i style="color:green">\g<1></i>'),
-    (r'[m(\d)][ex](.*?)[/ex][/m]', r'<div class="ex" style="margin-left:\g<1>em;color:steelblue">\g<2></div>'),
-    (r'[m(\d)][*][ex](.*?)[/ex][/*][/m]',
+    ('[i][c]', r'[i][c](.*?)[/c][/i]', r'<i style="color:green">\g<1></i>'),
+    ('[ex]', r'[m(\d)][ex](.*?)[/ex][/m]', r'<div class="ex" style="margin-left:\g<1>em;color:steelblue">\g<2></div>'),
+    ('[*][ex]', r'[m(\d)][*][ex](.*?)[/ex][/*][/m]',
      r'<div class="sec ex" style="margin-left:\g<1>em;color:steelblue">\g<2></div>'),
-    (r'[*][ex](.*?)[/ex][/*]', r'<span class="sec ex" style="color:steelblue">\g<1></span>'),
-    (r'[m1](?:-{2,})[/m]', '<hr/>'),
-    (r'[m(\d)](?:-{2,})[/m]', r'<hr style="margin-left:\g<1>em"/>'),
+    ('[*][ex]', r'[*][ex](.*?)[/ex][/*]', r'<span class="sec ex" style="color:steelblue">\g<1></span>'),
+    ('[m1]--', r'[m1](?:-{2,})[/m]', '<hr/>'),
+    ('--[/m]', r'[m(\d)](?:-{2,})[/m]', r'<hr style="margin-left:\g<1>em"/>'),
 ]
-shortcuts = [(re.compile(repl.replace('[', r'\[').replace('*]', r'\*]')), sub)
-             for (repl, sub) in shortcuts]
+shortcuts = [(literal, re.compile(repl.replace('[', r'\[').replace('*]', r'\*]')), sub)
+             for (literal, repl, sub) in shortcuts]
 
 def apply_shortcuts(line):
-    for repl, sub in shortcuts:
-        line = re.sub(repl, sub, line)
+    for literal, repl, sub in shortcuts:
+        if literal in line:
+            line = repl.sub(sub, line)
     return line
 
+# tags that are dropped or replaced before parsing, in a single pass
+pre_parse_tags = {
+    '[trn]': '', '[/trn]': '', '[trs]': '', '[/trs]': '',
+    '[!trn]': '', '[/!trn]': '', '[!trs]': '', '[/!trs]': '',
+    '[/lang]': '', '[com]': '', '[/com]': '',
+    '[t]': '''<!-- T --><span style="font-family:'Helvetica'">''',
+    '[/t]': '</span><!-- T -->',
+}
+
+# text formats, color, example and secondary zones, labels, references:
+# tags that map to html one to one, rendered in a single pass
+html_tags = {
+    "[']": '<u>', "[/']": '</u>',
+    '[b]': '<b>', '[/b]': '</b>',
+    '[i]': '<i>', '[/i]': '</i>',
+    '[u]': '<u>', '[/u]': '</u>',
+    '[sup]': '<sup>', '[/sup]': '</sup>',
+    '[sub]': '<sub>', '[/sub]': '</sub>',
+    '[c]': '<span style="color:green">', '[/c]': '</span>',
+    '[ex]': '<span class="ex" style="color:steelblue">', '[/ex]': '</span>',
+    '[*]': '<span class="sec">', '[/*]': '</span>',
+    '[p]': '<i class="p" style="color:green">', '[/p]': '</i>',
+    '[ref]': '<<', '[/ref]': '>>',
+    '[url]': '<<', '[/url]': '>>',
+}
+
+def _alternation(table):
+    return '|'.join(re.escape(tag) for tag in sorted(table, key=len, reverse=True))
+
 # precompiled regexs
 
 re_brackets_blocks = re.compile(r'\{\{[^}]*\}\}')
-re_lang_open = re.compile(r'\[lang[^\]]*\]')
+re_pre_parse = re.compile(r'\[lang[^\]]*\]|' + _alternation(pre_parse_tags))
+re_html_tags = re.compile(_alternation(html_tags) + r'|\[c (\w+)\]')
 re_m_open = re.compile(r'(?<!\\)\[m\d\]')
-re_c_open_color = re.compile(r'\[c (\w+)\]')
 re_sound = re.compile(r'\[s\]([^\[]*?)(wav|mp3)\s*\[/s\]')
 re_img = re.compile(r'\[s\]([^\[]*?)(jpg|jpeg|gif|tif|tiff)\s*\[/s\]')
 re_m = re.compile(r'\[m(\d)\](.*?)\[/m\]')
+re_line_break = re.compile(r'\\$')
+re_ref = re.compile('<<(.*?)>>')
+re_escaped_bracket = re.compile(r'\\([\[\]])')
+re_tags_open = re.compile('(?<!\\\\)\[(c |[cuib]\])')
+re_tags_close = re.compile('\[/[cuib]\]')
+
+sound_tag = '<object type="audio/x-wav" data="\g<1>\g<2>" width="40" height="40">' \
+            '<param name="autoplay" value="false" />' \
+            '</object>'
+img_tag = '<img align="top" src="\g<1>\g<2>" alt="\g<1>\g<2>" />'
+
+def _pre_parse_sub(match):
+    return pre_parse_tags.get(match.group(), '')
+
+def _html_sub(match):
+    color = match.group(1)
+    if color is None:
+        return html_tags[match.group()]
+    return '<span style="color:%s">' % color
 
 # single instance of parser.  it's save as long as this script's not going multithread.
 _parse = flawless_dsl.FlawlessDSLParser().parse
@@ -146,31 +197,15 @@ def _clean_tags(line, audio):
     [lang ...] |
     [com]     /
     """
-    # remove {{...}} blocks
-    line = re_brackets_blocks.sub('', line)
-    # remove trn tags
-    # re_trn = re.compile('\[\/?!?tr[ns]\]')
-    line = line \
-        .replace('[trn]', '') \
-        .replace('[/trn]', '') \
-        .replace('[trs]', '') \
-        .replace('[/trs]', '') \
-        .replace('[!trn]', '') \
-        .replace('[/!trn]', '') \
-        .replace('[!trs]', '') \
-        .replace('[/!trs]', '')
-
-    # remove lang tags
-    line = re_lang_open.sub('', line).replace('[/lang]', '')
-    # remove com tags
-    line = line.replace('[com]', '').replace('[/com]', '')
-    # remove t tags
-    line = line.replace('[t]', '''<!-- T --><span style="font-family:'Helvetica'">''')
-    line = line.replace('[/t]', '</span><!-- T -->')
+    # remove {{...}} blocks, they may hide brackets of other tags
+    if '{{' in line:
+        line = re_brackets_blocks.sub('', line)
+    # remove trn, trs, lang and com tags, replace t tags
+    line = re_pre_parse.sub(_pre_parse_sub, line)
 
     line = _parse(line)
 
-    line = re.sub(r'\\$', '<br/>', line)
+    line = re_line_break.sub('<br/>', line)
 
     # paragraph, part one: before shortcuts.
     line = line.replace('[m]', '[m1]')
@@ -185,54 +220,19 @@ def _clean_tags(line, audio):
     # paragraph, part two: if any not shourcuted [m] left?
     line = re_m.sub('<div style="margin-left:\g<1>em">\g<2></div>', line)
 
-    # text formats
-
-    line = line.replace("[']", '<u>').replace("[/']", '</u>')
-    line = line.replace('[b]', '<b>').replace('[/b]', '</b>')
-    line = line.replace('[i]', '<i>').replace('[/i]', '</i>')
-    line = line.replace('[u]', '<u>').replace('[/u]', '</u>')
-    line = line.replace('[sup]', '<sup>').replace('[/sup]', '</sup>')
-    line = line.replace('[sub]', '<sub>').replace('[/sub]', '</sub>')
-
-    # color
-    line = line.replace('[c]', '<span style="color:green">')
-    line = re_c_open_color.sub('<span style="color:\g<1>">', line)
-    line = line.replace('[/c]', '</span>')
-
-    # example zone
-    line = line.replace('[ex]', '<span class="ex" style="color:steelblue">')
-    line = line.replace('[/ex]', '</span>')
-
-    # secondary zone
-    line = line.replace('[*]', '<span class="sec">').replace('[/*]', '</span>')
-
-    # abbrev. label
-    line = line.replace('[p]', '<i class="p" style="color:green">')
-    line = line.replace('[/p]', '</i>')
+    line = re_html_tags.sub(_html_sub, line)
 
     # cross reference
-    line = line.replace('[ref]', '<<').replace('[/ref]', '>>')
-    line = line.replace('[url]', '<<').replace('[/url]', '>>')
-    line = re.sub('<<(.*?)>>', ref_sub, line)
+    line = re_ref.sub(ref_sub, line)
 
     # sound file
-    if audio:
-        sound_tag = '<object type="audio/x-wav" data="\g<1>\g<2>" width="40" height="40">' \
-                    '<param name="autoplay" value="false" />' \
-                    '</object>'
-    else:
-        sound_tag = ''
-    line = re_sound.sub(sound_tag, line)
+    line = re_sound.sub(sound_tag if audio else '', line)
 
     # image file
-    line = re_img.sub(
-        '<img align="top" src="\g<1>\g<2>" alt="\g<1>\g<2>" />',
-        line,
-    )
+    line = re_img.sub(img_tag, line)
 
     # \[...\]
-    line = line.replace(r'\[', '[').replace(r'\]', ']')
-    return line
+    return re_escaped_bracket.sub('\\1', line)
 
 wrapped_in_quotes_re = re.compile(r'^(\'|")(.*)(\1)$')
 
@@ -279,8 +279,8 @@ def read(glos, fname, **options):
 
             # some ill formated source may have tags spanned into multiple lines
             # try to match opening and closing tags
-            tags_open  = re.findall('(?<!\\\\)\[(c |[cuib]\])', line)
-            tags_close = re.findall('\[/[cuib]\]', line)
+            tags_open  = re_tags_open.findall(line)
+            tags_close = re_tags_close.findall(line)
             if len(tags_open) != len(tags_close):
                 unfinished_line = line
                 continue
@@ -320,3 +320,41 @@ def read(glos, fname, **options):
             [current_key] + current_key_alters,
             '\n'.join(current_text),
         )
+
+def benchmark(lines, repeat=5, audio=True):
+    """Returns how many lines per second _clean_tags converts."""
+    from time import perf_counter
+    started = perf_counter()
+    for _ in range(repeat):
+        for line in lines:
+            _clean_tags(line, audio)
+    return repeat * len(lines) / (perf_counter() - started)
+
+def main():
+    """
+    python -m yatetradki.reader.demangle_dsl [--encoding utf-16] [file.dsl ...]
+
+    Prints conversion throughput in lines per second, either for the article
+    lines of the given dictionaries or for the golden regression corpus.
+    """
+    import json
+    from argparse import ArgumentParser
+    from os.path import dirname, join
+    parser = ArgumentParser(description='Measure DSL to HTML conversion throughput')
+    parser.add_argument('--encoding', default='utf-8')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('dsl', nargs='*')
+    args = parser.parse_args()
+    if args.dsl:
+        lines = []
+        for fname in args.dsl:
+            with open(fname, encoding=args.encoding) as fp:
+                lines.extend(line.strip() for line in fp if line[:1] in (' ', '\t'))
+    else:
+        with open(join(dirname(__file__), 'demangle_dsl_golden.json'), encoding='utf-8') as fp:
+            lines = [case['line'] for case in json.load(fp)]
+    rate = benchmark(lines, args.repeat)
+    print('%d lines x %d: %.0f lines/s' % (len(lines), args.repeat, rate))
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,26 @@
 #import codecs
 #import io
-from os import makedirs
-from os.path import exists, basename, dirname, join, expanduser, expandvars
+from os import makedirs, replace, stat
+from os.path import exists, basename, dirname, join, expanduser, expandvars, getsize
 import re
+import sys
+import codecs
 import logging
-import pickle
 import fileinput
+import mmap
+import struct
+from array import array
+from copy import copy
 from argparse import ArgumentParser
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from threading import Lock
 
 from bs4 import BeautifulSoup
 
 from yatetradki.reader.demangle_dsl import _clean_tags
+from yatetradki.reader.dsl_search import HeadwordIndex, ArticleIndex, SUGGEST_LIMIT
 
 
 FORMAT = '%(asctime)-15s %(levelname)s %(message)s'
@@ -27,16 +36,49 @@ STR_MAIN_ENTRY = 'Main entry:'
 STR_SEE_MAIN_ENTRY = 'See main entry: ↑'
 EXAMPLES_PER_DICT = 3
 MAX_ARTICLE_LEN = 100000
+ARTICLE_CACHE_SIZE = 2000 # per dictionary, including negative results
+INDEX_DIR = '~/.cache/dsl_index/'
+INDEX_MAGIC = b'DSLIDX\x00\x01'
+# magic, DSL size, DSL mtime (ns), number of entries, size of the keys blob
+INDEX_HEADER = struct.Struct('<8sQQQQ')
+
+
+def _resolve_encoding(encoding, data):
+    """
+    Returns (codec, BOM length). UTF-16 without explicit byte order is
+    resolved by the BOM, like the text mode reader would do it.
+    """
+    name = codecs.lookup(encoding).name
+    if name == 'utf-16':
+        if data[:2] == codecs.BOM_UTF16_BE:
+            return 'utf-16-be', 2
+        return 'utf-16-le', 2 if data[:2] == codecs.BOM_UTF16_LE else 0
+    if name in ('utf-8', 'utf-8-sig'):
+        return 'utf-8', 3 if data[:3] == codecs.BOM_UTF8 else 0
+    return name, 0
 
 
 class DSLRawReader(object):
+    """
+    Reads DSL files as raw bytes. Positions (tell/seek) are byte offsets,
+    lines are found by searching for the encoded newline, and only headwords
+    and the requested articles are decoded. Text mode tell() on UTF-16 has
+    to replay the decoder and is painfully slow on large dictionaries.
+    """
     def __init__(self, filename, encoding='utf-16',
                  article_header='<meta charset="utf-8">'):
         self._filename = filename
         self._article_header = [article_header]
 
-        self._file = open(filename, 'r', encoding=encoding)
-        self._file.seek(0)
+        self._file = open(filename, 'rb')
+        size = getsize(filename)
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._size = size
+        self._encoding, self._bom = _resolve_encoding(encoding, self._data[:4])
+        self._newline = '\n'.encode(self._encoding)
+        self._unit = len(self._newline)
+        self._indent = ('\t'.encode(self._encoding), ' '.encode(self._encoding))
+        self._pos = 0
 
     def __repr__(self):
         return '%s(%s)' % (self.__class__, self._filename)
@@ -46,22 +88,48 @@ class DSLRawReader(object):
         return self._filename
 
     def tell(self):
-        return self._file.tell()
+        return self._pos
 
     def seek(self, offset, from_what=0):
-        return self._file.seek(offset, from_what)
+        if from_what == 1:
+            offset += self._pos
+        elif from_what == 2:
+            offset += self._size
+        self._pos = offset
+        return offset
 
     def __len__(self):
-        pos = self.tell()
-        self.seek(0, 2)
-        size = self.tell()
-        self.seek(pos)
-        return size
+        return self._size
+
+    def _next_line_span(self):
+        """Returns (start, end) of the next line including newline or None at EOF."""
+        start = max(self._pos, self._bom)
+        if start >= self._size:
+            return None
+        end = self._data.find(self._newline, start)
+        while end != -1 and (end - start) % self._unit:
+            # misaligned match inside a multibyte character
+            end = self._data.find(self._newline, end + 1)
+        end = self._size if end == -1 else end + self._unit
+        self._pos = end
+        return start, end
+
+    def _decode(self, start, end):
+        return self._data[start:end].decode(self._encoding).replace('\r\n', '\n')
+
+    def _readline(self):
+        span = self._next_line_span()
+        if span is None:
+            return ''
+        return self._decode(*span)
+
+    def _is_article_line(self, start):
+        return self._data[start:start + self._unit] in self._indent
 
     def read_header(self):
         while True:
-            pos = self._file.tell()
-            line = self._file.readline()
+            pos = self._pos
+            line = self._readline()
             if line == '':
                 # unexpected EOF
                 break
@@ -70,48 +138,63 @@ class DSLRawReader(object):
             elif len(line.strip()) == 0:
                 continue # empty line delimiter
             else:
-                self._file.seek(pos)
+                self._pos = pos
                 break
 
     def _skip_until_article_or_eof(self):
-        initial_pos = self._file.tell()
+        initial_pos = self._pos
         while True:
-            saved_pos = self._file.tell()
-            line = self._file.readline()
-            if line == '': # eof
+            saved_pos = self._pos
+            span = self._next_line_span()
+            if span is None: # eof
                 break
-            if line[0] in ' \t': # article body
-                self._file.seek(saved_pos)
+            if self._is_article_line(span[0]): # article body
+                self._pos = saved_pos
                 break
-        return initial_pos != self._file.tell()
+        return initial_pos != self._pos
 
-    def _read_article_lines(self, convert=True):
-        lines = []
+    def _article_span(self):
+        start = end = max(self._pos, self._bom)
         while True:
-            saved_pos = self._file.tell()
-            line = self._file.readline()
-            if line == '': # eof
+            saved_pos = self._pos
+            span = self._next_line_span()
+            if span is None: # eof
                 break
-            elif line[0] in ' \t': # article body
-                if convert:
-                    line = _clean_tags(line.strip(), None)
-                lines.append(line)
+            elif self._is_article_line(span[0]): # article body
+                end = span[1]
             else:
                 # we've reached next word title, probably
-                self._file.seek(saved_pos)
+                self._pos = saved_pos
                 break
+        return start, end
+
+    def _read_article_lines(self, convert=True):
+        start, end = self._article_span()
+        text = self._decode(start, end)
+        lines = [line + '\n' for line in text.split('\n')[:-1]]
+        if not text.endswith('\n'):
+            lines.append(text[text.rfind('\n') + 1:])
+        lines = [line for line in lines if line]
+        if convert:
+            lines = [_clean_tags(line.strip(), None) for line in lines]
         return lines
 
+    def _next_word_line(self):
+        span = self._next_line_span()
+        if span is None:
+            return None
+        return self._decode(*span)
+
     def get_next_word(self, convert=True):
-        word = self._file.readline()
-        if word == '': # eof
+        word = self._next_word_line()
+        if word is None: # eof
             return None, None
 
-        saved_pos = self._file.tell()
+        saved_pos = self._pos
         skipped_anything = self._skip_until_article_or_eof()
         article = self._read_article_lines(convert)
         if skipped_anything:
-            self._file.seek(saved_pos)
+            self._pos = saved_pos
 
         # Be cautious that words may contain multiple titles, e.g.:
         # En-En_American_Heritage_Dictionary.dsl:
@@ -123,49 +206,168 @@ class DSLRawReader(object):
         article = '\n'.join(self._article_header + article)
         return word.strip(), article
 
+    def next_headword(self):
+        """Same as get_next_word, but does not decode the article."""
+        word = self._next_word_line()
+        if word is None: # eof
+            return None
 
-class DSLIndexer(object):
-    def __init__(self, filename, dsl_raw_reader):
+        saved_pos = self._pos
+        skipped_anything = self._skip_until_article_or_eof()
+        self._article_span()
+        if skipped_anything:
+            self._pos = saved_pos
+        return word.strip()
 
-        self._index = dict()
 
-        if exists(filename):
-            with open(filename, 'rb') as index_file:
-                self._index = pickle.load(index_file)
-            return
+def _file_stamp(filename):
+    st = stat(filename)
+    return st.st_size, st.st_mtime_ns
+
+
+def _index_path(filename):
+    index_path = expanduser(expandvars(INDEX_DIR))
+    return join(index_path, basename(filename) + '.index')
+
+
+def _index_is_fresh(index_filename, dsl_filename):
+    try:
+        with open(index_filename, 'rb') as index_file:
+            header = index_file.read(INDEX_HEADER.size)
+    except OSError:
+        return False
+    if len(header) < INDEX_HEADER.size:
+        return False
+    magic, size, mtime, _count, _keys_size = INDEX_HEADER.unpack(header)
+    return magic == INDEX_MAGIC and (size, mtime) == _file_stamp(dsl_filename)
+
 
+def _u64_array(buffer):
+    if sys.byteorder == 'little':
+        return memoryview(buffer).cast('Q')
+    result = array('Q', bytes(buffer))
+    result.byteswap()
+    return result
+
+
+class DSLIndexer(object):
+    """
+    Headword index of a DSL file in a compact binary format. The file is
+    memory-mapped, lookups are binary searches over it, so opening is
+    instant and the pages are shared by all processes using the dictionary.
+
+    Layout, little endian:
+        INDEX_HEADER
+        u64[count + 1]  offsets of the headwords in the keys blob
+        u64[count]      article positions in the DSL file
+        keys blob       utf-8 headwords sorted bytewise
+
+    The index is rebuilt if the DSL file size or mtime does not match the
+    header (this also replaces indexes in the old pickle format).
+    """
+    def __init__(self, filename, dsl_raw_reader):
+        self._filename = filename
+        self._count = 0
+        stamp = _file_stamp(dsl_raw_reader.filename)
+        if self._open(filename, stamp):
+            return
+        self._build(filename, dsl_raw_reader, stamp)
+        if not self._open(filename, stamp):
+            raise RuntimeError('Could not open fresh index %s' % filename)
+
+    def _open(self, filename, stamp):
+        if not exists(filename):
+            return False
+        with open(filename, 'rb') as index_file:
+            header = index_file.read(INDEX_HEADER.size)
+            if len(header) < INDEX_HEADER.size:
+                return False
+            magic, size, mtime, count, keys_size = INDEX_HEADER.unpack(header)
+            if magic != INDEX_MAGIC or (size, mtime) != stamp:
+                logging.info('Index %s is outdated, rebuilding', filename)
+                return False
+            self._mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        start = INDEX_HEADER.size
+        self._key_offsets = _u64_array(view[start:start + 8 * (count + 1)])
+        start += 8 * (count + 1)
+        self._positions = _u64_array(view[start:start + 8 * count])
+        self._keys_start = start + 8 * count
+        self._count = count
+        return True
+
+    def _build(self, filename, dsl_raw_reader, stamp):
+        index = dict()
         size = len(dsl_raw_reader)
         logging.info('Indexing to file %s (dict size %s)', filename, size)
         base_filename = basename(filename)
 
+        dsl_raw_reader.seek(0)
         dsl_raw_reader.read_header()
         last_percent = 0
         while True:
             pos = dsl_raw_reader.tell()
-            current_word, _article = dsl_raw_reader.get_next_word(convert=False)
+            current_word = dsl_raw_reader.next_headword()
             if current_word is None: # eof
                 break
-            self._index[current_word] = pos
+            index[current_word.encode('utf-8')] = pos
             percent = float(pos) / size * 100.
             if percent - last_percent > 10:
                 last_percent = percent
                 logging.info('Indexing %s... %%%d', base_filename, percent)
 
+        keys = sorted(index)
+        key_offsets = array('Q', [0])
+        for key in keys:
+            key_offsets.append(key_offsets[-1] + len(key))
+        positions = array('Q', [index[key] for key in keys])
+        keys_size = key_offsets[-1]
+        if sys.byteorder != 'little':
+            key_offsets.byteswap()
+            positions.byteswap()
+
         try:
             makedirs(dirname(filename))
         except OSError:
             pass
 
-        with open(filename, 'wb') as index_file:
-            pickle.dump(self._index, index_file)
-        logging.info('Indexing done (%s entries, %s)',
-                     len(self._index), filename)
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'wb') as index_file:
+            index_file.write(INDEX_HEADER.pack(
+                INDEX_MAGIC, stamp[0], stamp[1], len(keys), keys_size))
+            index_file.write(key_offsets.tobytes())
+            index_file.write(positions.tobytes())
+            index_file.write(b''.join(keys))
+        replace(temp_filename, filename)
+        logging.info('Indexing done (%s entries, %s)', len(keys), filename)
 
     def __len__(self):
-        return len(self._index)
+        return self._count
+
+    def _key(self, i):
+        start = self._keys_start
+        return self._mmap[start + self._key_offsets[i]:start + self._key_offsets[i + 1]]
+
+    def _bisect(self, key):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
 
     def get_pos(self, word):
-        return self._index.get(word)
+        key = word.encode('utf-8')
+        i = self._bisect(key)
+        if i < self._count and self._key(i) == key:
+            return self._positions[i]
+        return None
+
+    def words(self):
+        for i in range(self._count):
+            yield self._key(i).decode('utf-8')
 
 
 class DSLLookuper(object):
@@ -178,9 +380,7 @@ class DSLLookuper(object):
 
         self._dsl_indexer = dsl_indexer
         if self._dsl_indexer is None:
-            index_path = expanduser(expandvars('~/.cache/dsl_index/'))
-            index_path = join(index_path, basename(filename) + '.index')
-            self._dsl_indexer = DSLIndexer(index_path, self._dsl_raw_reader)
+            self._dsl_indexer = DSLIndexer(_index_path(filename), self._dsl_raw_reader)
 
         self._dsl_raw_reader.seek(0)
 
@@ -196,6 +396,24 @@ class DSLLookuper(object):
                 logging.info('Could not find word "%s"', word)
                 return None
 
+    def headwords(self):
+        return self._dsl_indexer.words()
+
+    def articles(self):
+        """
+        Yields (headword, raw article) for every headword in the file. It
+        reads with a copy of the reader, which shares the mmap but keeps a
+        position of its own, so lookups can go on meanwhile.
+        """
+        reader = copy(self._dsl_raw_reader)
+        reader.seek(0)
+        reader.read_header()
+        while True:
+            word, article = reader.get_next_word(convert=False)
+            if word is None:
+                return
+            yield word, article
+
     def lookup(self, word):
         self._dsl_raw_reader.seek(0, 0)
         self._dsl_raw_reader.read_header()
@@ -208,13 +426,13 @@ class DSLLookuper(object):
         return result
 
 
-def check_reference(dsl_lookuper, word, article, depth):
+def check_reference(dsl_lookuper, word, article, depth, memo=None):
     # Special case for articles in En-En-Longman_DOCE5.dsl
     text = BeautifulSoup(article, 'html.parser').text
     if text.startswith(STR_SEE_MAIN_ENTRY):
         referenced_word = text[len(STR_SEE_MAIN_ENTRY):].strip()
         logging.info('Detected reference from "%s" to "%s" (LongmanDOCE5)', word, referenced_word)
-        return lookup_word(dsl_lookuper, referenced_word, depth)
+        return lookup_word(dsl_lookuper, referenced_word, depth, memo)
 
     # Special case for CambridgeAdvancedLearners
     main_entry_start = article.find(STR_MAIN_ENTRY)
@@ -225,7 +443,7 @@ def check_reference(dsl_lookuper, word, article, depth):
             referenced_word = match.group(1)
             if referenced_word != word:
                 logging.info('Detected reference from "%s" to "%s" (CambridgeAdvancedLearners)', word, referenced_word)
-                more_article, more_examples = lookup_word(dsl_lookuper, referenced_word, depth)
+                more_article, more_examples = lookup_word(dsl_lookuper, referenced_word, depth, memo)
                 return article + more_article, more_examples
 
     # Special case for LingvoUniversal
@@ -237,7 +455,7 @@ def check_reference(dsl_lookuper, word, article, depth):
                 logging.warning('Self reference from "%s" to "%s", skipping (LingvoUniversal)', word, referenced_word)
             else:
                 logging.info('Detected reference from "%s" to "%s" (LingvoUniversal)', word, referenced_word)
-                return lookup_word(dsl_lookuper, referenced_word, depth)
+                return lookup_word(dsl_lookuper, referenced_word, depth, memo)
 
     # Special case for En-En_American_Heritage_Dictionary.dsl
     match = RE_SEE_OTHER.search(text)
@@ -245,7 +463,7 @@ def check_reference(dsl_lookuper, word, article, depth):
         referenced_word = match.group(1)
         if referenced_word != word:
             logging.info('Detected reference from "%s" to "%s" (AmericanHeritageDictionary)', word, referenced_word)
-            return lookup_word(dsl_lookuper, referenced_word, depth)
+            return lookup_word(dsl_lookuper, referenced_word, depth, memo)
 
     return article, None
 
@@ -280,7 +498,22 @@ def extract_examples(article):
     return result
 
 
-def lookup_word(dsl_lookuper, word, depth):
+def lookup_word(dsl_lookuper, word, depth, memo=None):
+    """
+    memo is an optional cache of results keyed by (word, depth), it also
+    covers the words visited while following references.
+    """
+    if memo is None:
+        return _lookup_word(dsl_lookuper, word, depth, None)
+    key = (word, depth)
+    result = memo.get(key)
+    if result is None:
+        result = _lookup_word(dsl_lookuper, word, depth, memo)
+        memo.set(key, result)
+    return result
+
+
+def _lookup_word(dsl_lookuper, word, depth, memo):
     if depth == 0:
         logging.info('Exceeded recusion limit for word "%s"', word)
         return None, None
@@ -292,7 +525,7 @@ def lookup_word(dsl_lookuper, word, depth):
     # print(article, file=stderr)
 
     article = cleanup_article(article)
-    article, _examples = check_reference(dsl_lookuper, word, article, depth-1)
+    article, _examples = check_reference(dsl_lookuper, word, article, depth-1, memo)
 
     # print('----------------', file=stderr)
     examples = None
@@ -314,11 +547,16 @@ def _init_index(filename):
 def _ensure_indexes_present(dsl_filenames):
     """
     This functions is only called for its side effects. It creates DSLLookupers
-    for each DSL file in parallel processes to make user DSLIndexers are also
-    created in parallel.
+    for each DSL file with a missing or outdated index in parallel processes
+    to make sure DSLIndexers are also created in parallel.
     """
-    with Pool(processes=None) as pool:
-        pool.map(_init_index, dsl_filenames)
+    stale = [filename for filename in dsl_filenames
+             if not _index_is_fresh(_index_path(filename), filename)]
+    if len(stale) > 1:
+        with Pool(processes=None) as pool:
+            pool.map(_init_index, stale)
+    elif stale:
+        _init_index(stale[0])
 
 
 def _uniq_at(current_chunk, all_words):
@@ -326,44 +564,177 @@ def _uniq_at(current_chunk, all_words):
     return [word for word in current_chunk if word in uniq]
 
 
+class ArticleCache(object):
+    """Bounded LRU of lookup_word results, not thread-safe."""
+    def __init__(self, max_size=ARTICLE_CACHE_SIZE):
+        self._max_size = max_size
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        result = self._items.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def set(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DSLLibrary(object):
+    """
+    A set of dictionaries that stays open between lookups: readers, mmapped
+    indexes and recently rendered articles (including the reference chains
+    followed by check_reference) are kept around. A batch of words is looked
+    up in all dictionaries concurrently, one thread per dictionary, so that
+    every reader is only ever used by a single thread.
+    """
+    def __init__(self, dsl_filenames, article_cache_size=ARTICLE_CACHE_SIZE):
+        self._filenames = list(dsl_filenames)
+        self._article_cache_size = article_cache_size
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self._filenames)))
+        self._lock = Lock() # readers keep a position, one batch at a time
+        self._index_lock = Lock() # one HeadwordIndex build at a time, outside of _lock
+        self._article_lock = Lock() # and one ArticleIndex build
+        self._open()
+
+    def _open(self):
+        _ensure_indexes_present(self._filenames)
+        self._stamps = [_file_stamp(filename) for filename in self._filenames]
+        self._lookupers = [DSLLookuper(filename) for filename in self._filenames]
+        self._memos = [ArticleCache(self._article_cache_size) for _ in self._filenames]
+        self._headword_index = None
+        self._article_index = None
+
+    def refresh(self):
+        """Reopens everything if any of the DSL files has changed."""
+        stamps = [_file_stamp(filename) for filename in self._filenames]
+        if stamps != self._stamps:
+            logging.info('DSL files changed, reopening library')
+            self._open()
+
+    def _lookup_one_dict(self, i, words):
+        lookuper, memo = self._lookupers[i], self._memos[i]
+        return [lookup_word(lookuper, word, 5, memo) for word in words]
+
+    def lookup_words(self, words):
+        """Returns [[(article, examples) per dictionary] per word]."""
+        words = [word.strip() for word in words]
+        per_dict = list(self._executor.map(
+            lambda i: self._lookup_one_dict(i, words), range(len(self._lookupers))))
+        return [[found[w] for found in per_dict] for w in range(len(words))]
+
+    def lookup(self, words):
+        with self._lock:
+            self.refresh()
+            all_found = self.lookup_words(words)
+        result = []
+        for found in all_found:
+            articles = []
+            examples = []
+            for article, current_examples in found:
+                if article is not None:
+                    articles.append(article)
+                    uniq_examples = _uniq_at(current_examples, examples)
+                    examples.extend(uniq_examples[:EXAMPLES_PER_DICT])
+            if articles:
+                articles = '<br>'.join(articles)
+                articles = articles[:MAX_ARTICLE_LEN]
+                result.append(articles)
+        return ''.join(result)
+
+    def _headwords(self):
+        """
+        The HeadwordIndex of the current dictionaries. Headwords come from the
+        in-memory indexes, not the readers, so it is built without holding
+        _lock and lookups go on meanwhile. It is published only if the
+        dictionaries were not reopened during the build.
+        """
+        with self._lock:
+            self.refresh()
+            lookupers, index = self._lookupers, self._headword_index
+        if index is not None:
+            return index
+        with self._index_lock:
+            with self._lock:
+                if self._lookupers is lookupers and self._headword_index is not None:
+                    return self._headword_index
+            index = HeadwordIndex(word for lookuper in lookupers for word in lookuper.headwords())
+            with self._lock:
+                if self._lookupers is lookupers:
+                    self._headword_index = index
+        return index
+
+    def suggest(self, text, limit=SUGGEST_LIMIT):
+        """Completions for text from all dictionaries, see HeadwordIndex.suggest."""
+        return self._headwords().suggest(text, limit)
+
+    def folded(self, word):
+        """Headwords that only differ from word in case or diacritics."""
+        return self._headwords().folded(word)
+
+    def _articles(self):
+        """The ArticleIndex of the current dictionaries, built without holding _lock like _headwords."""
+        with self._lock:
+            self.refresh()
+            lookupers, index = self._lookupers, self._article_index
+        if index is not None:
+            return index
+        with self._article_lock:
+            with self._lock:
+                if self._lookupers is lookupers and self._article_index is not None:
+                    return self._article_index
+            index = ArticleIndex(pair for lookuper in lookupers for pair in lookuper.articles())
+            with self._lock:
+                if self._lookupers is lookupers:
+                    self._article_index = index
+        return index
+
+    def reverse(self, query, limit=SUGGEST_LIMIT):
+        """Headwords whose articles contain all words of query."""
+        return self._articles().search(query, limit)
+
+    def stats(self):
+        return [{'filename': filename, 'entries': len(lookuper._dsl_indexer),
+                 'cached': len(memo), 'hits': memo.hits, 'misses': memo.misses}
+                for filename, lookuper, memo in zip(self._filenames, self._lookupers, self._memos)]
+
+
+_LIBRARIES = {}
+_LIBRARIES_LOCK = Lock()
+def library(dsls):
+    """Returns a resident DSLLibrary for the given list of dictionaries."""
+    key = tuple(dsls)
+    with _LIBRARIES_LOCK:
+        if key not in _LIBRARIES:
+            _LIBRARIES[key] = DSLLibrary(dsls)
+        return _LIBRARIES[key]
+
+
 def lookup(dsls, words):
-    _ensure_indexes_present(dsls)
-    dsl_lookupers = [DSLLookuper(dsl) for dsl in dsls]
-    # print(dsl_reader.lookup('abrade'))
-    words_found = 0
-    words_missing = 0
+    return library(dsls).lookup(words)
 
-    result = []
-    for word in words:
-        found = 0
-        articles = []
-        examples = []
-        word = word.strip()
-        for dsl_reader in dsl_lookupers:
-            depth = 5
-            article, current_examples = lookup_word(dsl_reader, word, depth)
-            if article is not None:
-                articles.append(article)
-                uniq_examples = _uniq_at(current_examples, examples)
-                examples.extend(uniq_examples[:EXAMPLES_PER_DICT])
-                found = 1
-        if found:
-            articles = '<br>'.join(articles)
-            articles = articles[:MAX_ARTICLE_LEN]
-            examples = ''.join(['<li>%s</li>' % ex for ex in examples])
-            if examples:
-                examples = '<ul>%s</ul>' % examples
-            result.append(articles)
-            # print('%s\t%s\t%s' % (word, examples, articles))
-            #print(examples, file=stderr)
-            words_found += 1
-        else:
-            words_missing += 1
-            # logging.info('Missing word: %s', word)
-
-    # logging.info('Found %d words, %d missing words, %d total',
-    #              words_found, words_missing, words_found + words_missing)
-    return ''.join(result)
+
+def suggest(dsls, text, limit=SUGGEST_LIMIT):
+    return library(dsls).suggest(text, limit)
+
+
+def folded(dsls, word):
+    return library(dsls).folded(word)
+
+
+def reverse(dsls, query, limit=SUGGEST_LIMIT):
+    return library(dsls).reverse(query, limit)
 
 
 def main():
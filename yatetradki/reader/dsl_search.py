@@ -0,0 +1,182 @@
+"""
+Approximate search over DSL headwords and article bodies.
+
+HeadwordIndex keeps the headwords of one or more dictionaries folded (case
+and diacritics removed) and sorted. The sorted list is an implicit trie:
+prefix completion is a bisect, and fuzzy matching walks it with one
+Levenshtein row per character, reusing the rows of the prefix shared with
+the previous headword and skipping whole subtrees that are already too far
+from the query.
+
+ArticleIndex is an inverted index from words of article bodies to
+headwords, for reverse lookups. It is much bigger, so it is only built on
+demand.
+"""
+
+import re
+import unicodedata
+from bisect import bisect_left
+
+SUGGEST_LIMIT = 20
+MAX_DISTANCE = 2
+SHORT_WORD = 4 # words up to this length are only allowed one typo
+LAST_CHAR = '\U0010ffff'
+
+RE_TAG = re.compile(r'\{\{[^}]*\}\}|\[[^\]]*\]')
+RE_TERM = re.compile(r'\w+')
+
+
+class FoldTable(dict):
+    """str.translate table that folds characters on first use."""
+    def __missing__(self, code):
+        decomposed = unicodedata.normalize('NFKD', chr(code))
+        folded = ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+        self[code] = folded
+        return folded
+
+
+_FOLD_TABLE = FoldTable()
+
+
+def fold(word):
+    """Bänk, BANK -> bank"""
+    if word.isascii():
+        return word.lower()
+    return word.translate(_FOLD_TABLE)
+
+
+def _common_prefix(a, b, limit):
+    i = 0
+    while i < limit and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class HeadwordIndex(object):
+    def __init__(self, words):
+        pairs = sorted({(fold(word), word) for word in words})
+        self._keys = [key for key, _ in pairs]
+        self._words = [word for _, word in pairs]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def folded(self, word):
+        """Headwords equal to word up to case and diacritics."""
+        key = fold(word)
+        i = bisect_left(self._keys, key)
+        result = []
+        while i < len(self._keys) and self._keys[i] == key:
+            result.append(self._words[i])
+            i += 1
+        return result
+
+    def prefix(self, prefix, limit=SUGGEST_LIMIT):
+        key = fold(prefix)
+        i = bisect_left(self._keys, key)
+        result = []
+        while i < len(self._keys) and len(result) < limit and self._keys[i].startswith(key):
+            result.append(self._words[i])
+            i += 1
+        return result
+
+    def fuzzy(self, word, max_distance=MAX_DISTANCE, limit=SUGGEST_LIMIT):
+        """
+        Headwords within max_distance edits of word, closest first, as
+        (distance, headword) pairs. Like most spell checkers it assumes the
+        first letter is right, that keeps the search to one subtree.
+        """
+        query = fold(word)
+        if not query:
+            return []
+        width = len(query) + 1
+        too_far = max_distance + 1
+        keys = self._keys
+        i = bisect_left(keys, query[0])
+        end = bisect_left(keys, query[0] + LAST_CHAR, i)
+        # rows[depth] is the Levenshtein row for key[:depth]; only cells
+        # within max_distance of the diagonal can end up small enough
+        rows = [[j if j <= max_distance else too_far for j in range(width)]]
+        previous = ''
+        found = []
+        while i < end:
+            key = keys[i]
+            depth = _common_prefix(key, previous, min(len(key), len(previous), len(rows) - 1))
+            del rows[depth + 1:]
+            previous = key
+            pruned = False
+            while depth < len(key):
+                last = rows[-1]
+                char = key[depth]
+                depth += 1
+                row = [too_far] * width
+                if depth <= max_distance:
+                    row[0] = depth
+                for j in range(max(1, depth - max_distance), min(width, depth + too_far)):
+                    row[j] = min(row[j - 1] + 1, last[j] + 1,
+                                 last[j - 1] + (query[j - 1] != char), too_far)
+                rows.append(row)
+                if min(row) > max_distance:
+                    # nothing that starts with key[:depth] can get any closer
+                    i = bisect_left(keys, key[:depth] + LAST_CHAR, i + 1, end)
+                    pruned = True
+                    break
+            if pruned:
+                continue
+            distance = rows[-1][-1]
+            if distance <= max_distance:
+                found.append((distance, abs(len(key) - len(query)), key, self._words[i]))
+            i += 1
+        found.sort()
+        return [(distance, word) for distance, _, _, word in found[:limit]]
+
+    def suggest(self, text, limit=SUGGEST_LIMIT):
+        """
+        Completions for what the user is typing: folded matches first, then
+        headwords starting with text, then headwords with typos in them.
+        """
+        text = text.strip()
+        if not text:
+            return []
+        result = self.folded(text)
+        result += self.prefix(text, limit)
+        if len(result) < limit:
+            # one typo is cheap to look for, only widen if there is nothing
+            close = self.fuzzy(text, 1, limit)
+            if not close and len(text) > SHORT_WORD:
+                close = self.fuzzy(text, MAX_DISTANCE, limit)
+            result += [word for _, word in close]
+        return list(dict.fromkeys(result))[:limit]
+
+
+def terms(text):
+    return RE_TERM.findall(fold(RE_TAG.sub(' ', text)))
+
+
+class ArticleIndex(object):
+    """Inverted index: word of an article body -> headwords of the article."""
+    def __init__(self, articles):
+        """articles is an iterable of (headword, raw article text)"""
+        self._headwords = []
+        self._postings = {}
+        for headword, article in articles:
+            doc = len(self._headwords)
+            self._headwords.append(headword)
+            for term in set(terms(article)):
+                self._postings.setdefault(term, []).append(doc)
+
+    def __len__(self):
+        return len(self._headwords)
+
+    def search(self, query, limit=SUGGEST_LIMIT):
+        """Headwords whose articles contain every word of query."""
+        postings = [self._postings.get(term, []) for term in set(terms(query))]
+        if not postings:
+            return []
+        postings.sort(key=len)
+        docs = set(postings[0])
+        for posting in postings[1:]:
+            docs.intersection_update(posting)
+            if not docs:
+                return []
+        return list(dict.fromkeys(self._headwords[doc] for doc in sorted(docs)))[:limit]
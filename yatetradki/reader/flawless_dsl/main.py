@@ -20,6 +20,7 @@
 
 import copy
 import re
+from functools import lru_cache
 
 from . import tag as _tag
 from . import layer as _layer
@@ -68,6 +69,8 @@ TEXT = 3
 
 BRACKET_L = '\0\1'
 BRACKET_R = '\0\2'
+TEXT_SLOT = '\0'
+SKELETON_CACHE_SIZE = 4096
 
 # precompiled regexs
 re_m_tag_with_content = re.compile(r'(\[m\d\])(.*?)(\[/m\])')
@@ -111,6 +114,11 @@ class FlawlessDSLParser(object):
             tag_open_re = r'\[%s%s\]' % (tag_re, ext_re)
             tags_.add((tag, tag_re, ext_re, tag_open_re))
         self.tags = frozenset(tags_)
+        # one regex for every known opening and closing tag, used by _tokenize
+        openings = '|'.join('%s%s' % (_[1], _[2]) for _ in self.tags)
+        closings = '|'.join(_[1] for _ in self.tags)
+        self._re_tag = re.compile(r'(?<!\\)\[(?:(?P<open>%s)|/(?P<close>%s))\]' % (openings, closings))
+        self._open_tags = {}
 
 
     def parse(self, line):
@@ -122,9 +130,27 @@ class FlawlessDSLParser(object):
 
         :rtype: str
         """
-        line = self.put_brackets_away(line)
-        line = self._parse(line)
-        return self.bring_brackets_back(line)
+        if '[' not in line:
+            return line
+        if TEXT_SLOT in line:
+            return self._tags_and_text_loop(self._tokenize(line))
+        # the result only depends on the sequence of tags, texts are carried
+        # along in order.  render the tags once with slots for the texts.
+        skeleton = []
+        texts = []
+        for item_t, item in self._tokenize(line):
+            if item_t is TEXT:
+                texts.append(item)
+                item = TEXT_SLOT
+            skeleton.append((item_t, item))
+        parts = _render_skeleton(tuple(skeleton)).split(TEXT_SLOT)
+        if len(parts) != len(texts) + 1:
+            return self._tags_and_text_loop(self._tokenize(line))
+        result = [parts[0]]
+        for text, part in zip(texts, parts[1:]):
+            result.append(text)
+            result.append(part)
+        return ''.join(result)
 
 
     def _parse(self, line):
@@ -133,6 +159,39 @@ class FlawlessDSLParser(object):
         return line
 
 
+    def _tokenize(self, line):
+        """
+        same items as put_brackets_away + _split_line_by_tags produce, but in
+        one scan: anything that is not a known tag stays in the text as is.
+        """
+        ptr = 0
+        for match in self._re_tag.finditer(line):
+            start = match.start()
+            if start > ptr:
+                yield TEXT, line[ptr:start]
+            opening = match.group('open')
+            if opening is None:
+                yield CLOSE, match.group('close')
+            else:
+                yield OPEN, self._open_tag(opening)
+            ptr = match.end()
+        if ptr < len(line):
+            yield TEXT, line[ptr:]
+
+
+    def _open_tag(self, opening):
+        tag = self._open_tags.get(opening)
+        if tag is None:
+            bracketed = '[%s]' % opening
+            for name, _, _, tag_open_re in self.tags:
+                if re.match(tag_open_re, bracketed):
+                    break
+            else:
+                name = opening
+            tag = self._open_tags[opening] = _tag.Tag(opening, name)
+        return tag
+
+
     def _split_line_by_tags(self, line):
         """
         split line into chunks, each chunk is whether opening / closing tag or text.
@@ -267,6 +326,11 @@ class FlawlessDSLParser(object):
         return line.replace(BRACKET_L, '[').replace(BRACKET_R, ']')
 
 
+@lru_cache(maxsize=SKELETON_CACHE_SIZE)
+def _render_skeleton(skeleton):
+    return FlawlessDSLParser._tags_and_text_loop(skeleton)
+
+
 def parse(line, tags=None):
     """parse DSL markup.
 
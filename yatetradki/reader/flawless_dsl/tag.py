@@ -39,12 +39,7 @@ def was_opened(stack, tag):
     :param tag: tag.Tag
     :return: bool
     """
-    if not len(stack):
-        return False
-    layer = stack[-1]
-    if tag in layer:
-        return True
-    return was_opened(stack[:-1], tag)
+    return any(tag in layer for layer in stack)
 
 
 predefined = ['m', '*', 'ex', 'i', 'c']
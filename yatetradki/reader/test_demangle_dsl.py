@@ -0,0 +1,58 @@
+import ast
+import json
+from os.path import dirname, join
+from tempfile import TemporaryDirectory
+
+from yatetradki.reader.demangle_dsl import _clean_tags, read
+
+
+HERE = dirname(__file__)
+
+
+def golden_cases():
+    with open(join(HERE, 'demangle_dsl_golden.json'), encoding='utf-8') as file_:
+        return json.load(file_)
+
+
+def flawless_test_lines():
+    """Every `before` line from the flawless_dsl test suite."""
+    with open(join(HERE, 'flawless_dsl', 'tests.py'), encoding='utf-8') as file_:
+        tree = ast.parse(file_.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant):
+            if any(getattr(target, 'id', None) == 'before' for target in node.targets):
+                yield node.value.value
+
+
+class Glossary:
+    def __init__(self):
+        self.info = {}
+        self.entries = []
+
+    def setInfo(self, key, value):
+        self.info[key] = value
+
+    def addEntry(self, words, text):
+        self.entries.append((words, text))
+
+
+class TestCleanTags:
+    def test_golden_output(self):
+        for case in golden_cases():
+            assert case['html'] == _clean_tags(case['line'], case['audio']), case['line']
+
+    def test_golden_covers_flawless_tests(self):
+        golden = {case['line'] for case in golden_cases()}
+        missing = [line for line in flawless_test_lines() if line not in golden]
+        assert [] == missing
+
+    def test_read_joins_tags_spanning_lines(self):
+        with TemporaryDirectory() as dir_:
+            fname = join(dir_, 'test.dsl')
+            with open(fname, 'w', encoding='utf-8') as file_:
+                file_.write('#NAME "Test"\n\nword\nword2\n\t[b]bold\n\tstill[/b]\nnext\n\t[i]x[/i]\n')
+            glos = Glossary()
+            read(glos, fname)
+        assert {'title': 'Test'} == glos.info
+        assert [(['word', 'word2'], '<div style="margin-left:1em"><b>boldstill</b></div>'),
+                (['next'], '<div style="margin-left:1em"><i>x</i></div>')] == glos.entries
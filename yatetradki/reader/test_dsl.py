@@ -1,8 +1,13 @@
 from unittest import TestCase
+from os import stat
 from os.path import join
+from pickle import dump as pickle_dump
 from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from unittest.mock import patch
 
 from yatetradki.reader.dsl import DSLRawReader, DSLIndexer, DSLLookuper
+from yatetradki.reader.dsl import DSLLibrary, HeadwordIndex, ArticleIndex
 from yatetradki.reader.dsl import _uniq_at
 
 
@@ -138,6 +143,113 @@ word22
             assert reader.dsl_indexer.get_pos(word) >= len(HEADER)
 
 
+class TestDslIndexFile:
+    def make(self, dir_, contents):
+        dsl_name = join(dir_, 'testdict.dsl')
+        index_name = join(dir_, 'testdict.dsl.index')
+        spit(contents, dsl_name, encoding='utf-8')
+        reader = DSLRawReader(dsl_name, encoding='utf-8', article_header='')
+        return DSLIndexer(index_name, reader), index_name
+
+    def test_reopen_does_not_rebuild(self):
+        contents = HEADER + '''
+word1
+	article1
+'''
+        with TemporaryDirectory() as dir_:
+            indexer, index_name = self.make(dir_, contents)
+            before = stat(index_name).st_mtime_ns
+            indexer = DSLIndexer(index_name, indexer_reader(dir_))
+            assert before == stat(index_name).st_mtime_ns
+            assert indexer.get_pos('word1') is not None
+
+    def test_rebuild_when_dsl_changes(self):
+        contents = HEADER + '''
+word1
+	article1
+'''
+        with TemporaryDirectory() as dir_:
+            indexer, index_name = self.make(dir_, contents)
+            assert indexer.get_pos('word2') is None
+            indexer, index_name = self.make(dir_, contents + '''word2
+	article2
+''')
+            assert 2 == len(indexer)
+            assert indexer.get_pos('word2') > indexer.get_pos('word1')
+
+    def test_rebuild_old_pickle_index(self):
+        with TemporaryDirectory() as dir_:
+            index_name = join(dir_, 'testdict.dsl.index')
+            with open(index_name, 'wb') as file_:
+                pickle_dump({'stale': 0}, file_)
+            indexer, _ = self.make(dir_, HEADER + '''
+word1
+	article1
+''')
+            assert indexer.get_pos('stale') is None
+            assert indexer.get_pos('word1') is not None
+
+    def test_unicode_headwords(self):
+        contents = HEADER + '''
+ære
+	honour
+zebra
+	zebra
+abc
+	abc
+'''
+        with TemporaryDirectory() as dir_:
+            indexer, _ = self.make(dir_, contents)
+            for word in ['ære', 'zebra', 'abc']:
+                assert indexer.get_pos(word) is not None
+            assert indexer.get_pos('ær') is None
+            assert indexer.get_pos('zzz') is None
+
+
+class TestDslRawReaderEncodings:
+    def read_all(self, contents, encoding, newline='\n'):
+        pairs = []
+        with TemporaryDirectory() as dir_:
+            dsl_name = join(dir_, 'testdict.dsl')
+            with open(dsl_name, 'w', encoding=encoding, newline=newline) as file_:
+                file_.write(contents)
+            reader = DSLRawReader(dsl_name, encoding=encoding, article_header='')
+            reader.read_header()
+            word, article = reader.get_next_word(convert=False)
+            while word is not None:
+                pairs.append((word, article))
+                word, article = reader.get_next_word(convert=False)
+        return pairs
+
+    def test_utf16_bom_and_crlf(self):
+        contents = HEADER + '''
+ære
+	heder
+слово
+	word
+'''
+        # empty article_header still adds a leading newline
+        expected = [('ære', '\n\theder\n'), ('слово', '\n\tword\n')]
+        assert expected == self.read_all(contents, 'utf-16')
+        assert expected == self.read_all(contents, 'utf-16', newline='\r\n')
+        assert expected == self.read_all(contents, 'utf-16-be')
+
+    def test_utf16_newline_byte_inside_character(self):
+        # U+0A00 is encoded as 00 0A in UTF-16-LE, next to a 0A 00 newline
+        contents = HEADER + '''
+w\u0a00
+	\u0a00\u0a00
+w2
+	a2
+'''
+        expected = [('w\u0a00', '\n\t\u0a00\u0a00\n'), ('w2', '\n\ta2\n')]
+        assert expected == self.read_all(contents, 'utf-16')
+
+
+def indexer_reader(dir_):
+    return DSLRawReader(join(dir_, 'testdict.dsl'), encoding='utf-8', article_header='')
+
+
 class TestIntegration(TestCase):
     def test_header_only(self):
         contents = '''#NAME   "Test"
@@ -278,6 +390,80 @@ word1
 #             ]
 #         )
 
+class TestDslLibrary:
+    def test_batch_lookup_is_memoized(self):
+        with TemporaryDirectory() as dir_, patch('yatetradki.reader.dsl.INDEX_DIR', dir_):
+            first, second = join(dir_, 'first.dsl'), join(dir_, 'second.dsl')
+            spit(HEADER + '\nword1\n\tarticle1\nword2\n\tarticle2\n', first, encoding='utf-16')
+            spit(HEADER + '\nword2\n\tsecond2\n', second, encoding='utf-16')
+            library = DSLLibrary([first, second])
+            found = library.lookup_words(['word1', ' word2', 'missing'])
+            assert [None, None] == [article for article, _ in found[2]]
+            assert 'article2' in found[1][0][0] and 'second2' in found[1][1][0]
+            assert found == library.lookup_words(['word1', 'word2', 'missing'])
+            assert [3, 3] == [stats['hits'] for stats in library.stats()]
+            assert 'article2' in library.lookup(['word2'])
+
+            spit(HEADER + '\nword3\n\tsecond3\n', second, encoding='utf-16')
+            assert 'second3' in library.lookup(['word3'])
+
+    def test_suggest_and_reverse(self):
+        with TemporaryDirectory() as dir_, patch('yatetradki.reader.dsl.INDEX_DIR', dir_):
+            first, second = join(dir_, 'first.dsl'), join(dir_, 'second.dsl')
+            spit(HEADER + '\nHund\n\t[trn]dog[/trn]\nhunden\n\tthe dog\n', first, encoding='utf-16')
+            spit(HEADER + '\nhus\n\thouse\n', second, encoding='utf-16')
+            library = DSLLibrary([first, second])
+            assert ['Hund', 'hunden'] == library.suggest('hund')
+            assert ['Hund'] == library.folded('HUND')
+            assert ['Hund', 'hunden'] == library.reverse('dog')
+
+    def test_lookup_while_headwords_are_indexed(self):
+        with TemporaryDirectory() as dir_, patch('yatetradki.reader.dsl.INDEX_DIR', dir_):
+            first = join(dir_, 'first.dsl')
+            spit(HEADER + '\nHund\n\tdog\nhus\n\thouse\n', first, encoding='utf-16')
+            library = DSLLibrary([first])
+            building, lookedup, waited = Event(), Event(), []
+
+            def index(words):
+                building.set()
+                waited.append(lookedup.wait(5)) # times out if the build holds the library lock
+                return HeadwordIndex(words)
+
+            with patch('yatetradki.reader.dsl.HeadwordIndex', index):
+                thread = Thread(target=library.suggest, args=('hu',))
+                thread.start()
+                assert building.wait(5)
+                assert 'house' in library.lookup(['hus'])
+                lookedup.set()
+                thread.join()
+            assert [True] == waited
+            assert ['Hund', 'hus'] == library.suggest('hu')
+
+    def test_lookup_while_articles_are_indexed(self):
+        with TemporaryDirectory() as dir_, patch('yatetradki.reader.dsl.INDEX_DIR', dir_):
+            first = join(dir_, 'first.dsl')
+            spit(HEADER + '\nHund\n\tdog\nhus\n\thouse\n', first, encoding='utf-16')
+            library = DSLLibrary([first])
+            building, lookedup, waited = Event(), Event(), []
+
+            def index(pairs):
+                pairs = iter(pairs)
+                first_pair = next(pairs) # the build is half way through the file
+                building.set()
+                waited.append(lookedup.wait(5)) # times out if the build holds the library lock
+                return ArticleIndex([first_pair] + list(pairs))
+
+            with patch('yatetradki.reader.dsl.ArticleIndex', index):
+                thread = Thread(target=library.reverse, args=('house',))
+                thread.start()
+                assert building.wait(5)
+                assert 'house' in library.lookup(['hus'])
+                lookedup.set()
+                thread.join()
+            assert [True] == waited
+            assert ['hus'] == library.reverse('house')
+
+
 class TestUtils:
     def uniq_at(self):
         all_words = ['a', 'b', 'c']
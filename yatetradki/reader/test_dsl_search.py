@@ -0,0 +1,64 @@
+from random import Random
+
+from yatetradki.reader.dsl_search import HeadwordIndex, ArticleIndex, fold
+
+
+def levenshtein(a, b):
+    row = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        last, row = row, [i]
+        for j, y in enumerate(b, 1):
+            row.append(min(row[j - 1] + 1, last[j] + 1, last[j - 1] + (x != y)))
+    return row[-1]
+
+
+WORDS = ['bank', 'Bank', 'banke', 'banker', 'bankerott', 'bånd', 'hund', 'hunden', 'Æsj', 'ære']
+
+
+class TestFold:
+    def test_case_and_diacritics(self):
+        assert 'bank' == fold('BANK')
+        assert 'band' == fold('bÅnd')
+        assert 'æsj' == fold('Æsj')
+        assert 'strasse' == fold('Straße')
+
+
+class TestHeadwordIndex:
+    def test_folded_and_prefix(self):
+        index = HeadwordIndex(WORDS)
+        assert ['Bank', 'bank'] == index.folded('BANK')
+        assert ['bånd'] == index.folded('band')
+        assert ['banke', 'banker', 'bankerott'] == index.prefix('banke')
+        assert ['ære'] == index.prefix('ÆR')
+
+    def test_fuzzy_matches_brute_force(self):
+        rng = Random(1)
+        words = {''.join(rng.choice('abcæ') for _ in range(rng.randint(1, 7))) for _ in range(500)}
+        index = HeadwordIndex(words)
+        for query in rng.sample(sorted(words), 20) + ['abca', 'cccccc', 'a']:
+            for max_distance in (1, 2):
+                expected = {word for word in words
+                            if word[0] == query[0] and levenshtein(word, query) <= max_distance}
+                found = index.fuzzy(query, max_distance, limit=len(words))
+                assert expected == {word for _, word in found}
+                assert all(levenshtein(word, query) == distance for distance, word in found)
+
+    def test_suggest_order(self):
+        index = HeadwordIndex(WORDS)
+        assert ['Bank', 'bank', 'banke', 'banker', 'bankerott', 'bånd'] == index.suggest('bank')
+        assert ['hund'] == index.suggest('hunt')
+        assert ['bankerott'] == index.suggest('bankerot')
+        assert [] == index.suggest(' ')
+
+
+class TestArticleIndex:
+    def test_search_all_terms(self):
+        index = ArticleIndex([
+            ('hund', '\t[m1][trn]dog, [i]hound[/i][/trn][/m]'),
+            ('bikkje', '\t[m1]dog ([c]coll.[/c])[/m]'),
+            ('katt', '\t[m1]cat[/m]'),
+        ])
+        assert ['hund', 'bikkje'] == index.search('Dog')
+        assert ['bikkje'] == index.search('dog coll')
+        assert [] == index.search('dog cat')
+        assert [] == index.search('trn')
@@ -3,10 +3,15 @@
 #
 # Use this simple bot to normalize & compress audio messages sent to the audio cards channel.
 #
+import asyncio
+import bisect
 import logging
-import subprocess
+import os
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
 from os import environ
-from os.path import expanduser, expandvars, exists
+from os.path import expanduser, expandvars, exists, join
 from tempfile import TemporaryDirectory
 
 from telegram import Bot, Update
@@ -17,6 +22,11 @@ logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
+CACHE = expanduser('~/.cache/compress-audio-bot') # <file_unique_id>.mp3
+CACHE_MAX_FILES = 1000
+MAX_JOBS = int(environ.get('COMPRESS_AUDIO_BOT_JOBS', os.cpu_count() or 2)) # ffmpeg processes at once
+BUCKETS = [1, 2, 5, 10, 30, 60, 120, 300] # seconds, upper bounds of the histogram buckets
+
 def load_env(filename):
     filename = expanduser(expandvars(filename))
     if not exists(filename):
@@ -28,20 +38,142 @@ def load_env(filename):
             key, value = line.strip().split('=', 1)
             environ[key] = value
 
-def compress(original, result: str):
+class Histogram:
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+
+    def __str__(self):
+        n = sum(self.counts)
+        labels = ['<={}s'.format(b) for b in BUCKETS] + ['>{}s'.format(BUCKETS[-1])]
+        buckets = ' '.join('{}:{}'.format(l, c) for l, c in zip(labels, self.counts) if c)
+        return '{} n={} avg={:.2f}s {}'.format(self.name, n, self.total / max(n, 1), buckets)
+
+class Transcoder:
+    """
+    Runs ffmpeg as asyncio subprocesses, at most max_jobs at once, so that
+    a long message does not hold up the other updates. Results are cached by
+    file_unique_id: a forwarded message is the same file and is encoded once,
+    also when the copies arrive while the first one is still being encoded.
+    """
+    def __init__(self, max_jobs=MAX_JOBS, cache=CACHE):
+        self.slots = asyncio.Semaphore(max_jobs)
+        self.cache = cache
+        self.pending = {} # file_unique_id -> task encoding it
+        self.using = Counter() # paths handlers are sending, kept out of prune
+        self.waiting = 0
+        self.running = 0
+        self.hits = 0
+        self.wait_times = Histogram('wait')
+        self.encode_times = Histogram('encode')
+        os.makedirs(cache, exist_ok=True)
+
+    def stats(self):
+        return 'waiting={} running={} pending={} cache_hits={}'.format(
+            self.waiting, self.running, len(self.pending), self.hits)
+
+    @asynccontextmanager
+    async def use(self, sound):
+        """Path of the compressed copy, which is not pruned until the block ends."""
+        path = await self.compressed(sound)
+        self.using[path] += 1
+        try:
+            yield path
+        finally:
+            self.using[path] -= 1
+            if not self.using[path]: del self.using[path]
+
+    async def compressed(self, sound):
+        """Path of the compressed copy of a telegram Audio or Voice."""
+        key = sound.file_unique_id
+        path = join(self.cache, key + '.mp3')
+        if exists(path):
+            self.hits += 1
+            os.utime(path)
+            logging.info('Cached %s, %s', key, self.stats())
+            return path
+        if key in self.pending:
+            self.hits += 1
+            logging.info('Already encoding %s, %s', key, self.stats())
+            return await asyncio.shield(self.pending[key])
+        task = asyncio.ensure_future(self.encode(sound, path))
+        self.pending[key] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task.done():
+                self.pending.pop(key, None)
+            else:
+                task.add_done_callback(lambda _: self.pending.pop(key, None))
+
+    async def encode(self, sound, path):
+        queued = time.monotonic()
+        self.waiting += 1
+        logging.info('Queued %s, %s', sound.file_unique_id, self.stats())
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        started = time.monotonic()
+        self.wait_times.add(started - queued)
+        try:
+            # in the cache, so that the result is renamed within one filesystem
+            with TemporaryDirectory(dir=self.cache, prefix='.encoding-') as tmpdir:
+                original = join(tmpdir, 'original')
+                file = await sound.get_file()
+                await file.download_to_drive(original)
+                result = join(tmpdir, 'compressed.mp3')
+                await compress(original, result)
+                os.replace(result, path)
+        finally:
+            self.running -= 1
+            self.slots.release()
+            self.encode_times.add(time.monotonic() - started)
+        logging.info('Encoded %s in %.2fs, %s', sound.file_unique_id, time.monotonic() - started, self.stats())
+        logging.info('Histograms: %s; %s', self.wait_times, self.encode_times)
+        self.prune()
+        return path
+
+    def prune(self):
+        files = [join(self.cache, name) for name in os.listdir(self.cache) if name.endswith('.mp3')]
+        if len(files) <= CACHE_MAX_FILES: return
+        keep = set(self.using) | {join(self.cache, key + '.mp3') for key in self.pending}
+        files.sort(key=os.path.getmtime)
+        for name in [name for name in files if name not in keep][:len(files) - CACHE_MAX_FILES]:
+            try: os.remove(name)
+            except OSError: pass
+
+async def compress(original, result: str):
     # cmd = ["ffmpeg", "-i", original,
     #     "-filter:a", "loudnorm,dynaudnorm,speechnorm,loudnorm",
     #     "-ac", "1", "-c:a", "libopus", "-b:a", "32k",
     #     "-vbr", "on", "-ar", "16000", "-compression_level", "10",
     #     "-f", "ogg",
     #     result]
-    cmd = ["ffmpeg", "-i", original,
+    cmd = ["ffmpeg", "-nostdin", "-i", original,
         "-filter:a", "loudnorm,dynaudnorm,speechnorm,loudnorm",
         "-ac", "1", "-c:a", "libmp3lame",
         # "-q:a", "9",
         result]
     logging.info('Running command: %s', ' '.join(cmd))
-    return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    try:
+        _, stderr = await proc.communicate()
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise RuntimeError('ffmpeg failed with {}: {}'.format(
+            proc.returncode, stderr.decode(errors='replace')[-2000:]))
 
 def append(base, extra): return base if extra.strip() in base else base + extra
 def buffer(base, extra): return '' if extra.strip() in base else extra
@@ -52,13 +184,8 @@ async def audio_handler(update: Update, context):
     yyyy = update.effective_message.date.strftime('%Y')
     yyyymm = update.effective_message.date.strftime('%Y%m')
     yyyymmdd = update.effective_message.date.strftime('%Y%m%d')
-    with TemporaryDirectory() as tmpdir:
-        sound = update.effective_message.audio or update.effective_message.voice
-        file = await sound.get_file()
-        base = tmpdir + "/" + ts #update.effective_message.voice.file_unique_id
-        await file.download_to_drive(base)
-        compressed = base + ".mp3"
-        compress(base, compressed)
+    sound = update.effective_message.audio or update.effective_message.voice
+    async with context.bot_data['transcoder'].use(sound) as compressed:
         with open(compressed, 'rb') as audio:
             caption_entities = update.effective_message.caption_entities or []
             caption = update.effective_message.caption or ''
@@ -76,10 +203,14 @@ async def audio_handler(update: Update, context):
                                          audio=audio, title=ts,
                                          caption=caption, caption_entities=caption_entities)
 
+async def post_init(app):
+    app.bot_data['transcoder'] = Transcoder()
+
 def main():
     load_env('~/.telegram')
     token = environ.get('TELEGRAM_COMPRESS_AUDIO_BOT_TOKEN')
-    app = ApplicationBuilder().token(token).build()
+    # handlers run concurrently, Transcoder limits how many of them encode at once
+    app = ApplicationBuilder().token(token).concurrent_updates(True).post_init(post_init).build()
     app.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, audio_handler))
     app.run_polling()
 
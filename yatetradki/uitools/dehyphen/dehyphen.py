@@ -1,8 +1,8 @@
 #!/bin/env python3
 
 from subprocess import run
-import re
-import sys
+
+from yatetradki.uitools.textmarksman.reflow import unwrap
 
 def slurp():
     return run('xsel', shell=True, capture_output=True).stdout.decode('utf-8')
@@ -13,20 +13,6 @@ def spit(text):
 def notify(title, message):
     run(['notify-send', title, message], check=True)
 
-def unwrap(text: str) -> str:
-    upper = "".join([chr(i) for i in range(sys.maxunicode) if chr(i).isupper()])
-    # remove trailing whitespace
-    text = re.sub(r'\s+$', '', text)
-    text = re.sub(r' +\n', '\n', text)
-    text = re.sub(r'\n +', '\n', text)
-    # join hyphen
-    text = re.sub(r'[-\u2014]\s*\u2029\s*', '', text)
-    expr = r'([^\.\n])\n(?![\n' + upper + '])'
-    text = re.sub(expr, r'\1 ', text)
-    # collapse spaces
-    text = re.sub(r'[ \t]+', ' ', text)
-    return text
-
 def main():
     text = slurp()
     text = unwrap(text)
@@ -6,7 +6,7 @@ import mimetypes
 import os
 import re
 import time
-from collections import Counter, defaultdict
+from collections import Counter
 from os import makedirs
 from os.path import abspath, basename, dirname, exists, join, splitext
 from pathlib import Path
@@ -18,6 +18,7 @@ from aiohttp import web
 from pydantic import BaseModel
 
 import pkg_resources
+from harken.index import CACHE_DIR, SEARCH_LIMIT, WATCH_INTERVAL, default_index_path, open_index
 ASSETS = pkg_resources.resource_filename('harken', 'assets')
 
 logging.basicConfig(level=logging.DEBUG)
@@ -27,6 +28,7 @@ MEDIA = ['.mp3', '.mp4', '.mkv', '.avi', '.webm', '.opus', '.ogg']
 SUBS = ['.vtt']
 # SUBS = ['.vtt', '.srt']
 MEDIA_DIR = './media'
+MAX_PAGE_SIZE = 500
 
 def slurp(path):
     logging.info(f"Slurping {path}")
@@ -47,15 +49,14 @@ def traverse(basedir):
         elif entry.is_file():
             yield entry
 
-def build_index():
-    docs = read_corpus(find(MEDIA_DIR, SUBS))
-    return Search().index(docs)
+def build_index(path=None):
+    return open_index(path or default_index_path([MEDIA_DIR]), read_lines, scan(), root=MEDIA_DIR)
 
 def with_extension(path: str, ext: str) -> str:
     return splitext(path)[0] + ext
 
-def search_index(index, q):
-    results = index.search(q)
+def search_index(index, q, page=1, size=SEARCH_LIMIT):
+    results, total = index.find(q, size, (page - 1) * size)
     out = []
     for doc in [index.get_document(result) for result in results]:
         sub = join(MEDIA_DIR, doc['filename'])
@@ -70,7 +71,7 @@ def search_index(index, q):
                     subtitle=doc['filename'],
                     media=with_extension(doc['filename'], ext)
                 ).dict())
-    return out
+    return out, total
 
 index = None
 
@@ -158,9 +159,16 @@ async def serve_index(request):
 async def search_content(request):
     q = request.query.get('q', '')
     if not q: return web.json_response({'error': 'q parameter is required'}, status=400)
+    try:
+        page = int(request.query.get('page', 1))
+        size = int(request.query.get('size', SEARCH_LIMIT))
+    except ValueError:
+        return web.json_response({'error': 'page and size must be integers'}, status=400)
+    if page < 1 or not 0 < size <= MAX_PAGE_SIZE:
+        return web.json_response({'error': f'page must be positive, size within 1..{MAX_PAGE_SIZE}'}, status=400)
 
-    documents = search_index(index, q)
-    return web.json_response({'results': documents})
+    documents, total = search_index(index, q, page, size)
+    return web.json_response({'results': documents, 'total': total, 'page': page, 'size': size})
 
 
 def find(where: str, types: Iterable[str]) -> List[str]:
@@ -180,68 +188,12 @@ def test_index():
     # results = index.search('bulke')
     # documents = [index.get_document(result) for result in results]
     # documents = search_index(build_index(), 'direkte')
-    documents = search_index(build_index(), 'peive')
+    documents, total = search_index(build_index(), 'peive')
     pprint(documents)
 
 def equals(a, b):
     assert a == b, f"{a} != {b}"
 
-class Search:
-    def trigrams(word): return [word[i:i+3] for i in range(len(word)-2)] or [word]
-    def __init__(self):
-        self.docs = {} # doc_id to doc mapping
-        self.plist = defaultdict(set) # term to doc_id mapping
-        self.trigram_index = defaultdict(set) # trigram to terms mapping
-    def index(self, documents):
-        t0 = time.time()
-        self.docs = {doc['id']: doc for doc in documents}
-        def tokenize(text): return re.findall(r'\b[a-zA-Z0-9åøæÅØÆ]+\b', text.lower())
-        for document in documents:
-            doc_id = document['id']
-            # title = document['title']
-            content = document['content']
-            for term in tokenize(content):
-                self.plist[term].add(doc_id)
-        for term in self.plist:
-            for trigram in Search.trigrams(term):
-                self.trigram_index[trigram].add(term)
-        logging.info(f"Index built in {time.time() - t0:.2f}s, {len(self.docs)} documents, {len(self.plist)} terms, {len(self.trigram_index)} trigrams")
-        return self
-    def search(self, query):
-        t0 = time.time()
-        query_words = query.lower().split()
-        if not query_words: return []
-        logging.info(f"Searching for '{query_words}'")
-        sets_of_words = [list(self._trigram_words(w)) for w in query_words]
-        if not sets_of_words: return []
-        logging.info(f'Words mapped to trigrams: {sets_of_words}')
-
-        # trigrams(word) map to many terms, so it's union between trigrams mapped to terms
-        # but since the query itself assumes AND, we intersect between sets of terms
-        result = self._search(sets_of_words[0], set.union)
-        logging.info(f'Result after first word: {result}')
-        for words in sets_of_words[1:]:
-            result = result.intersection(self._search(words, set.union))
-
-        logging.info(f"Search for '{query}' took {time.time() - t0:.2f}s, {len(result)} results")
-        return sorted(list(result))
-    def _trigram_words(self, query_word):
-        result = set()
-        for trigram in Search.trigrams(query_word):
-            for word in self.trigram_index[trigram]:
-                if query_word in word:
-                    result.add(word)
-        return result
-    def _search(self, query_words, set_combine):
-        if not query_words: return set()
-        result = self.plist[query_words[0]]
-        for word in query_words[1:]:
-            if word in self.plist:
-                result = set_combine(result, self.plist[word])
-        return result
-    def get_document(self, doc_id): return self.docs[doc_id]
-    def get_documents(self, doc_ids): return [self.get_document(doc_id) for doc_id in doc_ids]
-
 def parse_timestamp(s):
     """
     00:00:26,240
@@ -284,20 +236,11 @@ def parse_vtt(lines):
         _ = consume(next(lines), r'^$')
         yield Subtitle(start_time=start_str, end_time=end_str, text=text, offset=i)
 
-def read_corpus(filenames):
-    docs = []
-    doc_id = 0
-    for file in filenames:
-        start_doc_id = doc_id
-        for line in parse_subtitles(join(MEDIA_DIR, file)):
-            docs.append({
-                "id": doc_id,
-                "filename": f'{file}',
-                "content": line.text,
-                "offset": doc_id - start_doc_id,
-            })
-            doc_id += 1
-    return docs
+def read_lines(filename):
+    return [line.text for line in parse_subtitles(filename)]
+
+def scan():
+    return [(sub, None) for sub in find(MEDIA_DIR, SUBS)]
 
 def test_parse():
     srt = 'w/byday/20230904/by10m/by10m_03.srt'
@@ -308,8 +251,6 @@ def test_parse():
     pprint(lines)
 
 def test_search():
-    search = Search()
-
     # corpus = [
     #     {"id": 0, "title": "apple", "content": "Apples are normally found in the fruit section"},
     #     {"id": 1, "title": "banana", "content": "hånd bananas are Yellow"},
@@ -325,8 +266,7 @@ def test_search():
     # equals([3], search.transform("red"))
     # equals([3], search.transform("red ns"))
 
-    corpus = read_corpus(find(MEDIA_DIR, SUBS))
-    search.index(corpus)
+    search = build_index()
     # pprint(search.show(search.transform("smukke")))
     pprint(search.get_documents(search.search("porten")))
     # equals([1], search.transform("smukke"))
@@ -337,10 +277,13 @@ def main():
     global MEDIA_DIR
     parser = argparse.ArgumentParser()
     parser.add_argument('media', help='Media directory', default=MEDIA_DIR)
+    parser.add_argument('--index', help='Index file, by default one per media directory in ' + CACHE_DIR)
+    parser.add_argument('--watch', type=float, default=WATCH_INTERVAL, help='Seconds between rescans of the media directory, 0 to disable')
     args = parser.parse_args()
 
     MEDIA_DIR = args.media
-    index = build_index()
+    index = build_index(args.index)
+    if args.watch: index.watch(scan, args.watch)
 
     app = web.Application()
     app.router.add_get('/', serve_index)
@@ -10,7 +10,7 @@ import os
 import re
 import time
 from bisect import bisect_left
-from collections import defaultdict, namedtuple
+from collections import namedtuple
 from dataclasses import dataclass
 from inspect import isgenerator
 from os.path import exists, join, splitext
@@ -25,6 +25,8 @@ from nicegui.elements.input import Input
 from nicegui.events import KeyEventArguments
 from pydantic import BaseModel
 
+from harken.index import CACHE_DIR, WATCH_INTERVAL, default_index_path, open_index, parse_query
+
 ASSETS = './assets'
 logging.basicConfig(level=logging.DEBUG)
 logging.info(f"Starting harken. ASSETS={ASSETS}")
@@ -106,64 +108,6 @@ class SearchResult(BaseModel):
 
 def equals(a, b): assert a == b, f"{a} != {b}"
 
-class Search:
-    def trigrams(word): return [word[i:i+3] for i in range(len(word)-2)] or [word]
-    def __init__(self):
-        self.docs = {} # doc_id to doc mapping
-        self.plist = defaultdict(set) # term to doc_id mapping
-        self.trigram_index = defaultdict(set) # trigram to terms mapping
-    # def media(self, needle) -> [str]:
-        # return [doc['media'] for doc in self.docs.values() if needle in doc['media']]
-    def content(self, documents):
-        t0 = time.time()
-        self.docs.update({doc['id']: doc for doc in documents})
-        def tokenize(text): return re.findall(r'\b[a-zA-Z0-9åøæÅØÆ]+\b', text.lower())
-        for document in documents:
-            doc_id = document['id']
-            # title = document['title']
-            content = document['content']
-            for term in tokenize(content):
-                self.plist[term].add(doc_id)
-        for term in self.plist:
-            for trigram in Search.trigrams(term):
-                self.trigram_index[trigram].add(term)
-        logging.info(f"Index built in {time.time() - t0:.2f}s, {len(self.docs)} documents, {len(self.plist)} terms, {len(self.trigram_index)} trigrams")
-        return self
-    def search(self, query):
-        t0 = time.time()
-        query_words = query.lower().split()
-        if not query_words: return []
-        logging.info(f"Searching for '{query_words}'")
-        sets_of_words = [list(self._trigram_words(w)) for w in query_words]
-        if not sets_of_words: return []
-        logging.info(f'Words mapped to trigrams: {sets_of_words}')
-
-        # trigrams(word) map to many terms, so it's union between trigrams mapped to terms
-        # but since the query itself assumes AND, we intersect between sets of terms
-        result = self._search(sets_of_words[0], set.union)
-        logging.info(f'Result after first word: {result}')
-        for words in sets_of_words[1:]:
-            result = result.intersection(self._search(words, set.union))
-
-        logging.info(f"Search for '{query}' took {time.time() - t0:.2f}s, {len(result)} results")
-        return sorted(list(result))
-    def _trigram_words(self, query_word):
-        result = set()
-        for trigram in Search.trigrams(query_word):
-            for word in self.trigram_index[trigram]:
-                if query_word in word:
-                    result.add(word)
-        return result
-    def _search(self, query_words, set_combine):
-        if not query_words: return set()
-        result = self.plist[query_words[0]]
-        for word in query_words[1:]:
-            if word in self.plist:
-                result = set_combine(result, self.plist[word])
-        return result
-    def get_document(self, doc_id): return self.docs[doc_id]
-    def get_documents(self, doc_ids): return [self.get_document(doc_id) for doc_id in doc_ids]
-
 def consume(line, pattern, *parsers):
     matches = re.match(pattern, line)
     if not matches: raise ValueError(f"Pattern {pattern} did not match line {line}")
@@ -216,24 +160,11 @@ def find(where: str, subs: Iterable[str], medias: Iterable[str]) -> List[NamedPa
     result.sort(key=lambda x: x.media)
     return result
 
-class Corpus:
-    def __init__(self):
-        self.doc_id = 0
-    def read(self, filenames: List[NamedPair]):
-        docs = []
-        for file in filenames:
-            start_doc_id = self.doc_id
-            for line in parse_subtitles(file.sub):
-                docs.append({
-                    "id": self.doc_id,
-                    "sub": f'{file.sub}',
-                    "media": f'{file.media}',
-                    "content": line.text,
-                    "offset": self.doc_id - start_doc_id,
-                })
-                self.doc_id += 1
-        logging.info(f"Read {len(docs)} documents from {len(filenames)} files")
-        return docs
+def scan(dirs: Iterable[str]) -> List[NamedPair]:
+    return [pair for media_dir in dirs for pair in find(media_dir, SUBS, MEDIA)]
+
+def read_lines(filename) -> List[str]:
+    return [line.text for line in parse_subtitles(filename)]
 
 def test_parse():
     srt = 'w/byday/20230904/by10m/by10m_03.srt'
@@ -249,8 +180,6 @@ def test_vtt():
     pprint(lines)
 
 def test_search():
-    search = Search()
-
     # corpus = [
     #     {"id": 0, "title": "apple", "content": "Apples are normally found in the fruit section"},
     #     {"id": 1, "title": "banana", "content": "hånd bananas are Yellow"},
@@ -266,9 +195,7 @@ def test_search():
     # equals([3], search.transform("red"))
     # equals([3], search.transform("red ns"))
 
-    corp = Corpus()
-    corpus = corp.read(find(MEDIA_DIR, SUBS))
-    search.content(corpus)
+    search = open_index(default_index_path([MEDIA_DIR]), read_lines, find(MEDIA_DIR, SUBS, MEDIA))
     # pprint(search.show(search.transform("smukke")))
     pprint(search.get_documents(search.search("porten")))
     # equals([1], search.transform("smukke"))
@@ -338,16 +265,10 @@ class UiState:
     commands: [Callable]
 
 def create_ui(args):
-    search = Search()
-    corp = Corpus()
-    files: List[NamedPair] = []
+    files: List[NamedPair] = scan(args.dirs)
     for media_dir in args.dirs:
-        logging.info(f"Indexing {media_dir}")
-        batch = find(media_dir, SUBS, MEDIA)
-        files.extend(batch)
-        corpus = corp.read(batch)
-        search.content(corpus)
         app.add_media_files(media_dir, Path(media_dir))
+    search = open_index(args.index or default_index_path(args.dirs), read_lines, files)
 
     state = UiState(
         files=sorted(list(set(files)), key=lambda x: x.media),
@@ -365,6 +286,11 @@ def create_ui(args):
     )
     logging.info(f"Media files: {len(files)}")
 
+    def on_files_changed(pairs: List[NamedPair]):
+        state.files = sorted(set(pairs), key=lambda x: x.media)
+        state.media2file = {m.media: m for m in pairs}
+    if args.watch: search.watch(lambda: scan(args.dirs), args.watch, on_files_changed)
+
     def load_media(media: str, offset: int = -1):
         file = state.media2file[media]
         state.subtitles.clear()
@@ -414,15 +340,17 @@ def create_ui(args):
     @ui.refreshable
     def redraw_search(query=None):
         if not query: return
-        ids = search.search(query)[0:10]
+        ids = search.search(query, 10)
         docs = search.get_documents(ids) # content, id, media, offset, sub
+        phrases, words = parse_query(query)
+        highlight = '|'.join(re.escape(w) for w in [' '.join(p) for p in phrases] + words) or '$^'
         # with ui.scroll_area().classes('border w-full h-80'):
         with ui.column().classes('border w-full'):
             for doc in docs:
                 print('doc', doc)
                 on_click = lambda doc=doc: load_media(doc['media'], doc['offset'])
                 content = doc['content']
-                content = re.sub(rf'({query})', r'<b>\1</b>', content, flags=re.IGNORECASE)
+                content = re.sub(rf'({highlight})', r'<b>\1</b>', content, flags=re.IGNORECASE)
                 ui.html(content).classes('pl-4 hover:outline-1 hover:outline-dashed').on('click', on_click)
     def on_search(e):
         nonlocal state
@@ -526,7 +454,7 @@ k -- Focus on search field
         with ui.row().classes('w-full'):
             with ui.column().classes('border w-4/12'):
                 with ui.scroll_area().classes('border w-full h-80'):
-                    for f in files:
+                    for f in state.files:
                         on_click = lambda f=f: load_media(f.media)
                         classes = 'hover:underline cursor-pointer'
                         if f == state.current_file: classes += ' active'
@@ -552,6 +480,8 @@ k -- Focus on search field
 def main(reload=False):
     parser = argparse.ArgumentParser()
     parser.add_argument('dirs', nargs='+', help='Media directories, can be several')
+    parser.add_argument('--index', help='Index file, by default one per set of directories in ' + CACHE_DIR)
+    parser.add_argument('--watch', type=float, default=WATCH_INTERVAL, help='Seconds between rescans of the directories, 0 to disable')
     args = parser.parse_args()
     logging.info(f"Args: {args}")
     # app.on_startup(lambda: create_ui(args,))
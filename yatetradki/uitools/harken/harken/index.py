@@ -0,0 +1,560 @@
+"""
+Subtitle search index that survives restarts.
+
+The index is saved to a single file: a JSON header with every indexed
+subtitle file (path, mtime, size and the doc ids of its lines), the line
+texts and their lengths in words, the sorted terms and, per term, the doc
+ids it occurs in as a delta-encoded array. The body is zlib compressed,
+loading it is a decompress plus one array per term. Parsing subtitles is
+what takes the time, so on start only files whose mtime or size changed are
+parsed again.
+
+Doc ids only grow: the lines of a new or changed file get fresh ids at the
+end, which keeps postings sorted when appended to, and since the lines of a
+file have consecutive ids, dropping a file is one slice per term. It also
+means that the next line of a file is the next doc id.
+
+Search is an AND of clauses. A word matches every term it is a part of, a
+"quoted phrase" must appear as is, either within a line or continuing on
+the next one. Clauses are intersected starting from the rarest one by
+galloping through the sorted postings, matches are ranked with BM25 and
+only the requested page is scored in full. Lines where a phrase only
+continues on the next line come after the lines that have it as is.
+
+    python -m harken.index --lines 1000000
+"""
+
+import heapq
+import json
+import logging
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from hashlib import sha1
+from itertools import accumulate, chain, compress
+from math import log
+from operator import sub as minus
+from os.path import abspath, dirname, exists, expanduser, join
+from threading import Lock, Thread
+from typing import Callable, List, Optional
+
+MAGIC = b'HARKEN-INDEX-2\n'
+SECTIONS = struct.Struct('<6Q') # byte sizes of header, texts, lengths, terms, counts, deltas
+CACHE_DIR = expanduser('~/.cache/harken')
+WATCH_INTERVAL = 30.0 # seconds between rescans of the media directories
+RX_TERM = re.compile(r'\b[a-zA-Z0-9åøæÅØÆ]+\b')
+RX_QUERY = re.compile(r'"([^"]*)"|(\S+)')
+
+SEARCH_LIMIT = 50
+EXPANSIONS = 4096 # query words whose matching terms are remembered
+# gallop when one posting is this many times longer than the other, below
+# that a set intersection in C beats probing from Python
+GALLOP = 40
+K1 = 1.2
+B = 0.75
+PARTIAL = 0.5 # weight of a term that the query word is only a part of
+PHRASE = 2.0 # weight of a phrase found within one line
+ACROSS = 1.5 # weight of a phrase that continues on the next line
+
+def tokenize(text): return RX_TERM.findall(text.lower())
+def trigrams(word): return [word[i:i+3] for i in range(len(word)-2)] or [word]
+
+def default_index_path(dirs):
+    key = '\0'.join(sorted(abspath(d) for d in dirs))
+    return join(CACHE_DIR, f'index-{sha1(key.encode()).hexdigest()[:12]}.bin')
+
+def parse_query(query):
+    """'"god morgen" alle' -> ([['god', 'morgen']], ['alle'])"""
+    phrases, words = [], []
+    for phrase, word in RX_QUERY.findall(query):
+        if phrase: phrases.append(tokenize(phrase))
+        else: words.extend(tokenize(word))
+    return [p for p in phrases if p], list(dict.fromkeys(words))
+
+def gallop(a, x, lo=0):
+    """First i >= lo with a[i] >= x, probes ahead in doubling steps before bisecting."""
+    n = len(a)
+    hi = lo
+    step = 1
+    while hi < n and a[hi] < x:
+        lo = hi + 1
+        hi += step
+        step <<= 1
+    return bisect_left(a, x, lo, min(hi, n))
+
+def intersect(a, b):
+    """Sorted ids found in both a and b."""
+    if len(a) > len(b): a, b = b, a
+    if len(b) < GALLOP * len(a):
+        return array('I', sorted(set(a).intersection(b)))
+    out = array('I')
+    i, n = 0, len(b)
+    for x in a:
+        i = gallop(b, x, i)
+        if i == n: break
+        if b[i] == x: out.append(x)
+    return out
+
+def union(postings):
+    if len(postings) == 1: return postings[0]
+    return array('I', sorted(set().union(*postings)))
+
+def contains(a, x):
+    i = bisect_left(a, x)
+    return i < len(a) and a[i] == x
+
+def has_phrase(tokens, phrase):
+    n = len(phrase)
+    i = -1
+    try:
+        while True:
+            i = tokens.index(phrase[0], i + 1)
+            if tokens[i:i+n] == phrase: return True
+    except ValueError:
+        return False
+
+def crosses(head, tail, phrase):
+    """Whether phrase starts at the end of head and continues at the start of tail."""
+    return any(head[len(head)-k:] == phrase[:k] and tail[:len(phrase)-k] == phrase[k:]
+               for k in range(1, min(len(phrase), len(head) + 1)))
+
+@dataclass
+class IndexedFile:
+    sub: str
+    media: Optional[str]
+    mtime: int
+    size: int
+    first: int # doc id of the first line, the rest follow
+    lines: List[str]
+
+@dataclass
+class Clause:
+    """One part of a query: the docs it allows and how much it scores in each of them."""
+    df: int # number of docs with it, for idf
+    best: float # the highest weight it can give
+    weight: Callable[[int], float]
+    docs: Optional[array] = None # matching docs when known up front
+    terms: Optional[List[str]] = None # terms to probe otherwise
+    cost: int = 0
+    weak: Optional[Callable[[int], bool]] = None # whether it only matches a doc across lines
+
+class SubtitleIndex:
+    def __init__(self, path, read_lines: Callable[[str], List[str]], root=''):
+        """
+        path is where the index is saved, read_lines(filename) parses one
+        subtitle file into its lines of text, subtitle names are relative
+        to root.
+        """
+        self.path = path
+        self.read_lines = read_lines
+        self.root = root
+        self.lock = Lock()
+        self._reset()
+
+    def _reset(self):
+        self.files = {} # sub -> IndexedFile
+        self.firsts = [] # first doc ids of self.order, ascending
+        self.order = [] # subs in the order of their doc ids
+        self.next_id = 0
+        self.plist = {} # term -> sorted array of doc ids
+        self.trigram_index = defaultdict(set) # trigram -> terms, may hold dropped terms
+        self.lengths = array('H') # doc id -> number of words in the line
+        self.size = 0 # number of lines
+        self.words = 0 # number of words in them
+        self.expansions = {} # query word -> terms that contain it
+
+    def __len__(self): return self.size
+
+    def _add(self, file: IndexedFile):
+        self.files[file.sub] = file
+        self.firsts.append(file.first)
+        self.order.append(file.sub)
+        for offset, text in enumerate(file.lines):
+            doc_id = file.first + offset
+            tokens = tokenize(text)
+            self.lengths.append(min(len(tokens), 0xffff))
+            self.words += len(tokens)
+            for term in set(tokens):
+                posting = self.plist.get(term)
+                if posting is None:
+                    posting = self.plist[term] = array('I')
+                    for trigram in trigrams(term): self.trigram_index[trigram].add(term)
+                posting.append(doc_id)
+        self.size += len(file.lines)
+        self.expansions.clear()
+
+    def _remove(self, sub):
+        file = self.files.pop(sub)
+        i = bisect_left(self.firsts, file.first)
+        del self.firsts[i]
+        del self.order[i]
+        end = file.first + len(file.lines)
+        for term in set(chain.from_iterable(map(tokenize, file.lines))):
+            posting = self.plist[term]
+            del posting[bisect_left(posting, file.first):bisect_left(posting, end)]
+            if not posting: del self.plist[term]
+        self.size -= len(file.lines)
+        self.words -= sum(self.lengths[file.first:end])
+        self.expansions.clear()
+
+    def update(self, pairs):
+        """
+        Brings the index in line with pairs of (subtitle, media) names:
+        parses new and changed subtitles, drops the ones that are gone.
+        Returns the number of files that changed.
+        """
+        wanted = dict(pairs)
+        stale = []
+        with self.lock:
+            gone = [sub for sub in self.files if sub not in wanted]
+            for sub, media in wanted.items():
+                try: st = os.stat(join(self.root, sub))
+                except OSError: continue
+                known = self.files.get(sub)
+                if known and (known.mtime, known.size) == (st.st_mtime_ns, st.st_size):
+                    known.media = media
+                else:
+                    stale.append((sub, media, st))
+        parsed = []
+        for sub, media, st in stale:
+            try: parsed.append((sub, media, st, [line.replace('\n', ' ') for line in self.read_lines(join(self.root, sub))]))
+            except (OSError, ValueError, RuntimeError) as e:
+                # most likely still being written, it'll be retried on the next scan
+                logging.warning(f"Skipping {sub}: {e!r}")
+        with self.lock:
+            for sub in gone: self._remove(sub)
+            for sub, media, st, lines in parsed:
+                if sub in self.files: self._remove(sub)
+                self._add(IndexedFile(sub, media, st.st_mtime_ns, st.st_size, self.next_id, lines))
+                self.next_id += len(lines)
+        if gone or parsed:
+            logging.info(f"Index updated: {len(parsed)} files parsed, {len(gone)} dropped, {len(self)} documents, {len(self.plist)} terms")
+        return len(gone) + len(parsed)
+
+    def save(self):
+        t0 = time.time()
+        with self.lock:
+            files = [self.files[sub] for sub in self.order]
+            terms = sorted(self.plist)
+            counts = array('I', [len(self.plist[term]) for term in terms])
+            deltas = array('I')
+            for term in terms:
+                posting = self.plist[term]
+                deltas.extend(map(minus, posting, chain((0,), posting)))
+            lengths = array('H')
+            for f in files: lengths.extend(self.lengths[f.first:f.first+len(f.lines)])
+            header = {
+                'byteorder': sys.byteorder,
+                'next_id': self.next_id,
+                'files': [[f.sub, f.media, f.mtime, f.size, f.first, len(f.lines)] for f in files],
+            }
+            texts = '\n'.join(chain.from_iterable(f.lines for f in files))
+        sections = [json.dumps(header).encode(), texts.encode(), lengths.tobytes(),
+                    '\n'.join(terms).encode(), counts.tobytes(), deltas.tobytes()]
+        os.makedirs(dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(SECTIONS.pack(*map(len, sections)))
+            f.write(zlib.compress(b''.join(sections), 1))
+        os.replace(tmp, self.path)
+        logging.info(f"Index saved to {self.path} in {time.time() - t0:.2f}s, {os.path.getsize(self.path)} bytes")
+
+    def load(self):
+        """Reads the saved index if there is one, returns whether it did."""
+        if not exists(self.path): return False
+        t0 = time.time()
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                logging.warning(f"Ignoring {self.path}: unknown format")
+                return False
+            sizes = SECTIONS.unpack(f.read(SECTIONS.size))
+            body = zlib.decompress(f.read())
+        sections = []
+        pos = 0
+        for size in sizes:
+            sections.append(body[pos:pos+size])
+            pos += size
+        header = json.loads(sections[0])
+        texts = sections[1].decode().split('\n')
+        terms = sections[3].decode().split('\n') if sections[3] else []
+        lengths, counts, deltas = array('H'), array('I'), array('I')
+        lengths.frombytes(sections[2])
+        counts.frombytes(sections[4])
+        deltas.frombytes(sections[5])
+        if header['byteorder'] != sys.byteorder:
+            for a in (lengths, counts, deltas): a.byteswap()
+        with self.lock:
+            self._reset()
+            self.next_id = header['next_id']
+            self.lengths = array('H', bytes(2 * self.next_id))
+            pos = 0
+            for sub, media, mtime, size, first, count in header['files']:
+                file = IndexedFile(sub, media, mtime, size, first, texts[pos:pos+count])
+                self.files[sub] = file
+                self.firsts.append(first)
+                self.order.append(sub)
+                self.lengths[first:first+count] = lengths[pos:pos+count]
+                pos += count
+            self.size = pos
+            self.words = sum(lengths)
+            pos = 0
+            for term, count in zip(terms, counts):
+                self.plist[term] = array('I', accumulate(deltas[pos:pos+count]))
+                for trigram in trigrams(term): self.trigram_index[trigram].add(term)
+                pos += count
+        logging.info(f"Index loaded from {self.path} in {time.time() - t0:.2f}s, {len(self)} documents, {len(self.plist)} terms")
+        return True
+
+    def watch(self, scan: Callable[[], list], interval=WATCH_INTERVAL, on_change=None):
+        """
+        Rescans every interval seconds in a background thread, scan()
+        returns the current (subtitle, media) pairs. Changes are saved and
+        reported to on_change(pairs).
+        """
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    pairs = scan()
+                    if self.update(pairs):
+                        self.save()
+                        if on_change: on_change(pairs)
+                except Exception:
+                    logging.exception('Index watcher failed')
+        Thread(target=loop, name='harken-index-watcher', daemon=True).start()
+
+    def search(self, query, limit=SEARCH_LIMIT, offset=0):
+        """Doc ids of the best matches, best first."""
+        return self.find(query, limit, offset)[0]
+
+    def find(self, query, limit=SEARCH_LIMIT, offset=0):
+        """Returns a page of ranked doc ids and the total number of matches."""
+        t0 = time.time()
+        phrases, words = parse_query(query)
+        if not phrases and not words: return [], 0
+        with self.lock:
+            clauses = [self._phrase_clause(p) for p in phrases] + [self._word_clause(w) for w in words]
+            clauses.sort(key=lambda c: c.cost)
+            docs = self._match(clauses)
+            page = self._rank(docs, clauses, offset + limit)[offset:]
+        logging.info(f"Search for '{query}' took {time.time() - t0:.3f}s, {len(docs)} results")
+        return page, len(docs)
+
+    def _expand(self, word):
+        """Terms that contain word: the ones that have all of its trigrams, checked."""
+        terms = self.expansions.get(word)
+        if terms is None:
+            candidates = sorted((self.trigram_index.get(t, ()) for t in set(trigrams(word))), key=len)
+            found = set(candidates[0]).intersection(*candidates[1:])
+            terms = [term for term in found if word in term and term in self.plist]
+            if len(self.expansions) >= EXPANSIONS: self.expansions.clear()
+            self.expansions[word] = terms
+        return terms
+
+    def _word_clause(self, word):
+        terms = self._expand(word)
+        exact = self.plist.get(word)
+        cost = sum(len(self.plist[t]) for t in terms)
+        if terms == [word]: weight = lambda d: 1.0
+        elif exact: weight = lambda d: 1.0 if contains(exact, d) else PARTIAL
+        else: weight = lambda d: PARTIAL
+        return Clause(df=min(cost, self.size), best=1.0 if exact else PARTIAL, weight=weight,
+                      terms=terms, cost=cost)
+
+    def _phrase_clause(self, phrase):
+        within, across = self._phrase(phrase)
+        docs = union([within, across]) if across else within
+        weight = lambda d: PHRASE if contains(within, d) else ACROSS
+        weak = (lambda d: not contains(within, d)) if across else None
+        return Clause(df=len(docs), best=PHRASE if within else ACROSS, weight=weight,
+                      docs=docs, cost=len(docs), weak=weak)
+
+    def _phrase(self, phrase):
+        """Lines with the phrase, and lines where it starts and goes on in the next line."""
+        postings = [self.plist.get(t) for t in phrase]
+        if not all(postings): return array('I'), array('I')
+        docs = postings[0]
+        for posting in sorted(postings, key=len)[1:]:
+            docs = intersect(docs, posting)
+        within = array('I', [d for d in docs if has_phrase(tokenize(self._text(d)), phrase)])
+        across = array('I')
+        if len(phrase) > 1:
+            last = postings[-1]
+            before_last = array('I', map((-1).__add__, last[1:] if last[0] == 0 else last))
+            for d in intersect(postings[0], before_last):
+                file, offset = self._locate(d)
+                if offset + 1 < len(file.lines) and \
+                        crosses(tokenize(file.lines[offset]), tokenize(file.lines[offset + 1]), phrase):
+                    across.append(d)
+        return within, across
+
+    def _match(self, clauses):
+        """Docs that satisfy every clause, clauses come cheapest first."""
+        docs = None
+        for clause in clauses:
+            if clause.docs is not None:
+                docs = clause.docs if docs is None else intersect(docs, clause.docs)
+            elif docs is None or clause.cost <= len(docs) * len(clause.terms):
+                # cheaper to merge the postings than to probe each of them
+                merged = union([self.plist[t] for t in clause.terms]) if clause.terms else array('I')
+                docs = merged if docs is None else intersect(docs, merged)
+            else:
+                hits = set()
+                for term in clause.terms: hits.update(intersect(docs, self.plist[term]))
+                docs = array('I', sorted(hits))
+            if not docs: break
+        return docs
+
+    def _rank(self, docs, clauses, k):
+        """
+        Best k docs. Docs are grouped by the number of phrases they only
+        match across lines, fewer first, and ranked by BM25 within a group:
+        length normalization alone would put a one word line that a phrase
+        continues from above a longer line with the whole phrase.
+        """
+        if k <= 0: return []
+        weak = [c.weak for c in clauses if c.weak]
+        if not weak: return self._bm25(docs, clauses, k)
+        groups = defaultdict(lambda: array('I'))
+        for d in docs: groups[sum(w(d) for w in weak)].append(d)
+        ranked = []
+        for group in sorted(groups):
+            ranked += self._bm25(groups[group], clauses, k - len(ranked))
+            if len(ranked) >= k: break
+        return ranked
+
+    def _bm25(self, docs, clauses, k):
+        """
+        Best k docs by BM25. A line scores more the shorter it is, so lines
+        are scored in the order of their length until no longer line can get
+        into the top k.
+        """
+        n = max(self.size, 1)
+        average = max(self.words / n, 1.0)
+        idfs = [log(1 + (n - c.df + 0.5) / (c.df + 0.5)) for c in clauses]
+        lengths = list(map(self.lengths.__getitem__, docs))
+        top = [] # (score, -doc) heap of the best k
+        for length in sorted(Counter(lengths)):
+            norm = K1 * (1 - B + B * length / average)
+            bound = sum(idf * c.best * (K1 + 1) / (c.best + norm) for idf, c in zip(idfs, clauses))
+            if len(top) >= k and top[0][0] >= bound: break
+            for d in compress(docs, map(length.__eq__, lengths)):
+                if len(top) >= k and top[0][0] >= bound: break # the rest of this length can't do better
+                score = 0.0
+                for idf, clause in zip(idfs, clauses):
+                    w = clause.weight(d)
+                    score += idf * w * (K1 + 1) / (w + norm)
+                if len(top) < k: heapq.heappush(top, (score, -d))
+                elif (score, -d) > top[0]: heapq.heapreplace(top, (score, -d))
+        return [-d for _, d in sorted(top, reverse=True)]
+
+    def _locate(self, doc_id):
+        file = self.files[self.order[bisect_right(self.firsts, doc_id) - 1]]
+        return file, doc_id - file.first
+
+    def _text(self, doc_id):
+        file, offset = self._locate(doc_id)
+        return file.lines[offset]
+
+    def get_document(self, doc_id):
+        with self.lock:
+            file, offset = self._locate(doc_id)
+        return {
+            'id': doc_id,
+            'filename': file.sub,
+            'sub': file.sub,
+            'media': file.media,
+            'content': file.lines[offset],
+            'offset': offset,
+        }
+    def get_documents(self, doc_ids): return [self.get_document(doc_id) for doc_id in doc_ids]
+
+def open_index(path, read_lines, pairs, root=''):
+    """Loads the saved index, catches up with pairs and saves it if anything changed."""
+    index = SubtitleIndex(path, read_lines, root)
+    try: index.load()
+    except Exception:
+        logging.exception(f"Could not load {path}, rebuilding")
+        index = SubtitleIndex(path, read_lines, root)
+    if index.update(pairs) or not exists(path): index.save()
+    return index
+
+def synthetic_lines(count, vocabulary=50000, seed=0):
+    """Subtitle-like lines of 3 to 12 words, Zipf distributed like speech."""
+    import random
+    rnd = random.Random(seed)
+    letters = 'abcdefghijklmnoprstuvyåøæ'
+    words = list(dict.fromkeys(''.join(rnd.choices(letters, k=rnd.randint(1, 10))) for _ in range(vocabulary)))
+    weights = list(accumulate(1 / (rank + 1) for rank in range(len(words))))
+    return words, [' '.join(rnd.choices(words, cum_weights=weights, k=rnd.randint(3, 12))) for _ in range(count)]
+
+def benchmark(index, queries, repeat=3):
+    """Returns (query, matches, best seconds for the first page) for every query."""
+    result = []
+    for query in queries:
+        best = None
+        for _ in range(repeat):
+            index.expansions.clear()
+            t0 = time.perf_counter()
+            _, total = index.find(query, 20)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        result.append((query, total, best))
+    return result
+
+def main():
+    """
+    python -m harken.index [--lines 1000000] [--repeat 3]
+
+    Indexes synthetic subtitles, saves and loads them and prints how long
+    typical queries take for the first page of results.
+    """
+    from argparse import ArgumentParser
+    from tempfile import TemporaryDirectory
+    parser = ArgumentParser(description='Measure subtitle search on a synthetic corpus')
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--per-file', type=int, default=400)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    t0 = time.perf_counter()
+    words, lines = synthetic_lines(args.lines)
+    print(f'generated {len(lines)} lines in {time.perf_counter() - t0:.1f}s')
+    with TemporaryDirectory() as tmp:
+        index = SubtitleIndex(join(tmp, 'index.bin'), None)
+        t0 = time.perf_counter()
+        for i in range(0, len(lines), args.per_file):
+            chunk = lines[i:i+args.per_file]
+            index._add(IndexedFile(f'{i // args.per_file:06d}.vtt', None, 0, 0, index.next_id, chunk))
+            index.next_id += len(chunk)
+        print(f'indexed in {time.perf_counter() - t0:.1f}s, {len(index.plist)} terms')
+        t0 = time.perf_counter()
+        index.save()
+        print(f'saved in {time.perf_counter() - t0:.1f}s, {os.path.getsize(index.path) / 1e6:.1f} MB')
+        t0 = time.perf_counter()
+        index.load()
+        print(f'loaded in {time.perf_counter() - t0:.1f}s')
+    first, second = lines[1].split()[:2], lines[2].split()
+    queries = [
+        words[0], # the most common word
+        words[len(words) // 2], # a rare one
+        words[3][:2], # short words only match themselves
+        words[1][:3], # a part of many terms
+        words[10] + ' ' + words[50],
+        f'"{first[0]} {first[1]}"',
+        f'"{lines[1].split()[-1]} {second[0]}"', # across two lines
+    ]
+    for query, total, seconds in benchmark(index, queries, args.repeat):
+        print(f'{seconds * 1000:8.1f} ms {total:8d} matches  {query}')
+
+if __name__ == '__main__':
+    main()
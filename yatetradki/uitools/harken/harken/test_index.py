@@ -0,0 +1,113 @@
+from os.path import join
+from tempfile import TemporaryDirectory
+
+# harken.py next to this file would shadow the harken package
+from index import SubtitleIndex
+
+
+def spit(root, name, lines):
+    with open(join(root, name), 'w') as file_:
+        file_.write('\n'.join(lines))
+
+
+class Reader:
+    def __init__(self):
+        self.parsed = []
+
+    def __call__(self, filename):
+        self.parsed.append(filename)
+        with open(filename) as file_:
+            return file_.read().splitlines()
+
+
+def make_index(root, files):
+    for name, lines in files.items():
+        spit(root, name, lines)
+    index = SubtitleIndex(join(root, 'index.bin'), Reader(), root)
+    index.update([(name, name + '.mp3') for name in files])
+    return index
+
+
+def texts(index, query, limit=10, offset=0):
+    return [doc['content'] for doc in index.get_documents(index.search(query, limit, offset))]
+
+
+class TestPersistence:
+    def test_save_load_round_trip(self):
+        with TemporaryDirectory() as root:
+            index = make_index(root, {
+                'a.vtt': ['god morgen alle sammen', 'hvor er hunden'],
+                'b.vtt': ['hunden sover', 'god natt'],
+            })
+            index.save()
+            loaded = SubtitleIndex(index.path, Reader(), root)
+            assert loaded.load()
+            assert index.plist == loaded.plist
+            assert index.lengths == loaded.lengths
+            assert (index.size, index.words, index.next_id) == (loaded.size, loaded.words, loaded.next_id)
+            assert texts(index, 'hund') == texts(loaded, 'hund')
+            assert 'b.vtt.mp3' == loaded.get_document(3)['media']
+
+    def test_missing_file(self):
+        with TemporaryDirectory() as root:
+            assert not SubtitleIndex(join(root, 'index.bin'), Reader(), root).load()
+
+
+class TestUpdate:
+    def test_only_changed_files_are_parsed(self):
+        with TemporaryDirectory() as root:
+            index = make_index(root, {'a.vtt': ['god morgen'], 'b.vtt': ['hunden sover'], 'c.vtt': ['katten']})
+            index.read_lines = reader = Reader()
+            spit(root, 'b.vtt', ['hunden sover ikke lenger'])
+            assert 2 == index.update([('a.vtt', None), ('b.vtt', None)])
+            assert [join(root, 'b.vtt')] == reader.parsed
+            assert ['hunden sover ikke lenger'] == texts(index, 'hunden')
+            assert [] == texts(index, 'sover ikke lenger katten')
+            assert [] == index.search('katten')
+            assert 'katten' not in index.plist
+            assert 2 == len(index)
+            assert 0 == index.update([('a.vtt', None), ('b.vtt', None)])
+
+    def test_removed_then_loaded(self):
+        with TemporaryDirectory() as root:
+            index = make_index(root, {'a.vtt': ['god morgen', 'god dag'], 'b.vtt': ['god kveld']})
+            index.update([('b.vtt', None)])
+            index.save()
+            loaded = SubtitleIndex(index.path, Reader(), root)
+            loaded.load()
+            assert ['god kveld'] == texts(loaded, 'god')
+
+
+class TestRanking:
+    def test_shorter_lines_first(self):
+        with TemporaryDirectory() as root:
+            index = make_index(root, {'a.vtt': ['en stor hund i hagen', 'hund', 'stor hund']})
+            assert ['hund', 'stor hund', 'en stor hund i hagen'] == texts(index, 'hund')
+
+    def test_whole_word_before_part_of_word(self):
+        with TemporaryDirectory() as root:
+            index = make_index(root, {'a.vtt': ['hunden min', 'stor hund']})
+            assert ['stor hund', 'hunden min'] == texts(index, 'hund')
+
+    def test_all_words_are_required(self):
+        with TemporaryDirectory() as root:
+            index = make_index(root, {'a.vtt': ['god morgen', 'god natt', 'morgen kaffe']})
+            assert ['god morgen'] == texts(index, 'morgen god')
+
+    def test_phrase_within_line_before_across_lines(self):
+        with TemporaryDirectory() as root:
+            index = make_index(root, {
+                'a.vtt': ['god', 'morgen', 'morgen god'],
+                'b.vtt': ['god morgen alle sammen'],
+            })
+            assert ['god morgen alle sammen', 'god'] == texts(index, '"god morgen"')
+            assert ['god'] == texts(index, '"god morgen"', 1, 1)
+            assert 2 == index.find('"god morgen"')[1]
+
+    def test_paging(self):
+        with TemporaryDirectory() as root:
+            index = make_index(root, {'a.vtt': ['hund ' * n for n in range(1, 8)]})
+            first, total = index.find('hund', 3)
+            second, _ = index.find('hund', 3, 3)
+            assert 7 == total
+            assert 6 == len(set(first + second))
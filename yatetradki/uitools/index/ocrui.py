@@ -25,11 +25,11 @@ from PyQt5.QtWidgets import QSlider
 from PyQt5.QtWidgets import QVBoxLayout
 from PyQt5.QtWidgets import QWidget
 from tesserocr import PSM
-from tesserocr import PyTessBaseAPI
 from tesserocr import RIL
 from tesserocr import get_languages
 
 from weight import get_pil_image_weight
+from yatetradki.uitools.textmarksman.engines import ENGINES
 
 FORMAT = '%(asctime)-15s %(levelname)s %(message)s'
 logging.basicConfig(format=FORMAT, level=logging.DEBUG)
@@ -50,9 +50,7 @@ def by_key(pairs, key):
 
 
 def pil_image_to_qpixmap(image):
-    filename = '/tmp/ocrui-image.png'
-    image.save(filename)
-    return QPixmap(filename)
+    return QPixmap.fromImage(ImageQt(image))
 
 @dataclass
 class Box:
@@ -107,6 +105,7 @@ class Menu(QMainWindow):
         self.psm = PSM.AUTO
         self.ril = RIL.WORD
         self.boxes = []
+        self.results = {} # (lang, psm, ril) -> boxes, the image does not change
 
         def set_lang(action):
             logging.info('lang={}'.format(action.text()))
@@ -224,11 +223,14 @@ class Menu(QMainWindow):
 
         # From the second initialization, both arguments will be valid
         if numpy_image is not None and snip_number is not None:
+            self.image = Image.fromarray(numpy_image[:, :, ::-1]) # BGR, like the pixmap
             self.background = self.convert_numpy_img_to_qpixmap(numpy_image)
             self.change_and_set_title("Snip #{0}".format(snip_number))
         else:
             self.background_filename = "page1.jpg"
             self.overlay_filename = "overlay.png"
+            self.image = Image.open(self.background_filename)
+            self.image.load()
             self.background = QPixmap(self.background_filename)
             self.change_and_set_title(Menu.default_title)
 
@@ -247,9 +249,14 @@ class Menu(QMainWindow):
 
     def run_ocr(self):
         logging.info('Running OCR: lang={}, psm={}, ril={}'.format(self.lang, self.psm, self.ril))
-        with PyTessBaseAPI(lang=self.lang, psm=self.psm) as api:
-            # api.SetImage(self.image)
-            api.SetImageFile(self.background_filename)
+        key = (self.lang, self.psm, self.ril)
+        if key in self.results:
+            self.boxes = self.results[key]
+            self.update_layers()
+            self.update()
+            return
+        with ENGINES.tesseract(self.lang, self.psm) as api:
+            api.SetImage(self.image)
             # mode_dir = ensure_dir('out{}'.format(mode))
             components = api.GetComponentImages(self.ril, True)
             print('components', len(components))
@@ -266,6 +273,7 @@ class Menu(QMainWindow):
                 self.boxes.append(Box(x, y, x + w, y + h, weight, text))
 
         self.boxes.sort(key=lambda box: box.weight)
+        self.results[key] = self.boxes
         self.update_layers()
         self.update()
         logging.info('OCR finished')
@@ -279,17 +287,17 @@ class Menu(QMainWindow):
         logging.info('min=%s, max=%s, delta=%s, threshold=%s', boxes[0].weight, boxes[-1].weight, delta, threshold)
 
         weights = []
-        with Image.open(self.background_filename) as orig:
-            draw = ImageDraw.Draw(orig)
-            for box in boxes:
-                weights.append(box.weight)
-                if box.weight < threshold:
-                    continue
-                draw.rectangle((box.x1, box.y1, box.x2, box.y2), outline='red')
-                # im.save('{}/{:05d}.png'.format(mode_dir, i))
-            # orig.save(self.overlay_filename)
-            # self.background = QPixmap(self.overlay_filename)
-            self.background = pil_image_to_qpixmap(orig)
+        orig = self.image.copy()
+        draw = ImageDraw.Draw(orig)
+        for box in boxes:
+            weights.append(box.weight)
+            if box.weight < threshold:
+                continue
+            draw.rectangle((box.x1, box.y1, box.x2, box.y2), outline='red')
+            # im.save('{}/{:05d}.png'.format(mode_dir, i))
+        # orig.save(self.overlay_filename)
+        # self.background = QPixmap(self.overlay_filename)
+        self.background = pil_image_to_qpixmap(orig)
         y, x = np.histogram(weights, bins=np.linspace(boxes[0].weight, boxes[-1].weight, 50))
         self.histogram_widget.plot(x, y, clear=True, stepMode="center", fillLevel=0, fillOutline=True, brush=(0, 0, 255, 150))
         self.histogram_widget.plot([threshold, threshold], [0, max(y)], brush=(255, 0, 0, 255))
@@ -1,6 +1,7 @@
 import re
 import csv
 from bisect import bisect_left
+from functools import lru_cache
 from json import loads
 from os.path import dirname
 from os.path import join
@@ -10,6 +11,8 @@ import icu
 
 NOR_INDEX_PATH = join(dirname(__file__), 'index-nor.csv')
 RUS_INDEX_PATH = join(dirname(__file__), 'index-rus.csv')
+INDEX_PATHS = {'nor': NOR_INDEX_PATH, 'rus': RUS_INDEX_PATH}
+LOCALES = {'nor': 'nb_NO', 'rus': 'ru_RU'}
 
 def http_get(url):
     with urlopen(url) as r:
@@ -19,14 +22,13 @@ def reference(word):
     url = 'http://norsk.dicts.aulismedia.com/processnorsk.php?search={}'.format(word)
     return loads(http_get(url).decode('utf-8'))
 
-def less_equal(a, b):
-    collator = icu.Collator.createInstance(icu.Locale('nb_NO.UTF-8'))
+@lru_cache(maxsize=None)
+def collator(locale='nb_NO'):
+    return icu.Collator.createInstance(icu.Locale(locale))
 
-    def key(x):
-        return collator.getSortKey(x)
-
-    s = sorted([a, b], key=key)
-    return s[0] == a
+def less_equal(a, b, locale='nb_NO'):
+    key = collator(locale).getSortKey
+    return key(a) <= key(b)
 
 SETTINGS = {
     'nor': {
@@ -42,15 +44,33 @@ SETTINGS = {
 def has_cyrillic(text):
     return bool(re.search('[\u0400-\u04FF]', text))
 
+def page_number(filename):
+    return int(''.join([c for c in filename if c.isdigit()]))
+
+class PageIndex:
+    """
+    Pages of a scanned dictionary (e.g. nor1396.jpg: vaker..vakthavende),
+    with ICU sort keys of the last word on every page, so that finding the
+    page of a word is a single bisect in the order of the dictionary
+    language (æ, ø, å come after z in Norwegian).
+    """
+    def __init__(self, path, locale):
+        self.key = collator(locale).getSortKey
+        self.pages = sorted(read_index(path).items())
+        self.last_keys = [self.key(right) for _, (_, right) in self.pages]
+
+    def find(self, query):
+        """Returns the filename of the first page that ends with query or later."""
+        index = bisect_left(self.last_keys, self.key(query))
+        return self.pages[min(index, len(self.pages) - 1)][0]
+
+@lru_cache(maxsize=None)
+def page_index(lang):
+    return PageIndex(INDEX_PATHS[lang], LOCALES[lang])
+
 def search(query):
-    path = RUS_INDEX_PATH if has_cyrillic(query) else NOR_INDEX_PATH
     lang = 'rus' if has_cyrillic(query) else 'nor'
-    index = read_index(path)
-    pages = sorted(index.items())
-    values = [x[1][1] for x in pages]
-    index = bisect_left(values, query, lo=0, hi=len(values))
-    my = pages[index]  # e.g.: ('nor1396.jpg', ['vaker', 'vakthavende'])
-    page = int(''.join([c for c in my[0] if c.isdigit()]))
+    page = page_number(page_index(lang).find(query))
     return {
         'lastpage': SETTINGS[lang]['lastpage'],
         'firstpage': SETTINGS[lang]['firstpage'],
@@ -66,19 +86,23 @@ def test_search(query):
     print('my = ', my)
     print('ref = ', ref)
 
-def verify(path):
+def verify(path, locale='nb_NO'):
     index = read_index(path)
     print(len(index))
     pages = sorted(index.items())
-    for i, (key, (left, right)) in enumerate(pages):
+    key = collator(locale).getSortKey
+    keys = [(key(left.lower()), key(right.lower())) for _, (left, right) in pages]
+    for i, (name, (left, right)) in enumerate(pages):
         left, right = left.lower(), right.lower()
-        assert less_equal(left, right), '{}: left <= right: {} <= {}'.format(key, left, right)
+        kleft, kright = keys[i]
+        assert kleft <= kright, '{}: left <= right: {} <= {}'.format(name, left, right)
         if i > 0:
             pleft, pright = pages[i - 1][1]
-            assert less_equal(pleft, left), '{}: pleft <= left: {} <= {}'.format(key, pleft, left)
-            assert less_equal(pright, left), '{}: pright <= left: {} <= {}'.format(key, pright, left)
-            assert less_equal(pleft, right), '{}: pleft <= right: {} <= {}'.format(key, pleft, right)
-            assert less_equal(pright, right), '{}: pright <= right: {} <= {}'.format(key, pright, right)
+            kpleft, kpright = keys[i - 1]
+            assert kpleft <= kleft, '{}: pleft <= left: {} <= {}'.format(name, pleft, left)
+            assert kpright <= kleft, '{}: pright <= left: {} <= {}'.format(name, pright, left)
+            assert kpleft <= kright, '{}: pleft <= right: {} <= {}'.format(name, pleft, right)
+            assert kpright <= kright, '{}: pright <= right: {} <= {}'.format(name, pright, right)
     print('OK')
 
 def read_index(path):
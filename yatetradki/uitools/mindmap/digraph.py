@@ -28,17 +28,14 @@ DONE: argument for presets: small, large, etc
 import re
 import sys
 from shutil import which
-from plumbum import BG
-from plumbum.cmd import bash, xclip, plantuml
+from plumbum.cmd import xclip
 from argparse import ArgumentParser
 from html2text import HTML2Text
 import webbrowser
 from textwrap import wrap
 from bs4 import BeautifulSoup
 
-PUML = '/tmp/digraph.puml'
-SVG = '/tmp/digraph.svg'
-PNG = '/tmp/digraph.png'
+import puml
 
 def chrome_binary():
     candidates = [
@@ -451,6 +448,7 @@ def extra(start):
 """.format(start)
 
 def render(text, preset, start):
+    """Returns paths to the rendered diagram: {'puml': ..., 'svg': ..., 'png': ...}"""
     max_width = 18
     text = dense(as_text(text))
     lines = Line.from_text(text)
@@ -461,12 +459,7 @@ def render(text, preset, start):
     head = HEADER + base() + preset + extra(start)
     output = head + colorize(lines) + "\n" + connections(lines) + FOOTER
     print(output)
-
-    spit(PUML, output)
-    a = bash[must_bin('plantuml'), PUML, '-tsvg', '-o', '/tmp'] & BG
-    b = bash[must_bin('plantuml'), PUML, '-tpng', '-o', '/tmp'] & BG
-    a.wait()
-    b.wait()
+    return puml.render(output)
 
 def main():
     must_bin("xclip", "Install xclip to use this script.")
@@ -494,9 +487,9 @@ def main():
     #     spit(PUML, output)
     #     bash[must_bin('plantuml'), PUML, '-tsvg', '-o', '/tmp']()
     #     bash[must_bin('plantuml'), PUML, '-tpng', '-o', '/tmp']()
-    render(text, footer(args.preset), args.start)
-    print("Mindmap saved to {}".format(SVG), file=sys.stderr)
-    open_in_browser(SVG)
+    paths = render(text, footer(args.preset), args.start)
+    print("Mindmap saved to {}".format(paths['svg']), file=sys.stderr)
+    open_in_browser(paths['svg'])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -14,15 +14,12 @@ file, and opens the SVG in Chrome.
 """
 import sys
 from shutil import which
-from plumbum import BG
-from plumbum.cmd import xclip, plantuml
+from plumbum.cmd import xclip
 from argparse import ArgumentParser
 from html2text import HTML2Text
 import webbrowser
 
-PUML = '/tmp/mindmap.puml'
-PNG = '/tmp/mindmap.png'
-SVG = '/tmp/mindmap.svg'
+import puml
 
 def chrome_binary():
     canditates = [
@@ -179,6 +176,7 @@ def markdown(lines):
     return '\n'.join(output)
 
 def render(text):
+    """Returns paths to the rendered mindmap: {'puml': ..., 'svg': ..., 'png': ...}"""
     text = dense(as_text(text))
     lines = Line.from_text(text)
     lines = colors(lines)
@@ -186,12 +184,7 @@ def render(text):
 
     output = HEADER + markdown(lines) + FOOTER
     print(output)
-
-    spit(PUML, output)
-    a = plantuml[PUML, '-tsvg', '-o', '/tmp'] & BG
-    b = plantuml[PUML, '-tpng', '-o', '/tmp'] & BG
-    a.wait()
-    b.wait()
+    return puml.render(output)
 
 def main():    
     must_bin("xclip", "Install xclip to use this script.")
@@ -214,9 +207,9 @@ def main():
     # if args.input is None:
     #     spit(PUML, output)
     #     plantuml[PUML, '-tsvg', '-o', '/tmp']()
-    render(args.input)
-    print("Mindmap saved to {}".format(SVG), file=sys.stderr)
-    open_in_browser(SVG)
+    paths = render(text)
+    print("Mindmap saved to {}".format(paths['svg']), file=sys.stderr)
+    open_in_browser(paths['svg'])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
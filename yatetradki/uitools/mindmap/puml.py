@@ -0,0 +1,92 @@
+"""
+PlantUML rendering through long-lived workers, with a cache of the results.
+
+Starting plantuml costs a JVM cold start, so each output format gets one
+`plantuml -pipe` process that is kept running: a diagram is written to its
+stdin and the image is read back up to the delimiter line. A worker that
+dies is started again on the next render.
+
+Results are cached by a hash of the PlantUML source (which includes the
+preset), in files named after that hash, so the same diagram is only
+rendered once and concurrent renders of different diagrams never share a
+file.
+"""
+import atexit
+import hashlib
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists, expanduser, join
+from shutil import which
+
+CACHE_DIR = expanduser('~/.cache/mindmap')
+FORMATS = ('svg', 'png')
+DELIMITER = b'___MINDMAP_RENDER_END___'
+
+class Worker:
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.proc = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        binary = which('plantuml')
+        if binary is None:
+            raise RuntimeError('plantuml is not installed')
+        self.proc = subprocess.Popen(
+            [binary, '-pipe', '-t' + self.fmt, '-charset', 'UTF-8', '-pipedelimitor', DELIMITER.decode()],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def render(self, source):
+        with self.lock:
+            if self.proc is None or self.proc.poll() is not None:
+                self.start()
+            try:
+                self.proc.stdin.write(source.encode() + b'\n')
+                self.proc.stdin.flush()
+                # the delimiter follows the image right away, png does not end with a newline
+                data = b''
+                while not data.endswith(DELIMITER + b'\n'):
+                    line = self.proc.stdout.readline()
+                    if not line:
+                        raise RuntimeError('plantuml -t{} exited with code {}'.format(self.fmt, self.proc.wait()))
+                    data += line
+            except (OSError, RuntimeError):
+                self.stop()
+                raise
+            return data[:-len(DELIMITER) - 1]
+
+    def stop(self):
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+WORKERS = {fmt: Worker(fmt) for fmt in FORMATS}
+POOL = ThreadPoolExecutor(len(FORMATS), thread_name_prefix='plantuml')
+
+@atexit.register
+def stop():
+    for worker in WORKERS.values():
+        worker.stop()
+
+def spit_bytes(filename, data):
+    # write next to the target and rename, readers never see a partial file
+    tmp = '{}.{}.tmp'.format(filename, threading.get_ident())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, filename)
+
+def render(source):
+    """Renders the diagram in every format, returns {'puml': path, 'svg': path, 'png': path}."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    key = hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+    paths = {ext: join(CACHE_DIR, '{}.{}'.format(key, ext)) for ext in ('puml',) + FORMATS}
+    if not exists(paths['puml']):
+        spit_bytes(paths['puml'], source.encode())
+    missing = [fmt for fmt in FORMATS if not exists(paths[fmt])]
+    futures = [(fmt, POOL.submit(WORKERS[fmt].render, source)) for fmt in missing]
+    for fmt, future in futures:
+        spit_bytes(paths[fmt], future.result())
+    return paths
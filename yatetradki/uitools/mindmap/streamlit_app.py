@@ -3,14 +3,8 @@ from enum import Enum
 
 import streamlit as st
 
-from digraph import PUML as PUML_DIGRAPH
-from digraph import SVG as SVG_DIGRAPH
-from digraph import PNG as PNG_DIGRAPH
 from digraph import render as render_digraph
 from digraph import slurp
-from mindmap import PUML as PUML_MINDMAP
-from mindmap import SVG as SVG_MINDMAP
-from mindmap import PNG as PNG_MINDMAP
 from mindmap import render as render_mindmap
 
 # TODO: control edge.len
@@ -101,27 +95,22 @@ with left:
 with button_digraph:
     if st.button('Digraph'):
         state.type = Type.digraph.value
-        render_digraph(state.input, settings(preset), start)
+        state.paths = render_digraph(state.input, settings(preset), start)
 with button_mindmap:
     if st.button('Mindmap'):
         state.type = Type.mindmap.value
-        render_mindmap(state.input)
+        state.paths = render_mindmap(state.input)
 
 puml = ''
 with right:
     png, svg = st.tabs(['PNG', 'SVG'])
-    if state.type == Type.digraph.value:
+    # paths of this session's last render, other sessions have their own
+    if 'paths' in state:
         with png:
-            st.image(PNG_DIGRAPH)
+            st.image(state.paths['png'])
         with svg:
-            st.image(SVG_DIGRAPH)
-        puml = slurp(PUML_DIGRAPH)
-    elif state.type == Type.mindmap.value:
-        with png:
-            st.image(PNG_MINDMAP)
-        with svg:
-            st.image(SVG_MINDMAP)
-        puml = slurp(PUML_MINDMAP)
+            st.image(state.paths['svg'])
+        puml = slurp(state.paths['puml'])
 
 st.divider()
 st.text(puml)
@@ -1,8 +1,10 @@
 import asyncio
 import json
 import logging
+import os
 import re
 import shutil
+import time
 from asyncio import TimeoutError as AsyncioTimeoutError
 from asyncio import create_subprocess_shell
 from asyncio import new_event_loop
@@ -10,9 +12,11 @@ from bisect import bisect_right
 from contextlib import asynccontextmanager
 from datetime import datetime
 from glob import glob
+from itertools import count
 from itertools import groupby
 from os import environ
 from os import makedirs
+from os.path import basename
 from os.path import dirname
 from os.path import exists
 from os.path import expanduser
@@ -38,6 +42,8 @@ def expand(path):
 
 CACHE_DIR = expand('~/.cache/nrkup')
 BASE = expand('~/payload/video/nrkup/nordland')
+STAGE_WORKERS = {'download': 2, 'audio': 2, 'upload': 1} # episodes in each stage at a time
+COMPAND = ['compand', '0.3,1', '6:-70,-60,-20', '-5', '-90', '0.2']
 
 async def async_http_get(url, timeout=10.0):
     async def request():
@@ -73,6 +79,49 @@ async def async_run(args):
         raise Exception(stderr.decode())
 
 
+async def async_pipe(*commands):
+    """
+    async_run for a pipeline: stdout of every command goes to stdin of the
+    next one. When a command fails the others are killed, a stuck one would
+    otherwise keep the pipeline waiting.
+    """
+    logging.info('Running: %s', ' | '.join(' '.join(quote(x) for x in args) for args in commands))
+    procs = []
+
+    def kill():
+        for proc in procs:
+            if proc.returncode is None:
+                try: proc.kill()
+                except ProcessLookupError: pass
+
+    async def wait(proc):
+        _, stderr = await proc.communicate()
+        if proc.returncode != 0: kill()
+        return stderr
+
+    try:
+        stdin = None
+        for i, args in enumerate(commands):
+            read, write = os.pipe() if i < len(commands) - 1 else (None, asyncio.subprocess.DEVNULL)
+            try:
+                procs.append(await asyncio.create_subprocess_exec(*args, stdin=stdin, stdout=write, stderr=asyncio.subprocess.PIPE))
+            except BaseException:
+                if read is not None: os.close(read)
+                raise
+            finally:
+                # the children have their own copies of the pipe ends
+                if stdin is not None: os.close(stdin)
+                if read is not None: os.close(write)
+            stdin = read
+        results = await asyncio.gather(*(wait(proc) for proc in procs))
+    except BaseException:
+        kill()
+        raise
+    errors = [stderr.decode() for proc, stderr in zip(procs, results) if proc.returncode != 0]
+    if errors:
+        raise Exception('\n'.join(error for error in errors if error.strip()) or 'Pipeline failed')
+
+
 def which(program):
     paths = [None, '/usr/local/bin', '/usr/bin', '/bin', '~/bin', '~/.local/bin']
     for path in paths:
@@ -130,6 +179,22 @@ async def sox_compress_dynamic_range(input, output):
     #await async_run(['sox', input, output, 'compand', '0.02,0.20', '5:-60,-40,-10', '-5', '-90', '0.1'])
 
 
+async def ffmpeg_sox_compress(video, audio):
+    """
+    ffmpeg_extract_audio followed by sox_compress_dynamic_range twice, as
+    one pipe without the intermediate files. The result appears under its
+    name only when it is complete.
+    """
+    logging.info('extracting audio and compressing dynamic range %s, %s', video, audio)
+    part = join(dirname(audio), 'part-' + basename(audio))
+    try:
+        await async_pipe([which('ffmpeg'), '-nostdin', '-v', 'error', '-i', video, '-map', 'a', '-f', 'sox', '-'],
+                         [which('sox'), '-t', 'sox', '-', part] + COMPAND + COMPAND)
+        os.replace(part, audio)
+    finally:
+        if exists(part): os.remove(part)
+
+
 async def sox_remove_silence(input, output):
     logging.info('removing silence %s, %s', input, output)
     await async_run([which('sox'), input, output, '-l', '1', '0.1', '1%', '-1', '1.0', '1%'])
@@ -290,6 +355,54 @@ async def fetch_nrk_metadata(dkno):
     return json.loads(await async_http_get(url))
 
 
+STAGES = {} # stage name -> asyncio.Semaphore
+JOB_IDS = count(1)
+
+class Job:
+    """An episode going through the stages: what it is doing now and how long each stage took."""
+    def __init__(self, url):
+        self.id = next(JOB_IDS)
+        self.url = url
+        self.state = 'queued'
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.timings = {} # stage -> {'wait': seconds, 'run': seconds}
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    @asynccontextmanager
+    async def stage(self, name):
+        if name not in STAGES: STAGES[name] = asyncio.Semaphore(STAGE_WORKERS[name])
+        self.state = 'waiting for ' + name
+        queued = time.monotonic()
+        async with STAGES[name]:
+            started = time.monotonic()
+            self.state = name
+            try:
+                yield
+            finally:
+                self.timings[name] = {'wait': round(started - queued, 3), 'run': round(time.monotonic() - started, 3)}
+
+    def finish(self, error=None):
+        self.state = 'failed' if error else 'done'
+        self.error = str(error) if error else None
+        self.finished = time.time()
+
+    def as_json(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'state': self.state,
+            'error': self.error,
+            'created': self.created,
+            'finished': self.finished,
+            'timings': self.timings,
+        }
+
+
 def non_empty_file(path):
     return isfile(path) and getsize(path) > 0
 
@@ -360,26 +473,18 @@ class Episode:
         data = await self.metadata()
         return [IndexPoint.from_json(x) for x in data['preplay']['indexPoints']]
 
-    async def mp3(self):
-        # if exists(self.audio):
-        #     return self.audio
-        await self.metadata()
-        video = find_first(self.base + '/**/*.m4v')
-        if not video:
-            await ui_notify('NRKUP', 'nwkdownload: Downloading video: ' + self.title)
-            video = await nrk_download(self.url, self.base)
-        orig_audio = join(self.base, 'orig-' + self.name)
-        if not exists(orig_audio):
-            await ui_notify('NRKUP', 'ffmpeg: Extracting audio: ' + self.title)
-            await ffmpeg_extract_audio(video, orig_audio)
-        nosilence_audio = join(self.base, 'nosilence-' + self.name)
-        if not exists(nosilence_audio):
-            await ui_notify('NRKUP', 'sox: removing silence: ' + self.title)
-            await sox_compress_dynamic_range(orig_audio, nosilence_audio)
+    async def mp3(self, job=None):
+        job = job or Job(self.url)
+        async with job.stage('download'):
+            await self.metadata()
+            video = find_first(self.base + '/**/*.m4v')
+            if not video and not exists(self.audio):
+                await ui_notify('NRKUP', 'nwkdownload: Downloading video: ' + self.title)
+                video = await nrk_download(self.url, self.base)
         if not exists(self.audio):
-            await ui_notify('NRKUP', 'sox: compressing dynamic range: ' + self.title)
-            await sox_compress_dynamic_range(nosilence_audio, self.audio)
-
+            async with job.stage('audio'):
+                await ui_notify('NRKUP', 'ffmpeg | sox: Extracting audio, compressing dynamic range: ' + self.title)
+                await ffmpeg_sox_compress(video, self.audio)
         return self.audio
 
     @property
@@ -37,7 +37,7 @@ from urllib3 import disable_warnings
 from yatetradki.tools.telega import TdlibClient
 from yatetradki.utils import must_env
 
-from episode import Episode, ui_notify, which
+from episode import Episode, Job, ui_notify, which
 
 FORMAT = '%(asctime)-15s %(levelname)s (%(name)s) %(message)s'
 logging.basicConfig(format=FORMAT, level=logging.DEBUG)
@@ -48,6 +48,7 @@ def expand(path):
 HOST = '127.0.0.1'
 PORT = 7000
 TDLIB = expand('~/.cache/tdlib/nrkup')
+KEEP_JOBS = 100 # finished jobs kept for /jobs
 
 
 def disable_logging():
@@ -102,18 +103,21 @@ class TeleFile:
             await tele.close()
 
 
-async def fetch(tg, url):
+async def fetch(tg, job):
     chat_id = int(must_env('TELEGRAM_NYHETER_ID'))
     logging.info('chat_id = %d', chat_id)
-    episode = await Episode.make(url)
+    episode = await Episode.make(job.url)
     logging.info('Found episode: %s', episode)
-    filename = await episode.mp3() # make sure file is present in fs
-    if episode.name in tg.recent_filenames_audio(chat_id):
-        await ui_notify('NRKUP', 'Already available: ' + episode.name)
-        return
-    logging.info('Sending %s', filename)
-    await ui_notify('NRKUP', 'Sending: ' + filename)
-    tg.send_audio(chat_id, filename)
+    filename = await episode.mp3(job) # make sure file is present in fs
+    loop = asyncio.get_running_loop()
+    async with job.stage('upload'):
+        # tdlib calls block, keep them off the event loop
+        if episode.name in await loop.run_in_executor(None, tg.recent_filenames_audio, chat_id):
+            await ui_notify('NRKUP', 'Already available: ' + episode.name)
+            return
+        logging.info('Sending %s', filename)
+        await ui_notify('NRKUP', 'Sending: ' + filename)
+        await loop.run_in_executor(None, tg.send_audio, chat_id, filename)
     await ui_notify('NRKUP', 'Uploaded: ' + episode.name)
 
 
@@ -129,11 +133,15 @@ class HttpServer:
         self.port = port
         self.loop = loop
         self.tg = tg
+        self.jobs = {} # id -> Job, in the order they came in
+        self.tasks = set() # the loop only keeps weak references to tasks
 
     async def run(self):
         logging.info('Starting HTTP server on %s:%s', self.host, self.port)
         app = web.Application(middlewares=[cors_middleware(allow_all=True)])
         app.router.add_route('POST', '/download', self.download)
+        app.router.add_route('GET', '/jobs', self.list_jobs)
+        app.router.add_route('GET', '/jobs/{id}', self.get_job)
         app.router.add_route('GET', '/subtitles', self.subtitles)
         runner = web.AppRunner(app)
         await runner.setup()
@@ -141,15 +149,40 @@ class HttpServer:
         await site.start()
 
     async def download(self, request):
+        """Queues the episode and answers at once, the job goes through the stages on its own."""
         try:
             url = (await request.json()).get('url')
-            if not url: return web.Response(status=400, text='Missing url')
-            await ui_notify('NRKUP', 'Fetching: ' + url)
-            await fetch(self.tg, url)
-            return web.Response(text='OK ' + url)
+        except ValueError as e:
+            return web.Response(status=400, text=str(e))
+        if not url: return web.Response(status=400, text='Missing url')
+        job = next((job for job in self.jobs.values() if job.url == url and not job.done), None)
+        if job is None:
+            job = Job(url)
+            self.jobs[job.id] = job
+            task = self.loop.create_task(self.run_job(job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return web.json_response(job.as_json(), status=202)
+
+    async def run_job(self, job):
+        try:
+            await ui_notify('NRKUP', 'Fetching: ' + job.url)
+            await fetch(self.tg, job)
+            job.finish()
         except Exception as e:
             logging.exception(e)
-            return web.Response(status=400, text=str(e))
+            job.finish(e)
+        finished = [id for id, job in self.jobs.items() if job.done]
+        for id in finished[:-KEEP_JOBS]:
+            del self.jobs[id]
+
+    async def list_jobs(self, request):
+        return web.json_response([job.as_json() for job in self.jobs.values()])
+
+    async def get_job(self, request):
+        job = self.jobs.get(int(request.match_info['id'])) if request.match_info['id'].isdigit() else None
+        if job is None: return web.Response(status=404, text='No such job')
+        return web.json_response(job.as_json())
 
     async def subtitles(self, request):
         url = request.query.get('url')
@@ -185,7 +218,7 @@ def test_init(url=None):
     disable_logging()
     loop = new_event_loop()
     host, port = HOST, PORT
-    loop.run_until_complete(fetch(tg, url))
+    loop.run_until_complete(fetch(tg, Job(url)))
     # loop.run_until_complete(HttpServer(host, port, loop).run())
     # loop.run_forever()
 
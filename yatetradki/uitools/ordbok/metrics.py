@@ -0,0 +1,99 @@
+"""
+Counters and latency histograms for the ordbok server, exported as JSON
+and in the Prometheus text format.
+
+Histograms use fixed buckets (like Prometheus does), percentiles are
+interpolated within the bucket, which is plenty for "is p95 one second or
+ten seconds" questions and costs O(buckets) memory per series.
+"""
+
+from bisect import bisect_left
+from threading import Lock
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+    def quantile(self, q):
+        if not self.count: return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i-1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+    def as_json(self):
+        result = {'count': self.count, 'sum': round(self.sum, 3), 'max': round(self.max, 3)}
+        for q in QUANTILES:
+            result['p{0}'.format(int(q * 100))] = round(self.quantile(q), 3)
+        return result
+
+def label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs: return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join('{0}="{1}"'.format(k, v) for k, v in escaped) + '}'
+
+class Metrics:
+    def __init__(self):
+        self.counters = {} # name -> {label_key: value}
+        self.histograms = {} # name -> {label_key: Histogram}
+        self.help = {}
+        self.lock = Lock()
+    def describe(self, name, text):
+        self.help[name] = text
+    def inc(self, name, labels=None, value=1):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = label_key(labels)
+            series[key] = series.get(key, 0) + value
+    def observe(self, name, labels, value):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = label_key(labels)
+            if key not in series: series[key] = Histogram()
+            series[key].observe(value)
+    def as_json(self):
+        with self.lock:
+            return {
+                'counters': {name: [dict(key, value=value) for key, value in series.items()]
+                             for name, series in self.counters.items()},
+                'histograms': {name: [dict(key, **h.as_json()) for key, h in series.items()]
+                               for name, series in self.histograms.items()},
+            }
+    def as_prometheus(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                if name in self.help: lines.append('# HELP {0} {1}'.format(name, self.help[name]))
+                lines.append('# TYPE {0} counter'.format(name))
+                for key, value in series.items():
+                    lines.append('{0}{1} {2}'.format(name, format_labels(key), value))
+            for name, series in sorted(self.histograms.items()):
+                if name in self.help: lines.append('# HELP {0} {1}'.format(name, self.help[name]))
+                lines.append('# TYPE {0} histogram'.format(name))
+                for key, h in series.items():
+                    cumulative = 0
+                    for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                        cumulative += count
+                        lines.append('{0}_bucket{1} {2}'.format(name, format_labels(key, [('le', bound)]), cumulative))
+                    lines.append('{0}_sum{1} {2}'.format(name, format_labels(key), h.sum))
+                    lines.append('{0}_count{1} {2}'.format(name, format_labels(key), h.count))
+        return '\n'.join(lines) + '\n'
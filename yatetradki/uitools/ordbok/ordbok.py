@@ -7,7 +7,7 @@ from threading import Thread
 from urllib.request import urlopen, Request
 from PyQt6 import QtGui
 
-from aiohttp import web, ClientSession
+from aiohttp import web, ClientSession, TCPConnector, TraceConfig
 from aiohttp_jinja2 import setup as aiohttp_jinja2_setup
 from aiohttp_jinja2 import render_template as aiohttp_jinja2_render_template
 from jinja2 import FileSystemLoader
@@ -86,14 +86,15 @@ if (not is_interactive()) and (not dog.start()):
 import logging
 import logging.handlers
 import re
-import bz2
 from tempfile import gettempdir
-from os import makedirs, environ, walk
-from os.path import dirname, exists, normpath, join, expanduser, expandvars, getsize
+from os import makedirs, environ
+from os.path import dirname, exists, normpath, join, expanduser, expandvars
 from urllib.parse import urlparse
 from json import loads, dumps
 from string import Template
+from html import escape
 from itertools import groupby
+from collections import OrderedDict
 from pathlib import Path
 from contextvars import ContextVar
 from operator import ne
@@ -103,13 +104,21 @@ from asyncio import set_event_loop
 from asyncio import get_event_loop
 from asyncio import gather
 from asyncio import wait
+from asyncio import wait_for
+from asyncio import as_completed
 from asyncio import create_task
 from asyncio import FIRST_COMPLETED
 from asyncio import ensure_future
+from asyncio import shield
 from asyncio import TimeoutError as AsyncioTimeoutError
 from asyncio import run_coroutine_threadsafe
 from asyncio import sleep as asleep
 from asyncio import Queue as AQueue
+from asyncio import Lock as ALock
+from asyncio import Semaphore
+from asyncio import get_running_loop
+from asyncio import CancelledError
+from contextlib import asynccontextmanager
 # # https://bugs.python.org/issue34679#msg347525
 # policy = asyncio.get_event_loop_policy()
 # policy._loop_factory = asyncio.SelectorEventLoop
@@ -138,7 +147,12 @@ from PyQt6.QtCore import pyqtSignal, pyqtSlot
 from html2text import HTML2Text
 
 from yatetradki.reader.dsl import lookup as dsl_lookup
+from yatetradki.reader.dsl import suggest as dsl_suggest
+from yatetradki.reader.dsl import folded as dsl_folded
+from yatetradki.reader.dsl import reverse as dsl_reverse
 from yatetradki.uitools.index.search import search as index_search
+from yatetradki.uitools.ordbok.store import open_store, MemoryLRU
+from yatetradki.uitools.ordbok.metrics import Metrics
 #from yatetradki.tools.telega import TdlibClient, WordLogger
 from yatetradki.utils import must_env
 
@@ -150,6 +164,8 @@ WINDOW_TITLE = 'Ordbok'
 WINDOW_WIDTH = 1300
 WINDOW_HEIGHT = 800
 UPDATE_DELAY = 1000
+SUGGEST_DELAY = 150 # milliseconds of no typing before asking for completions
+DID_YOU_MEAN = 5 # suggestions shown when a word is not in the DSL dictionaries
 DIR = Path(expanduser(expandvars('$HOME/share/btsync/prg/srs-toolbelt/yatetradki/uitools/ordbok')))
 #DIR = Path(dirname(__file__))
 ICON_FILENAME = str(DIR / 'ordbok.png')
@@ -165,6 +181,19 @@ SUFFIX_BY_WORD = 'by_word'
 ADD_TO_FONT_SIZE = 6
 NETWORK_TIMEOUT = 30000 # milliseconds
 NETWORK_RETRIES = 3
+HTTP_POOL_SIZE = 100 # max open connections in the shared session
+HTTP_PER_HOST = 8 # max open connections per host
+HTTP_KEEPALIVE = 60 # seconds
+HTTP_DNS_TTL = 600 # seconds
+PREFETCH_CONCURRENCY = 4 # sources warmed up at the same time
+STREAM_TIMEOUT = 10 # seconds, per source in /stream/word
+STREAM_TIMEOUT_SLOW = NETWORK_TIMEOUT/1000.0 # seconds, for browser-based sources
+SLOW_SOURCES = {'ordbokene/inflect', 'ordbokene/word', 'naob/word', 'deepl/noen', 'deepl/noru', 'deepl/enno'}
+BROWSER_POOL_SIZE = 4 # max pages open at the same time
+BROWSER_PER_ORIGIN = 2 # max pages per origin (scheme://host:port)
+BROWSER_PAGE_IDLE = 120 # seconds, close warm pages unused for that long
+BROWSER_IDLE = 900 # seconds, close the browser itself when unused for that long
+BROWSER_REAP_INTERVAL = 30 # seconds
 RECENT_GRAB_DELAY = (UPDATE_DELAY / 1000.0) + 0.1 # seconds
 LOG_FILENAME = 'ordbok.log'
 
@@ -183,6 +212,14 @@ invalidate_word: ContextVar[bool] = ContextVar('invalidate_word', default=False)
 
 #POOL = ProcessPoolExecutor()
 
+metrics = Metrics()
+metrics.describe('ordbok_route_seconds', 'Time to handle a request, by route')
+metrics.describe('ordbok_upstream_seconds', 'Time to fetch from an upstream site, by client and host')
+metrics.describe('ordbok_source_seconds', 'Time to produce a source in prefetch and stream, by source')
+metrics.describe('ordbok_browser_acquire_seconds', 'Time waiting for a browser page, by origin')
+metrics.describe('ordbok_cache_total', 'Cache lookups by the tier that answered: memory, disk or network')
+metrics.describe('ordbok_errors_total', 'Errors seen by error_middleware, by exception type')
+
 def force_ipv4():
     """
     https://ordbok.uib.no gets stuck when accessed by IPV6.
@@ -254,48 +291,121 @@ def http_get_sync(url):
     with urlopen(req) as resp:
         return resp.read()
 
+class HttpSessions:
+    """
+    One shared ClientSession (per event loop) for all static fetches, so that
+    lookups of the same word reuse keep-alive connections, DNS results and
+    TLS sessions instead of setting them up for every request.
+    """
+    def __init__(self, limit=HTTP_POOL_SIZE, limit_per_host=HTTP_PER_HOST,
+                 keepalive=HTTP_KEEPALIVE, dns_ttl=HTTP_DNS_TTL):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive = keepalive
+        self.dns_ttl = dns_ttl
+        self.session = None
+        self.loop = None
+        self.counters = {
+            'sessions': 0,
+            'requests': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'dns_cache_hits': 0,
+            'dns_cache_misses': 0,
+        }
+    def trace(self):
+        def count(name):
+            async def on_event(_session, _context, _params):
+                self.counters[name] += 1
+            return on_event
+        config = TraceConfig()
+        config.on_request_start.append(count('requests'))
+        config.on_connection_create_end.append(count('connections_created'))
+        config.on_connection_reuseconn.append(count('connections_reused'))
+        config.on_dns_cache_hit.append(count('dns_cache_hits'))
+        config.on_dns_cache_miss.append(count('dns_cache_misses'))
+        return config
+    def get(self):
+        loop = get_running_loop()
+        if self.session is not None and not self.session.closed and self.loop is loop:
+            return self.session
+        if self.session is not None and self.loop is not loop:
+            logging.warning('http sessions: event loop changed, creating new session')
+        connector = TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_ttl,
+        )
+        self.session = ClientSession(connector=connector, trace_configs=[self.trace()])
+        self.loop = loop
+        self.counters['sessions'] += 1
+        return self.session
+    async def close(self):
+        session, self.session = self.session, None
+        if session is not None and not session.closed:
+            logging.info('http sessions: closing shared session')
+            await session.close()
+    def stats(self):
+        result = dict(self.counters)
+        result['limit'] = self.limit
+        result['limit_per_host'] = self.limit_per_host
+        result['open'] = self.session is not None and not self.session.closed
+        return result
+
+http_sessions = HttpSessions()
+
 async def http_get_async(url, timeout=None):
     USER_AGENT = 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:100.0) Gecko/20100101 Firefox/100.0'
     headers = {'User-Agent': USER_AGENT}
     retries = NETWORK_RETRIES
-    async with ClientSession() as session:
-        for i in range(retries):
-            try:
-                logging.info('async HTTP GET %s', url)
-                async with session.get(url, timeout=timeout, headers=headers) as resp:
-                    return await resp.text()
-            except AsyncioTimeoutError as e:
-                logging.warning('timeout (%s) getting "%s": "%s"', timeout, url, e)
-                if i == retries-1:
-                    raise
+    session = http_sessions.get()
+    for i in range(retries):
+        try:
+            logging.info('async HTTP GET %s', url)
+            async with session.get(url, timeout=timeout, headers=headers) as resp:
+                return await resp.text()
+        except AsyncioTimeoutError as e:
+            logging.warning('timeout (%s) getting "%s": "%s"', timeout, url, e)
+            if i == retries-1:
+                raise
 
 class StaticHttpClient:
     USER_AGENT = 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:100.0) Gecko/20100101 Firefox/100.0'
     TIMEOUT = NETWORK_TIMEOUT/1000.0
     RETRIES = NETWORK_RETRIES
+    def __init__(self, sessions=http_sessions):
+        self.sessions = sessions
     def headers(self, origin=None):
         headers = {'User-Agent': self.USER_AGENT}
         if origin: headers['Origin'] = origin
         return headers
     async def get_async(self, url, extractor=None, origin=None):
         retries = self.RETRIES
-        async with ClientSession() as session:
-            for i in range(retries):
-                try:
-                    logging.info('static client "%s"', url)
-                    async with session.get(url, timeout=self.TIMEOUT, headers=self.headers(origin), ssl=False, allow_redirects=True) as resp:
-                        result = await resp.text()
-                        logging.info('http get async done: "%s"', url)
-                        if extractor:
-                            soup = BeautifulSoup(result, 'html.parser')
-                            soup = soup.select_one(extractor)
-                            if soup is None: return ''
-                            return soup.prettify()
-                        return result
-                except AsyncioTimeoutError as e:
-                    logging.warning('async timeout (%s) getting "%s": "%s"', self.TIMEOUT, url, e)
-                    if i == retries-1:
-                        raise
+        session = self.sessions.get()
+        labels = {'client': 'static', 'host': urlparse(url).hostname}
+        for i in range(retries):
+            t0 = time.time()
+            try:
+                logging.info('static client "%s"', url)
+                async with session.get(url, timeout=self.TIMEOUT, headers=self.headers(origin), ssl=False, allow_redirects=True) as resp:
+                    result = await resp.text()
+                    logging.info('http get async done: "%s"', url)
+                    metrics.observe('ordbok_upstream_seconds', labels, time.time() - t0)
+                    if extractor:
+                        soup = BeautifulSoup(result, 'html.parser')
+                        soup = soup.select_one(extractor)
+                        if soup is None: return ''
+                        return soup.prettify()
+                    return result
+            except AsyncioTimeoutError as e:
+                logging.warning('async timeout (%s) getting "%s": "%s"', self.TIMEOUT, url, e)
+                metrics.inc('ordbok_errors_total', {'type': 'UpstreamTimeout'})
+                if i == retries-1:
+                    raise
+    async def close(self):
+        await self.sessions.close()
 
 class DynamicClient:
     TIMEOUT = NETWORK_TIMEOUT
@@ -315,21 +425,185 @@ async def wait_for_either(page, selectors, timeout):
     for task in pending: task.cancel()
     return done.pop().result()
 
+def origin_of(url):
+    p = urlparse(url)
+    return '{0}://{1}'.format(p.scheme, p.netloc)
+
+def same_document(url1, url2):
+    return url1.split('#')[0] == url2.split('#')[0]
+
+class BrowserPool:
+    """
+    Long-lived browser with a bounded set of warm pages. Launching a browser
+    takes seconds, so we launch it once, hand out pages to requests and keep
+    them around afterwards. Dead browsers are relaunched on the next request,
+    idle pages (and eventually the browser itself) are closed by the reaper.
+    All playwright objects are bound to the loop they were created in, so the
+    pool resets itself when used from another loop (e.g. async_run in tests).
+    """
+    def __init__(self, size=BROWSER_POOL_SIZE, per_origin=BROWSER_PER_ORIGIN,
+                 page_idle=BROWSER_PAGE_IDLE, browser_idle=BROWSER_IDLE):
+        self.size = size
+        self.per_origin = per_origin
+        self.page_idle = page_idle
+        self.browser_idle = browser_idle
+        self.loop = None
+        self.playwright = None
+        self.browser = None
+        self.lock = None
+        self.slots = None
+        self.origins = {}
+        self.idle = [] # [(origin, page, released_at)], oldest first
+        self.busy = 0
+        self.last_used = time.time()
+        self.reaper = None
+        self.launches = 0
+        self.reused = 0
+        self.created = 0
+    def bind(self):
+        loop = get_running_loop()
+        if self.loop is loop: return
+        if self.loop is not None:
+            logging.warning('browser pool: event loop changed, dropping old browser')
+        self.loop = loop
+        self.playwright = None
+        self.browser = None
+        self.lock = ALock()
+        self.slots = Semaphore(self.size)
+        self.origins = {}
+        self.idle = []
+        self.busy = 0
+        self.reaper = loop.create_task(self.reap())
+    def healthy(self):
+        return self.browser is not None and self.browser.is_connected()
+    async def ensure_browser(self):
+        async with self.lock:
+            if self.healthy(): return self.browser
+            if self.browser is not None:
+                logging.warning('browser pool: browser is gone, relaunching')
+            self.browser = None
+            self.idle = []
+            if self.playwright is None:
+                self.playwright = await async_playwright().start()
+            t0 = time.time()
+            try:
+                self.browser = await async_launch(self.playwright)
+            except Exception:
+                # driver might be dead as well, start from scratch next time
+                playwright, self.playwright = self.playwright, None
+                try: await playwright.stop()
+                except Exception as e: logging.warning('browser pool: cannot stop playwright: %s', e)
+                raise
+            self.launches += 1
+            logging.info('browser pool: launched browser #%d in %.2f', self.launches, time.time() - t0)
+            return self.browser
+    def origin_slot(self, origin):
+        if origin not in self.origins:
+            self.origins[origin] = Semaphore(self.per_origin)
+        return self.origins[origin]
+    def pick(self, origin):
+        same = [x for x in self.idle if x[0] == origin]
+        item = (same or self.idle)[-1]
+        self.idle.remove(item)
+        return item[1]
+    async def take(self, origin):
+        browser = await self.ensure_browser()
+        while self.idle:
+            page = self.pick(origin)
+            if not page.is_closed():
+                self.reused += 1
+                return page
+        self.created += 1
+        return await browser.new_page()
+    async def give_back(self, origin, page, ok):
+        if not ok or page.is_closed() or not self.healthy():
+            await self.close_page(page)
+            return
+        self.idle.append((origin, page, time.time()))
+        while len(self.idle) > self.size:
+            _, oldest, _ = self.idle.pop(0)
+            await self.close_page(oldest)
+    async def close_page(self, page):
+        try:
+            if not page.is_closed(): await page.close()
+        except Exception as e:
+            logging.warning('browser pool: cannot close page: %s', e)
+    @asynccontextmanager
+    async def page(self, url):
+        self.bind()
+        origin = origin_of(url)
+        t0 = time.time()
+        async with self.origin_slot(origin), self.slots: # waiting for a busy origin does not hold a global slot
+            self.last_used = time.time()
+            page = await self.take(origin)
+            metrics.observe('ordbok_browser_acquire_seconds', {'origin': origin}, time.time() - t0)
+            self.busy += 1
+            ok = False
+            try:
+                # changing only the #fragment would not reload the page
+                if page.url != 'about:blank' and same_document(page.url, url):
+                    await page.goto('about:blank')
+                yield page
+                ok = True
+            finally:
+                self.busy -= 1
+                self.last_used = time.time()
+                await self.give_back(origin, page, ok)
+    async def reap(self):
+        while True:
+            await asleep(BROWSER_REAP_INTERVAL)
+            try:
+                await self.reap_once()
+            except Exception as e:
+                logging.exception('browser pool: reaper failed: %s', e)
+    async def reap_once(self):
+        now = time.time()
+        if self.browser is not None and not self.healthy():
+            logging.warning('browser pool: browser disconnected, will relaunch on demand')
+            self.browser = None
+            self.idle = []
+        stale = [x for x in self.idle if now - x[2] > self.page_idle]
+        for item in stale:
+            self.idle.remove(item)
+            await self.close_page(item[1])
+        if stale: logging.info('browser pool: closed %d idle pages', len(stale))
+        if self.browser is not None and self.busy == 0 and now - self.last_used > self.browser_idle:
+            logging.info('browser pool: browser idle for %.0fs, closing', now - self.last_used)
+            await self.close_browser()
+    async def close_browser(self):
+        async with self.lock:
+            self.idle = []
+            browser, self.browser = self.browser, None
+            if browser is not None and browser.is_connected():
+                await browser.close()
+    async def close(self):
+        if self.reaper is not None: self.reaper.cancel()
+        await self.close_browser()
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
+    def stats(self):
+        return {
+            'connected': self.healthy(),
+            'launches': self.launches,
+            'busy': self.busy,
+            'idle': len(self.idle),
+            'created': self.created,
+            'reused': self.reused,
+        }
+
 class PlaywrightClientAsync(DynamicClient):
-    def __init__(self):
+    def __init__(self, pool=None):
         disable_logging()
-    def launch(self, p):
-        return async_launch(p)
+        self.pool = pool or BrowserPool()
     async def get_async(self, url, selector=None, extractor=None, action=None, action_selector=None, wait_until='load'):
-        # if self.browser is None: await self.init()
-        async with async_playwright() as p:
-            browser = await self.launch(p)
-            #browser = await p.firefox.launch(headless=True)
-            page = await browser.new_page()
-            content = await self.get_async_page(page, url, selector, extractor, action, action_selector, wait_until)
-            await page.close()
-            await browser.close()
-            return content
+        async with self.pool.page(url) as page:
+            t0 = time.time()
+            try:
+                return await self.get_async_page(page, url, selector, extractor, action, action_selector, wait_until)
+            finally:
+                labels = {'client': 'dynamic', 'host': urlparse(url).hostname}
+                metrics.observe('ordbok_upstream_seconds', labels, time.time() - t0)
     async def get_async_page(self, page, url, selector=None, extractor=None, action=None, action_selector=None, wait_until='load'):
         # if self.browser is None: await self.init()
         logging.info('dynamic client GOTO "%s", wait_until="%s"', url, wait_until)
@@ -361,52 +635,60 @@ class PlaywrightClientAsync(DynamicClient):
         return content
 
 class DynamicHttpClient:
+    def __init__(self):
+        self.client = PlaywrightClientAsync()
     async def get_async(self, url, selector=None, extractor=None, action=None, action_selector=None, wait_until=None):
-        return await PlaywrightClientAsync().get_async(
+        return await self.client.get_async(
             url,
             selector=selector,
             extractor=extractor,
             action=action,
             action_selector=action_selector,
             wait_until=wait_until)
+    async def close(self):
+        await self.client.pool.close()
 
 def get_dynamic(url):
     client = DynamicHttpClient()
     out = async_run(client.get_async(url))
     return out
 
-def get_file_dir_stats(base):
-    num_files = 0
-    num_dirs = 0
-    total_bytes = 0
-    for base, dirs, files in walk(base):
-        num_files += len(dirs)
-        num_dirs += len(dirs)
-        for file in files:
-            total_bytes += getsize(join(base, file))
-    return {
-        'num_files': num_files,
-        'num_dirs': num_dirs,
-        'total_bytes': total_bytes,
-    }
+memory_cache = MemoryLRU()
 
 class Cacher:
-    def __init__(self, basedir):
-        self.basedir = basedir
+    """
+    Response cache under a key prefix (by_method, by_url) of a store, see
+    store.py for the backends. Keys look like paths for historical reasons:
+    the original backend kept one bz2 file per key. Hot values are also kept
+    decompressed in memory.
+    """
+    def __init__(self, store, prefix, memory=memory_cache):
+        self.store = store
+        self.prefix = prefix
+        self.memory = memory
+    def name(self, keypath):
+        return join(self.store.location, self.prefix, keypath)
     def get(self, keypath, invalidate=False):
         if invalidate:
             logging.info('cache miss (invalidate=%s) "%s"', invalidate, keypath)
+            self.memory.invalidate(self.name(keypath))
             return None
-        path = join(self.basedir, keypath)
-        if not exists(path):
+        value = self.memory.get(self.name(keypath))
+        if value is not None:
+            logging.info('memory cache hit "%s"', keypath)
+            metrics.inc('ordbok_cache_total', {'tier': 'memory'})
+            return value
+        value = self.store.get(join(self.prefix, keypath))
+        if value is None:
             logging.info('cache miss "%s"', keypath)
             return None
         logging.info('cache hit "%s"', keypath)
-        return slurp(bz2.open, path)
+        metrics.inc('ordbok_cache_total', {'tier': 'disk'})
+        self.memory.set(self.name(keypath), value)
+        return value
     def set(self, keypath, value):
-        path = join(self.basedir, keypath)
-        makedirs(dirname(path), exist_ok=True)
-        spit(bz2.open, path, value)
+        self.store.set(join(self.prefix, keypath), value)
+        self.memory.set(self.name(keypath), value)
 
 def by_method_and_arg(f, *args, **kwargs):
     key = f.__name__.split('_')
@@ -424,18 +706,55 @@ def only_short(f):
         return await f(self, word)
     return wrapper
 
+class SingleFlight:
+    """
+    Coalesces concurrent cache misses: the first caller for a key starts the
+    fetch in a separate task, everybody else awaits the same task. The task
+    is shielded so that a cancelled request (closed iframe) does not abort
+    the fetch for the others, and its exception is seen by all waiters.
+    """
+    def __init__(self):
+        self.inflight = {}
+        self.started = 0
+        self.joined = 0
+    async def run(self, key, fn):
+        task = self.inflight.get(key)
+        if task is None:
+            self.started += 1
+            task = ensure_future(fn())
+            self.inflight[key] = task
+            task.add_done_callback(lambda t: self.forget(key, t))
+        else:
+            self.joined += 1
+            logging.info('single flight: joining in-flight fetch "%s"', key)
+        return await shield(task)
+    def forget(self, key, task):
+        if self.inflight.get(key) is task: del self.inflight[key]
+        if not task.cancelled(): task.exception() # mark as retrieved
+    def stats(self):
+        return {'inflight': len(self.inflight), 'started': self.started, 'joined': self.joined}
+
+flights = SingleFlight()
+
+async def fetch_through(cacher, keypath, fetch):
+    # invalidate skips the cache lookup, but may still join a fetch that is
+    # already in flight: that one goes to the network anyway
+    value = cacher.get(keypath, invalidate_word.get())
+    if value is not None: return value
+    async def fetch_and_store():
+        metrics.inc('ordbok_cache_total', {'tier': 'network'})
+        value = await fetch()
+        cacher.set(keypath, value)
+        return value
+    return await flights.run(cacher.name(keypath), fetch_and_store)
+
 def cached_async(f):
     @wraps(f)
     async def wrapper(*args, **kwargs):
         keypath = join(*by_method_and_arg(f, *args, **kwargs))
-        base = join(with_word(CACHE_DIR), SUFFIX_BY_METHOD)
-        cacher = Cacher(base)
+        cacher = Cacher(open_store(with_word(CACHE_DIR)), SUFFIX_BY_METHOD)
         logging.info('async cache keypath "%s", args %s %s', keypath, args, kwargs)
-        value = cacher.get(keypath, invalidate_word.get())
-        if value is None:
-            value = await f(*args, **kwargs)
-            cacher.set(keypath, value)
-        return value
+        return await fetch_through(cacher, keypath, lambda: f(*args, **kwargs))
     return wrapper
 
 class CachedHttpClient:
@@ -444,13 +763,10 @@ class CachedHttpClient:
         self.cachedir = cachedir
     async def get_async(self, url, **kwargs):
         keypath = self.get_key(url)
-        base = join(with_word(self.cachedir), SUFFIX_BY_URL)
-        cacher = Cacher(base)
-        value = cacher.get(keypath, invalidate_word.get())
-        if value is None:
-            value = await self.client.get_async(url, **kwargs)
-            cacher.set(keypath, value)
-        return value
+        cacher = Cacher(open_store(with_word(self.cachedir)), SUFFIX_BY_URL)
+        return await fetch_through(cacher, keypath, lambda: self.client.get_async(url, **kwargs))
+    async def close(self):
+        await self.client.close()
     def get_key(self, url):
         J = lambda x: re.sub(r'\W+', '', x) # remove space
         S = lambda x: re.sub(r'^\w\s\d-', '/', x)
@@ -1205,17 +1521,35 @@ class CambridgeEnNo(WordGetter):
 class DslWord(WordGetter):
     FILENAME = '~/.ordbok.dsl.txt'
     async def get_async(self):
-        self.parse()
+        # a miss builds the headword index and walks it for suggestions, off the loop
+        await get_running_loop().run_in_executor(None, self.parse)
         return self.styled()
+    @classmethod
+    def dictionaries(cls):
+        return slurp_lines(open, cls.FILENAME)
+    @classmethod
+    def suggest(cls, text):
+        dsls = cls.dictionaries()
+        return dsl_suggest(dsls, text) if dsls else []
+    @classmethod
+    def reverse(cls, text):
+        dsls = cls.dictionaries()
+        return dsl_reverse(dsls, text) if dsls else []
     def parse(self):
         # TODO: is file is empty or missing, show a hint on what to put there and where
-        dsls = slurp_lines(open, self.FILENAME)
+        dsls = self.dictionaries()
         self.word = self.word
         if not dsls:
             raise NoContent(self.no_dictionary())
         self.html = dsl_lookup(dsls, [self.word])
         if not self.html:
-            raise NoContent('DslWord: "{0}"'.format(self.word))
+            # Bank or bånk when the dictionaries only have bank
+            self.html = dsl_lookup(dsls, dsl_folded(dsls, self.word))
+        if not self.html:
+            raise NoContent('DslWord: "{0}"{1}'.format(self.word, self.did_you_mean(dsls)))
+    def did_you_mean(self, dsls):
+        suggestions = dsl_suggest(dsls, self.word, DID_YOU_MEAN)
+        return ', did you mean: {0}'.format(', '.join(suggestions)) if suggestions else ''
     def no_dictionary(self):
         return 'DslWord: No dictionaries found. Put full filename paths to DSL ' \
             'dictionaries into {0}, one filename per line'.format(self.FILENAME)
@@ -1413,9 +1747,12 @@ class MainWindow(QWidget):
     ZOOM = 1.7
     myActivate = pyqtSignal()
     myTranslate = pyqtSignal(str)
+    mySuggest = pyqtSignal(str, list)
     def __init__(self, app):
         super().__init__()
         self.myActivate.connect(self.activate)
+        self.mySuggest.connect(self.on_suggestions)
+        self.suggestions = []
         self.app = app
         self.last_seek = ''
 
@@ -1529,11 +1866,28 @@ class MainWindow(QWidget):
         self.move(qr.topLeft())
 
     def suggest(self, words):
+        self.suggestions = words
         completer = QCompleter(words, self)
         completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        # folded and fuzzy matches do not start with the typed text
+        completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
         self.comboBox.setCompleter(completer)
         completer.complete()
 
+    def request_suggestions(self, text):
+        if self.comboBox.currentText() != text or text in self.suggestions:
+            return
+        def run():
+            try:
+                self.mySuggest.emit(text, DslWord.suggest(text))
+            except Exception as e:
+                logging.warning('Could not suggest "%s": %s', text, e)
+        Thread(target=run, daemon=True).start()
+
+    def on_suggestions(self, text, words):
+        if words and self.comboBox.currentText() == text:
+            self.suggest(words)
+
     def set_text(self, text, invalidate=False):
         logging.info('Setting text: %s', text)
         self.myTranslate.emit(text)
@@ -1556,6 +1910,8 @@ class MainWindow(QWidget):
         if text == '':
             return
         QTimer.singleShot(UPDATE_DELAY, lambda: self.update(text))
+        if self.comboBox.hasFocus() and not self.recent_manual_change():
+            QTimer.singleShot(SUGGEST_DELAY, lambda: self.request_suggestions(text))
 
     def update(self, old_text):
         if self.recent_manual_change():
@@ -1615,21 +1971,84 @@ async def timed_http_get_async(url):
 def text_html(text):
     return web.Response(text=text, content_type='text/html')
 
+class Prefetcher:
+    """
+    Warms up the caches of all sources for a word in the background, so that
+    switching tabs in the UI does not wait for the network. Sources are
+    started in priority order, at most `concurrency` at a time. A new word
+    cancels the sources of the previous one that have not started yet
+    (fetches that are already in flight finish and land in the cache).
+    """
+    def __init__(self, sources, concurrency=PREFETCH_CONCURRENCY):
+        self.sources = sources
+        self.concurrency = concurrency
+        self.task = None
+        self.word = None
+        self.latency = {}
+        self.cancelled = 0
+    def start(self, word):
+        if self.task is not None and not self.task.done():
+            if self.word == word: return
+            logging.info('prefetch: cancelling outdated prefetch of "%s"', self.word)
+            self.task.cancel()
+            self.cancelled += 1
+        self.word = word
+        self.task = ensure_future(self.run(word))
+    async def run(self, word):
+        current_word.set(word)
+        invalidate_word.set(False)
+        slots = Semaphore(self.concurrency)
+        async def one(name, fn):
+            async with slots:
+                t0 = time.time()
+                try:
+                    await fn(word)
+                    status = 'ok'
+                except CancelledError:
+                    raise
+                except Exception as e:
+                    status = type(e).__name__
+                took = time.time() - t0
+                logging.info('prefetch: %s "%s" took %.2f (%s)', name, word, took, status)
+                metrics.observe('ordbok_source_seconds', {'source': name, 'via': 'prefetch'}, took)
+                self.latency[name] = {'took': round(took, 3), 'word': word, 'status': status, 'at': time.time()}
+        t0 = time.time()
+        await gather(*[one(name, fn) for name, fn in self.sources()])
+        logging.info('prefetch: all sources for "%s" took %.2f', word, time.time() - t0)
+    def stats(self):
+        return {
+            'word': self.word,
+            'running': self.task is not None and not self.task.done(),
+            'cancelled': self.cancelled,
+            'sources': self.latency,
+        }
+
 def text_css(text):
     return web.Response(text=text, content_type='text/css')
 
+def route_name(request):
+    # /lexin/word/{word} instead of one series per looked up word
+    route = request.match_info.route
+    if route is not None and route.resource is not None:
+        return route.resource.canonical
+    return request.rel_url.path
+
 class AIOHTTPUIServer:
-    def __init__(self, static_client, dynamic_client, host, port):
+    def __init__(self, static_client, dynamic_client, host, port, sessions=http_sessions):
         self.static_client = static_client
         self.dynamic_client = dynamic_client
+        self.sessions = sessions
         self.host = host
         self.port = port
+        self.loop = None
         self.app = web.Application(middlewares=[self.error_middleware, self.stats_middleware])
+        self.app.on_cleanup.append(self.on_cleanup)
         aiohttp_jinja2_setup(self.app, loader=FileSystemLoader(TEMPLATE_DIR))
         self.setup_routes(self.app)
         # https://docs.aiohttp.org/en/stable/web_advanced.html#application-runners
         self.runner = web.AppRunner(self.app)
         self.stats = TimingStats()
+        self.prefetcher = Prefetcher(self.sources)
     def url(self, path):
         return 'http://{}:{}{}'.format(self.host, self.port, path)
     def serve_background(self):
@@ -1638,17 +2057,59 @@ class AIOHTTPUIServer:
         logging.info('Starting AIOHTTPUIServer on %s:%s', self.host, self.port)
         loop = new_event_loop()
         set_event_loop(loop)
+        self.loop = loop
+        open_store(with_word(CACHE_DIR)) # a first start imports the old bz2 cache here, before requests come in
         loop.run_until_complete(self.runner.setup())
         site = web.TCPSite(self.runner, self.host, self.port)
         loop.run_until_complete(site.start())
         loop.run_forever()
+    def shutdown(self, timeout=10):
+        if self.loop is None or not self.loop.is_running(): return
+        logging.info('Stopping AIOHTTPUIServer')
+        try:
+            run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(timeout)
+        except Exception as e:
+            logging.warning('AIOHTTPUIServer: unclean shutdown: %s', e)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+    def prefetch(self, word):
+        """Thread-safe, called from the Qt thread when a word is set."""
+        if self.loop is None or not word: return
+        self.loop.call_soon_threadsafe(self.prefetcher.start, word)
+    def sources(self):
+        # in the order of the tabs in the UI, cached routes only
+        return [
+            ('ordbok/inflect', self.route_ordbok_inflect),
+            ('ordbokene/inflect', self.route_ordbokene_inflect),
+            ('lexin/word', self.route_lexin_word),
+            ('glosbe/noru', self.route_glosbe_noru),
+            ('glosbe/noen', self.route_glosbe_noen),
+            ('ordbok/word', self.route_ordbok_word),
+            ('ordbokene/word', self.route_ordbokene_word),
+            ('naob/word', self.route_naob_word),
+            ('dsl/word', self.route_dsl_word),
+            ('trex/noen', self.route_trex_noen),
+            ('gtrans/noen', self.route_gtrans_noen),
+            ('deepl/noen', self.route_deepl_noen),
+            ('deepl/noru', self.route_deepl_noru),
+            ('gtrans/enno', self.route_gtrans_enno),
+            ('deepl/enno', self.route_deepl_enno),
+            ('trex/enno', self.route_trex_enno),
+            ('glosbe/enno', self.route_glosbe_enno),
+            ('cambridge/enno', self.route_cambridge_enno),
+        ]
+    async def on_cleanup(self, _app):
+        await self.static_client.close()
+        await self.dynamic_client.close()
+        await self.sessions.close()
     @web.middleware
     async def stats_middleware(self, request, handler):
         t0 = time.time()
-        response = await handler(request)
-        total = time.time() - t0
-        self.stats.set(request.rel_url.path, total)
-        return response
+        try:
+            response = await handler(request)
+            self.stats.set(request.rel_url.path, time.time() - t0)
+            return response
+        finally:
+            metrics.observe('ordbok_route_seconds', {'route': route_name(request)}, time.time() - t0)
     @web.middleware
     async def error_middleware(self, request, handler):
         try:
@@ -1663,7 +2124,13 @@ class AIOHTTPUIServer:
             AsyncioTimeoutError,
             NoContent,
         ) as e:
+            metrics.inc('ordbok_errors_total', {'type': type(e).__name__})
             return text_html('{0}: {1}'.format(type(e).__name__, e))
+        except web.HTTPException:
+            raise
+        except Exception as e:
+            metrics.inc('ordbok_errors_total', {'type': type(e).__name__})
+            raise
     def setup_routes(self, app):
         def set_context(request):
             word = request.match_info.get('word')
@@ -1707,6 +2174,8 @@ class AIOHTTPUIServer:
         router.add_get('/wiktionary/no/{word}', wrap(self.route_wiktionary_no))
         router.add_get('/cambridge/enno/{word}', wrap(self.route_cambridge_enno))
         router.add_get('/dsl/word/{word}', wrap(self.route_dsl_word))
+        router.add_get('/dsl/suggest/{word}', wrap(self.route_dsl_suggest))
+        router.add_get('/dsl/reverse/{word}', wrap(self.route_dsl_reverse))
         router.add_get('/gtrans/noen/{word}', wrap(self.route_gtrans_noen))
         router.add_get('/gtrans/enno/{word}', wrap(self.route_gtrans_enno))
         router.add_get('/deepl/noen/{word}', wrap(self.route_deepl_noen))
@@ -1719,7 +2188,11 @@ class AIOHTTPUIServer:
         router.add_get('/aulismedia/next/{word}', wrap(self.route_aulismedia_next))
         router.add_get('/aulismedia/search_norsk/{word}', wrap(self.route_aulismedia_search_norsk))
         router.add_get('/all/word/{word}', self.route_all_word)
+        router.add_get('/prefetch/{word}', wrap(self.route_prefetch))
+        router.add_get('/stream/word/{word}', self.route_stream_word)
         router.add_get('/stats', self.route_stats)
+        router.add_get('/metrics', self.route_metrics)
+        router.add_get('/metrics.json', self.route_metrics_json)
         router.add_get('/', self.route_index)
         app.add_routes([web.static('/static', STATIC_DIR)])
     def route_iframe_css(self, _request):
@@ -1792,6 +2265,11 @@ class AIOHTTPUIServer:
     @only_short
     async def route_dsl_word(self, word):
         return await DslWord(None, word).get_async()
+    async def route_dsl_suggest(self, word):
+        # building the headword index on first use takes a while, keep the loop free
+        return await get_running_loop().run_in_executor(None, DslWord.suggest, word)
+    async def route_dsl_reverse(self, word):
+        return await get_running_loop().run_in_executor(None, DslWord.reverse, word)
     @cached_async
     async def route_gtrans_noen(self, word):
         return await GoogleTranslateNoEn(self.static_client, word).get_async()
@@ -1828,6 +2306,9 @@ class AIOHTTPUIServer:
         return index_search(word.lower())
     # def route_aulismedia_static(self, word):
     #     return AulismediaWord.static(word)
+    async def route_prefetch(self, word):
+        self.prefetcher.start(word)
+        return self.prefetcher.stats()
     async def route_all_word(self, request):
         word = request.match_info.get('word')
         parallel = request.rel_url.query.get('parallel', '')
@@ -1860,8 +2341,63 @@ class AIOHTTPUIServer:
         details = ''.join('{} {}\n'.format(t, u) for t, u in zip(strs, urls))
         result = header + details + ' '.join(strs) + '\n'
         return text_html(result)
+    async def route_stream_word(self, request):
+        """
+        Renders all sources on one page, flushing each one as soon as it is
+        ready, so slow browser-based sources do not hold back the static ones.
+        ?sources=lexin/word,naob/word limits the set of sources.
+        """
+        word = request.match_info.get('word')
+        invalidate = request.rel_url.query.get('invalidate', '')
+        only = request.rel_url.query.get('sources', '')
+        current_word.set(word)
+        invalidate_word.set(bool(invalidate))
+        sources = self.sources()
+        if only: sources = [(n, f) for n, f in sources if n in only.split(',')]
+
+        async def one(name, fn):
+            timeout = STREAM_TIMEOUT_SLOW if name in SLOW_SOURCES else STREAM_TIMEOUT
+            t0 = time.time()
+            try:
+                html = await wait_for(fn(word), timeout)
+            except (AsyncioTimeoutError, PlaywrightTimeoutErrorAsync):
+                html = 'Timeout after {0:.0f}s'.format(timeout)
+            except Exception as e:
+                html = '{0}: {1}'.format(type(e).__name__, escape(str(e)))
+            took = time.time() - t0
+            metrics.observe('ordbok_source_seconds', {'source': name, 'via': 'stream'}, took)
+            return name, html, took
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/html; charset=utf-8'})
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        await response.write('<html><head><meta charset="utf-8"><title>{0}</title></head><body>\n'.format(escape(word)).encode())
+        tasks = [create_task(one(name, fn)) for name, fn in sources]
+        try:
+            for next_done in as_completed(tasks):
+                name, html, took = await next_done
+                logging.info('stream: %s "%s" took %.2f', name, word, took)
+                fragment = '<section id="{0}"><h3>{0} <small>{1:.2f}s</small></h3>\n{2}\n</section>\n'.format(name, took, html)
+                await response.write(fragment.encode())
+        finally:
+            for task in tasks: task.cancel()
+        await response.write(b'</body></html>\n')
+        await response.write_eof()
+        return response
     async def route_stats(self, _request):
-        return web.json_response(self.stats.get_all(), dumps=lambda x: dumps(x, indent=2))
+        result = {
+            'timings': self.stats.get_all(),
+            'http': self.sessions.stats(),
+            'single_flight': flights.stats(),
+            'prefetch': self.prefetcher.stats(),
+            'memory_cache': memory_cache.stats(),
+            'cache': open_store(with_word(CACHE_DIR)).stats(),
+        }
+        return web.json_response(result, dumps=lambda x: dumps(x, indent=2))
+    async def route_metrics(self, _request):
+        return web.Response(text=metrics.as_prometheus(), content_type='text/plain', charset='utf-8')
+    async def route_metrics_json(self, _request):
+        return web.json_response(metrics.as_json(), dumps=lambda x: dumps(x, indent=2))
     async def route_index(self, request):
         links = []
         for r in self.app.router.resources():
@@ -1878,17 +2414,15 @@ def seconds_to_human(seconds):
     return '%02d:%02d:%02d' % (h, m, s)
 
 class TimingStats:
+    """Latest duration of the last MAX_ITEMS paths, see Metrics for histograms."""
     MAX_ITEMS = 30
     def __init__(self):
-        self.times = {}
+        self.times = OrderedDict()
     def set(self, path, value):
+        self.times.pop(path, None)
         self.times[path] = {'took': value, 'at': time.time()}
-        self.times = self.trim(self.times)
-    def trim(self, times):
-        list = self.as_list(times)
-        list.sort(key=lambda x: x['at'])
-        list = list[-self.MAX_ITEMS:]
-        return self.as_dict(list)
+        while len(self.times) > self.MAX_ITEMS:
+            self.times.popitem(last=False)
     def as_list(self, times):
         now = time.time()
         result = [{'path': path,
@@ -1898,8 +2432,6 @@ class TimingStats:
                    }
                   for path, value in times.items()]
         return result
-    def as_dict(self, times_list):
-        return {x['path']: {'took': x['took'], 'at': x['at']} for x in times_list}
     def get_all(self):
         result = self.as_list(self.times)
         result.sort(key=lambda x: x['took'])
@@ -1962,9 +2494,11 @@ def main():
     tray.show()
 
     dog.observe(lambda: window.myActivate.emit())
+    window.myTranslate.connect(ui_server.prefetch)
     #track_history(window.myTranslate)
 
     result = qtApp.exec()
+    ui_server.shutdown()
 
 def testnaob(word):
     # client = CachedHttpClient(DynamicHttpClient(), 'cache')
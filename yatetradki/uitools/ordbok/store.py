@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Cache backends for ordbok responses.
+
+FileStore is the original layout: one bz2 file per key under the cache
+directory. SqliteStore keeps everything in a single indexed file, uses a
+faster codec, and supports TTL and size-based eviction. Both implement
+get(key) / set(key, value) on str values. MemoryLRU is a bounded in-process
+tier that sits in front of either of them.
+
+open_store imports the old tree into the single-file store the first time
+it opens it, or by hand:
+
+    srst-ordbok-cache migrate --src ~/.cache/ordbok
+"""
+
+import bz2
+import logging
+import sqlite3
+import sys
+from sys import getsizeof
+import time
+import zlib
+from argparse import ArgumentParser
+from os import makedirs, environ, remove, replace, walk
+from os.path import dirname, exists, join, expanduser, expandvars, getsize, getmtime, relpath
+from pathlib import Path
+from threading import Lock
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+HOME = Path(expanduser('~'))
+CACHE_DIR = Path(environ.get('CACHE_DIR', HOME / '.cache' / 'ordbok'))
+CACHE_BACKEND = environ.get('ORDBOK_CACHE_BACKEND', 'sqlite') # sqlite | files
+CACHE_FILENAME = 'cache.sqlite'
+CACHE_TTL = float(environ.get('ORDBOK_CACHE_TTL', 0)) # seconds, 0 means forever
+CACHE_MAX_BYTES = int(environ.get('ORDBOK_CACHE_MAX_BYTES', 0)) # 0 means unlimited
+MEMORY_CACHE_BYTES = int(environ.get('ORDBOK_MEMORY_CACHE_BYTES', 64 * 1024 * 1024))
+ACCESS_RESOLUTION = 60 # seconds, don't rewrite access time more often than that
+EVICT_TO = 0.9 # evict down to this fraction of max_bytes
+
+def make_codecs():
+    codecs = {
+        'zlib': (lambda x: zlib.compress(x, 1), zlib.decompress),
+        'bz2': (bz2.compress, bz2.decompress),
+        'raw': (lambda x: x, lambda x: x),
+    }
+    if lz4 is not None:
+        codecs['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+    if zstandard is not None:
+        codecs['zstd'] = (zstandard.ZstdCompressor(level=3).compress,
+                          zstandard.ZstdDecompressor().decompress)
+    return codecs
+
+CODECS = make_codecs()
+
+def best_codec():
+    for name in ['zstd', 'lz4', 'zlib']:
+        if name in CODECS: return name
+
+def get_file_dir_stats(base):
+    num_files = 0
+    num_dirs = 0
+    total_bytes = 0
+    for base, dirs, files in walk(base):
+        num_files += len(files)
+        num_dirs += len(dirs)
+        for file in files:
+            total_bytes += getsize(join(base, file))
+    return {
+        'num_files': num_files,
+        'num_dirs': num_dirs,
+        'total_bytes': total_bytes,
+    }
+
+class FileStore:
+    def __init__(self, basedir):
+        self.basedir = str(basedir)
+        self.location = self.basedir
+    def get(self, key):
+        path = join(self.basedir, key)
+        if not exists(path): return None
+        with bz2.open(path, 'rb') as f:
+            return f.read().decode()
+    def set(self, key, value):
+        path = join(self.basedir, key)
+        makedirs(dirname(path), exist_ok=True)
+        with bz2.open(path, 'wb') as f:
+            f.write(value.encode())
+    def stats(self):
+        result = get_file_dir_stats(self.basedir)
+        result['backend'] = 'files'
+        return result
+    def close(self):
+        pass
+
+class SqliteStore:
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+    '''
+    def __init__(self, filename, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES, codec=None):
+        self.filename = str(filename)
+        self.location = self.filename
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.codec = codec or best_codec()
+        self.lock = Lock()
+        makedirs(dirname(self.filename) or '.', exist_ok=True)
+        self.db = sqlite3.connect(self.filename, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(self.SCHEMA)
+        self.total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        self.evictions = 0
+    def expired(self, created, now):
+        return self.ttl and (now - created > self.ttl)
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                'SELECT codec, value, created, accessed FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None: return None
+            codec, value, created, accessed = row
+            if self.expired(created, now):
+                self.delete([key])
+                return None
+            if now - accessed > ACCESS_RESOLUTION:
+                self.db.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return CODECS[codec][1](value).decode()
+    def set(self, key, value, created=None):
+        now = time.time()
+        blob = CODECS[self.codec][0](value.encode())
+        with self.lock:
+            old = self.db.execute('SELECT size FROM cache WHERE key = ?', (key,)).fetchone()
+            self.db.execute(
+                'INSERT OR REPLACE INTO cache (key, codec, value, size, created, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, self.codec, blob, len(blob), created or now, now))
+            self.total += len(blob) - (old[0] if old else 0)
+            if self.max_bytes and self.total > self.max_bytes:
+                self.evict()
+    def delete(self, keys):
+        for key in keys:
+            row = self.db.execute('SELECT size FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None: continue
+            self.db.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self.total -= row[0]
+            self.evictions += 1
+    def evict(self):
+        # caller holds the lock
+        if self.ttl:
+            cutoff = time.time() - self.ttl
+            expired = [k for (k,) in self.db.execute('SELECT key FROM cache WHERE created < ?', (cutoff,))]
+            self.delete(expired)
+        target = self.max_bytes * EVICT_TO
+        victims = []
+        freed = 0
+        for key, size in self.db.execute('SELECT key, size FROM cache ORDER BY accessed'):
+            if self.total - freed <= target: break
+            victims.append(key)
+            freed += size
+        self.delete(victims)
+        logging.info('cache store: evicted %d entries, %d bytes left', len(victims), self.total)
+    def stats(self):
+        with self.lock:
+            count = self.db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return {
+            'backend': 'sqlite',
+            'codec': self.codec,
+            'entries': count,
+            'total_bytes': self.total,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'evictions': self.evictions,
+        }
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class MemoryLRU:
+    """Least recently used str values, bounded by their size in bytes."""
+    def __init__(self, max_bytes=MEMORY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+    def set(self, key, value):
+        size = getsizeof(value)
+        with self.lock:
+            self.pop(key)
+            if size > self.max_bytes: return
+            self.items[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, old = self.items.popitem(last=False)
+                self.bytes -= getsizeof(old)
+                self.evictions += 1
+    def pop(self, key):
+        old = self.items.pop(key, None)
+        if old is not None: self.bytes -= getsizeof(old)
+    def invalidate(self, key):
+        with self.lock:
+            self.pop(key)
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.items),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+            'evictions': self.evictions,
+        }
+
+STORES = {}
+STORES_LOCK = Lock()
+def open_store(basedir=CACHE_DIR, backend=CACHE_BACKEND):
+    """
+    Returns a shared store for basedir, opening it on first use. Opening
+    the sqlite store the first time may import a whole bz2 tree, so servers
+    open it before they accept requests.
+    """
+    basedir = str(basedir)
+    key = (basedir, backend)
+    with STORES_LOCK:
+        if key not in STORES:
+            if backend == 'files':
+                STORES[key] = FileStore(basedir)
+            elif backend == 'sqlite':
+                filename = join(basedir, CACHE_FILENAME)
+                if not exists(filename) and has_bz2(basedir):
+                    migrate_into(basedir, filename)
+                STORES[key] = SqliteStore(filename)
+            else:
+                raise ValueError('Unknown cache backend: {0}'.format(backend))
+            logging.info('cache store: %s at "%s"', backend, STORES[key].location)
+        return STORES[key]
+
+def is_bz2(filename):
+    with open(filename, 'rb') as f:
+        return f.read(3) == b'BZh'
+
+def has_bz2(src):
+    return any(is_bz2(join(base, name)) for base, _dirs, files in walk(src) for name in files)
+
+def migrate_into(src, filename):
+    """Imports the bz2 tree under src into a new sqlite store at filename, which only appears when complete."""
+    part = filename + '.migrating'
+    for leftover in [part, part + '-wal', part + '-shm']:
+        if exists(leftover): remove(leftover)
+    logging.info('cache store: importing bz2 files from "%s" into "%s"', src, filename)
+    t0 = time.time()
+    store = SqliteStore(part)
+    count = migrate(src, store)
+    store.close()
+    replace(part, filename)
+    logging.info('cache store: imported %d entries in %.1fs', count, time.time() - t0)
+
+def migrate(src, store):
+    """Imports every bz2 file under src into store, keyed by relative path."""
+    count = 0
+    for base, _dirs, files in walk(src):
+        for name in files:
+            path = join(base, name)
+            if not is_bz2(path): continue
+            with bz2.open(path, 'rb') as f:
+                value = f.read().decode()
+            store.set(relpath(path, src), value, created=getmtime(path))
+            count += 1
+            if count % 1000 == 0: logging.info('migrated %d entries', count)
+    return count
+
+def main():
+    FORMAT = '%(asctime)-15s %(levelname)s %(message)s'
+    logging.basicConfig(format=FORMAT, level=logging.INFO)
+    parser = ArgumentParser(description='Manage ordbok response cache')
+    sub = parser.add_subparsers(dest='command', required=True)
+    m = sub.add_parser('migrate', help='import bz2 file-per-key cache into the single-file store')
+    m.add_argument('--src', default=str(CACHE_DIR), help='directory with the old bz2 tree')
+    m.add_argument('--dst', default=str(CACHE_DIR / CACHE_FILENAME), help='sqlite store filename')
+    s = sub.add_parser('stats', help='print store statistics')
+    s.add_argument('--dst', default=str(CACHE_DIR / CACHE_FILENAME), help='sqlite store filename')
+    args = parser.parse_args()
+
+    store = SqliteStore(expanduser(expandvars(args.dst)))
+    if args.command == 'migrate':
+        t0 = time.time()
+        count = migrate(expanduser(expandvars(args.src)), store)
+        print('Migrated {0} entries in {1:.1f}s'.format(count, time.time() - t0), file=sys.stderr)
+    print(store.stats())
+    store.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+from yatetradki.uitools.ordbok.metrics import Histogram, Metrics
+
+
+class TestHistogram:
+    def test_quantiles(self):
+        h = Histogram(buckets=(1.0, 2.0, 4.0))
+        for value in [0.5] * 50 + [1.5] * 45 + [3.0] * 5:
+            h.observe(value)
+        assert 100 == h.count
+        assert 0.0 < h.quantile(0.5) <= 1.0
+        assert 1.0 < h.quantile(0.95) <= 2.0
+        assert 2.0 < h.quantile(0.99) <= 4.0
+
+    def test_empty(self):
+        assert 0.0 == Histogram().quantile(0.99)
+
+    def test_overflow_bucket_bounded_by_max(self):
+        h = Histogram(buckets=(1.0,))
+        h.observe(7.0)
+        assert 1.0 < h.quantile(0.99) <= 7.0
+
+
+class TestMetrics:
+    def test_prometheus(self):
+        m = Metrics()
+        m.describe('ordbok_cache_total', 'Cache lookups')
+        m.inc('ordbok_cache_total', {'tier': 'memory'})
+        m.inc('ordbok_cache_total', {'tier': 'memory'})
+        m.observe('ordbok_route_seconds', {'route': '/lexin/word/{word}'}, 0.2)
+        text = m.as_prometheus()
+        assert '# HELP ordbok_cache_total Cache lookups' in text
+        assert 'ordbok_cache_total{tier="memory"} 2' in text
+        assert 'ordbok_route_seconds_bucket{route="/lexin/word/{word}",le="0.25"} 1' in text
+        assert 'ordbok_route_seconds_bucket{route="/lexin/word/{word}",le="+Inf"} 1' in text
+        assert 'ordbok_route_seconds_count{route="/lexin/word/{word}"} 1' in text
+
+    def test_json(self):
+        m = Metrics()
+        m.observe('ordbok_upstream_seconds', {'host': 'naob.no'}, 1.5)
+        [series] = m.as_json()['histograms']['ordbok_upstream_seconds']
+        assert 'naob.no' == series['host']
+        assert 1 == series['count']
@@ -0,0 +1,109 @@
+import bz2
+from os import makedirs
+from os.path import join, dirname, exists
+from sys import getsizeof
+from tempfile import TemporaryDirectory
+
+from yatetradki.uitools.ordbok.store import FileStore, SqliteStore, MemoryLRU, migrate, open_store
+
+
+def spit_bz2(filename, content):
+    makedirs(dirname(filename), exist_ok=True)
+    with bz2.open(filename, 'wb') as file_:
+        file_.write(content.encode())
+
+
+class TestSqliteStore:
+    def test_get_set(self):
+        with TemporaryDirectory() as dir_:
+            store = SqliteStore(join(dir_, 'cache.sqlite'))
+            assert store.get('by_method/route/lexin/word/hund') is None
+            store.set('by_method/route/lexin/word/hund', '<b>hund</b>')
+            assert '<b>hund</b>' == store.get('by_method/route/lexin/word/hund')
+            store.set('by_method/route/lexin/word/hund', 'dog')
+            assert 'dog' == store.get('by_method/route/lexin/word/hund')
+            assert 1 == store.stats()['entries']
+
+    def test_reopen(self):
+        with TemporaryDirectory() as dir_:
+            store = SqliteStore(join(dir_, 'cache.sqlite'))
+            store.set('a', 'value')
+            total = store.total
+            store.close()
+            store = SqliteStore(join(dir_, 'cache.sqlite'))
+            assert 'value' == store.get('a')
+            assert total == store.total
+
+    def test_ttl(self):
+        with TemporaryDirectory() as dir_:
+            store = SqliteStore(join(dir_, 'cache.sqlite'), ttl=10)
+            store.set('old', 'value', created=1.0)
+            store.set('new', 'value')
+            assert store.get('old') is None
+            assert 'value' == store.get('new')
+
+    def test_evict_least_recently_accessed(self):
+        with TemporaryDirectory() as dir_:
+            store = SqliteStore(join(dir_, 'cache.sqlite'), codec='raw', max_bytes=250)
+            for i in range(5):
+                store.set('key%d' % i, 'x' * 100)
+            assert store.total <= 250
+            assert store.get('key0') is None
+            assert store.get('key4') is not None
+
+    def test_delete_counts_only_present_keys(self):
+        with TemporaryDirectory() as dir_:
+            store = SqliteStore(join(dir_, 'cache.sqlite'))
+            store.set('a', 'value')
+            store.delete(['a', 'missing'])
+            assert 1 == store.stats()['evictions']
+            assert 0 == store.total
+
+
+class TestMemoryLRU:
+    def test_bounded_by_bytes(self):
+        value = 'x' * 100
+        lru = MemoryLRU(max_bytes=getsizeof(value) * 2)
+        lru.set('a', value)
+        lru.set('b', value)
+        assert value == lru.get('a') # a is now more recent than b
+        lru.set('c', value)
+        assert lru.get('b') is None
+        assert value == lru.get('a')
+        assert value == lru.get('c')
+        stats = lru.stats()
+        assert 1 == stats['evictions']
+        assert getsizeof(value) * 2 == stats['bytes']
+        assert 0.75 == stats['hit_ratio']
+
+    def test_invalidate(self):
+        lru = MemoryLRU()
+        lru.set('a', 'value')
+        lru.invalidate('a')
+        assert lru.get('a') is None
+        assert 0 == lru.stats()['bytes']
+
+
+class TestMigrate:
+    def test_bz2_tree(self):
+        with TemporaryDirectory() as dir_:
+            src = join(dir_, 'ordbok')
+            spit_bz2(join(src, 'by_method', 'route', 'lexin', 'word', 'hund'), 'hund')
+            spit_bz2(join(src, 'by_url', 'nbglosbecom', 'nbru', 'katt'), 'katt')
+            with open(join(src, 'notes.txt'), 'w') as file_:
+                file_.write('not a cache entry')
+
+            store = SqliteStore(join(dir_, 'cache.sqlite'))
+            assert 2 == migrate(src, store)
+            assert 'hund' == store.get('by_method/route/lexin/word/hund')
+            assert 'katt' == store.get('by_url/nbglosbecom/nbru/katt')
+            assert FileStore(src).get('by_url/nbglosbecom/nbru/katt') == 'katt'
+
+    def test_open_store_imports_old_tree(self):
+        with TemporaryDirectory() as dir_:
+            spit_bz2(join(dir_, 'by_method', 'route', 'lexin', 'word', 'hund'), 'hund')
+            store = open_store(dir_, 'sqlite')
+            assert 'hund' == store.get('by_method/route/lexin/word/hund')
+            assert exists(join(dir_, 'cache.sqlite'))
+            assert not exists(join(dir_, 'cache.sqlite.migrating'))
+            store.close()
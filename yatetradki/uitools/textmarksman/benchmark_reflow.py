@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Times reflow.unwrap against the unwrap textmarksman had before, on OCR
+output.
+
+    python -m yatetradki.uitools.textmarksman.benchmark_reflow
+    python -m yatetradki.uitools.textmarksman.benchmark_reflow --show page1.txt page2.txt
+
+Files given as arguments are tesseract output (GetUTF8Text saved as is),
+without them it runs on the samples below.
+"""
+import argparse
+import re
+import sys
+import timeit
+
+from yatetradki.uitools.textmarksman.reflow import unwrap
+
+SAMPLES = [
+    ('nor', 'Det var en gang en gutt som het Per, og han bodde ved fjor- \n'
+            'den sammen med mora si. Han likte å lese bøker om havet,\n'
+            'f.eks. om Heyerdahl og Nansen, og om NRK-\n'
+            'serien han så på TV.\n'
+            '\n'
+            '— Hvor skal du? spurte mora.\n'
+            '— Ned til båten, svarte Per.\n\x0c'),
+    ('rus', 'Это было давно, когда мы жили в маленьком городе на бере-\n'
+            'гу реки. Мы часто ходили гулять, т.е. почти каждый\n'
+            'день, и т.д.\n'
+            'Потом всё изменилось. Я до сих пор помню А. С.\n'
+            'Пушкина наизусть.\n\x0c'),
+    ('eng', 'Capture\n'
+            'a short word\n'),
+]
+
+def legacy_unwrap(text: str) -> str:
+    """textmarksman.unwrap before reflow."""
+    upper = "".join([chr(i) for i in range(sys.maxunicode) if chr(i).isupper()])
+    # remove trailing whitespace
+    text = re.sub(r'\s+$', '', text)
+    text = re.sub(r' +\n', '\n', text)
+    text = re.sub(r'\n +', '\n', text)
+    # join hyphen
+    text = re.sub(r'[-—]\s* \s*', '', text)
+    expr = r'([^\.\n])\n(?![\n' + upper + '])'
+    text = re.sub(expr, r'\1 ', text)
+    # collapse spaces
+    text = re.sub(r'[ \t]+', ' ', text)
+    #text = re.sub(r'[\n]+', '\n', text)
+    # remove 2 consecutive newlines
+    text = re.sub(r'\n\n', '\n', text)
+    return text
+
+def best(f, number):
+    return min(timeit.repeat(f, number=number, repeat=3)) / number
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark OCR text reflow')
+    parser.add_argument('files', nargs='*', help='Recorded OCR output, the built-in samples if none')
+    parser.add_argument('--lang', default='nor+rus+eng', help='OCR languages of the files')
+    parser.add_argument('--show', default=False, action='store_true', help='Print both results')
+    args = parser.parse_args()
+
+    samples = SAMPLES
+    if args.files:
+        samples = []
+        for name in args.files:
+            with open(name, encoding='utf-8') as f:
+                samples.append((args.lang, f.read()))
+    for lang, text in samples:
+        old = best(lambda: legacy_unwrap(text), 1)
+        new = best(lambda: unwrap(text, lang), 1000)
+        print('{}: {} chars, legacy {:.1f} ms, reflow {:.1f} us, {:.0f}x'.format(
+            lang, len(text), old * 1e3, new * 1e6, old / new))
+        if args.show:
+            print('  legacy: {!r}'.format(legacy_unwrap(text)))
+            print('  reflow: {!r}'.format(unwrap(text, lang)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Initialized OCR engines, kept around between calls.
+
+Creating an engine is the slow part of OCR: PyTessBaseAPI loads the
+traineddata of its languages, easyocr.Reader loads a neural model. The
+pool keeps idle engines keyed by (engine, lang, psm) and hands them out
+one caller at a time, since neither engine is safe to share between
+threads. Images are passed in memory, as PIL images or numpy arrays.
+
+    text = ENGINES.ocr(image, 'nor+eng')
+    with ENGINES.tesseract('nor', PSM.AUTO) as api:
+        api.SetImage(image)
+        ...
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+from tesserocr import PSM, PyTessBaseAPI
+
+TESSERACT = 'tesseract'
+EASYOCR = 'easyocr'
+MAX_IDLE = 2 # idle engines kept per key, more only exist while callers overlap
+
+def as_pil(image) -> Image.Image:
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image)
+    return Image.open(image)
+
+def create(engine, lang, psm):
+    started = time.monotonic()
+    if engine == TESSERACT:
+        api = PyTessBaseAPI(lang=lang, psm=psm)
+    elif engine == EASYOCR:
+        import easyocr
+        api = easyocr.Reader(lang.split(','))
+    else:
+        raise ValueError('Unknown OCR engine: {}'.format(engine))
+    logging.info('Created %s engine lang=%s psm=%s in %.2fs', engine, lang, psm, time.monotonic() - started)
+    return api
+
+class EnginePool:
+    def __init__(self, max_idle=MAX_IDLE):
+        self.max_idle = max_idle
+        self.idle = defaultdict(list) # (engine, lang, psm) -> engines nobody uses
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, engine, lang, psm=None):
+        key = (engine, lang, psm)
+        with self.lock:
+            api = self.idle[key].pop() if self.idle[key] else None
+        if api is None:
+            api = create(engine, lang, psm)
+        try:
+            yield api
+        except BaseException:
+            self.close(api) # may be in the middle of something
+            raise
+        with self.lock:
+            if len(self.idle[key]) < self.max_idle:
+                self.idle[key].append(api)
+                return
+        self.close(api)
+
+    def tesseract(self, lang, psm=PSM.SINGLE_COLUMN):
+        return self.acquire(TESSERACT, lang, psm)
+
+    def warm(self, engine, lang, psm=None):
+        """Creates an engine ahead of the first call, in the background."""
+        def run():
+            with self.acquire(engine, lang, psm):
+                pass
+        threading.Thread(target=run, daemon=True).start()
+
+    def ocr(self, image, lang, engine=TESSERACT, psm=PSM.SINGLE_COLUMN) -> str:
+        image = as_pil(image)
+        if engine == EASYOCR:
+            with self.acquire(EASYOCR, lang) as reader:
+                return '\n'.join(reader.readtext(np.asarray(image.convert('RGB')), detail=0))
+        with self.acquire(engine, lang, psm) as api:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+
+    def close(self, api):
+        if isinstance(api, PyTessBaseAPI):
+            api.End()
+
+    def clear(self):
+        with self.lock:
+            engines = [api for apis in self.idle.values() for api in apis]
+            self.idle.clear()
+        for api in engines:
+            self.close(api)
+
+ENGINES = EnginePool()
@@ -0,0 +1,140 @@
+"""
+Reflow of OCR output: tesseract breaks lines where the captured column
+ends, this joins them back into paragraphs.
+
+The break between two lines is decided from the lines themselves:
+- a hyphen between two lowercase letters is a hyphenated word, it is
+  joined without the hyphen; other hyphens join and stay (NRK-sjefen);
+- a line starting with a dialogue dash, a bullet or a number keeps its
+  break;
+- a line ending a sentence keeps its break before a line starting one.
+  Abbreviations of the OCR languages (f.eks., т.е.) and initials do not
+  end sentences;
+- a line much shorter than the longest one (a heading, the last line of
+  a paragraph) keeps its break before a line starting with a capital;
+- other lines are joined with a space.
+Empty lines separate paragraphs, the output has one paragraph per line.
+Line and paragraph separators (U+2028, U+2029), which some applications
+put in copied text at wrapped lines, are line breaks like '\n'.
+
+The rules are built once at import. Reflow keeps its state between
+chunks, so multi-page OCR can be fed page by page: feed returns the
+paragraphs that are settled, the last one waits for the next page in
+case it goes on there.
+"""
+import re
+
+SHORT_LINE = 0.6 # of the longest line, shorter lines end their paragraph before a capital
+SENTENCE_END = '.!?…'
+OPENING = '"\'«„“‘(['
+CLOSING = '"\'»”’)]'
+HYPHENS = '-\u00ad\u2010\u2011' # hyphen-minus, soft, hyphen, non-breaking
+LINE_BREAKS = str.maketrans({'\u2028': '\n', '\u2029': '\n'})
+
+# only those that rarely end a sentence, "osv." and "и т.д." often do
+ABBREVIATIONS = {
+    'nor': 'adm ang bl.a ca dvs el evt f.eks f.o.m ft hhv iflg jf kap kl m.a.o mht nr pga sen st stk t.o.m tlf vs',
+    'rus': 'в г д им и.о к напр ок пр проф р с см ср ст стр т т.е т.к ул ч',
+    'eng': 'approx dr e.g fig i.e jr mr mrs ms pp prof sr st vol vs',
+}
+LANGS = {'no': 'nor', 'nb': 'nor', 'nn': 'nor', 'nob': 'nor', 'nno': 'nor', 'ru': 'rus', 'en': 'eng'}
+
+RX_LANGS = re.compile(r'[+,\s]+')
+RX_SPACE = re.compile(r'[ \t\f\v\u00a0\u202f]+')
+RX_ITEM = re.compile(r'(?:[-\u2013\u2014\u2022\u00b7*]|\d{1,3}[.)])\s')
+
+def abbreviations(lang=None):
+    """Abbreviations of the languages in lang ('nor+rus', 'no,ru'), of all of them when None."""
+    if lang is None:
+        names = list(ABBREVIATIONS)
+    else:
+        names = [LANGS.get(name, name) for name in RX_LANGS.split(lang.lower()) if name]
+    return frozenset(word for name in names for word in ABBREVIATIONS.get(name, '').split())
+
+def starts_sentence(line):
+    first = line.lstrip(OPENING)[:1]
+    return first.isupper() or first.isdigit()
+
+class Reflow:
+    def __init__(self, lang=None):
+        self.abbreviations = abbreviations(lang)
+        self.longest = 0
+        self.last = None # last line fed, the break after it is not decided yet
+        self.paragraph = ''
+        self.rest = '' # a chunk may end in the middle of a line
+
+    def ends_sentence(self, line):
+        line = line.rstrip(CLOSING)
+        if not line or line[-1] not in SENTENCE_END:
+            return False
+        if line[-1] != '.':
+            return True
+        word = line[:-1].rsplit(' ', 1)[-1].lstrip(OPENING).lower()
+        if len(word) == 1 and word.isalpha():
+            return False # an initial
+        return word not in self.abbreviations
+
+    def breaks(self, a, b):
+        """Whether the break between lines a and b stays."""
+        if RX_ITEM.match(b):
+            return True
+        if not starts_sentence(b):
+            return False
+        return self.ends_sentence(a) or len(a) < SHORT_LINE * self.longest
+
+    def push(self, lines):
+        lines = [RX_SPACE.sub(' ', line).strip() for line in lines]
+        self.longest = max([self.longest] + [len(line) for line in lines])
+        out = []
+        for line in lines:
+            if not line:
+                if self.last is not None:
+                    out.append(self.paragraph)
+                    self.paragraph, self.last = '', None
+                continue
+            a = self.last
+            if a is None:
+                self.paragraph = line
+            elif a[-1] in HYPHENS and len(a) > 1 and a[-2].isalnum() and line[0].isalnum():
+                if a[-2].islower() and line[0].islower():
+                    self.paragraph = self.paragraph[:-1] + line
+                else:
+                    self.paragraph += line
+            elif self.breaks(a, line):
+                out.append(self.paragraph)
+                self.paragraph = line
+            else:
+                self.paragraph += ' ' + line
+            self.last = line
+        return ''.join(paragraph + '\n' for paragraph in out)
+
+    def feed(self, text):
+        """Takes the next chunk (a page), returns the paragraphs that are complete, one per line."""
+        lines = (self.rest + text.translate(LINE_BREAKS)).split('\n')
+        self.rest = lines.pop()
+        return self.push(lines)
+
+    def close(self):
+        """Returns the rest, without a newline at the end."""
+        out = self.push([self.rest])
+        self.rest = ''
+        if self.last is not None:
+            out += self.paragraph
+            self.paragraph, self.last = '', None
+        return out.rstrip('\n')
+
+def unwrap(text, lang=None):
+    reflow = Reflow(lang)
+    return (reflow.feed(text) + reflow.close()).rstrip('\n')
+
+def unwrap_pages(pages, lang=None):
+    """Reflows pages as they come, a paragraph may go on from one page to the next."""
+    reflow = Reflow(lang)
+    for page in pages:
+        # the end of a page is not the end of a paragraph
+        out = reflow.feed(page.rstrip() + '\n')
+        if out:
+            yield out
+    out = reflow.close()
+    if out:
+        yield out
@@ -0,0 +1,66 @@
+from yatetradki.uitools.textmarksman.reflow import Reflow, abbreviations, unwrap, unwrap_pages
+
+
+class TestHyphens:
+    def test_hyphenated_word_is_joined(self):
+        assert 'ved fjorden sammen med mora' == unwrap('ved fjor-\nden sammen med mora')
+
+    def test_compound_keeps_hyphen(self):
+        assert 'om NRK-serien han så' == unwrap('om NRK-\nserien han så')
+
+    def test_paragraph_separator_is_a_line_break(self):
+        assert 'first para secondhalf' == unwrap('first para\u2029second-\u2029half')
+        assert 'ved fjorden' == unwrap('ved fjor-\u2028den')
+
+    def test_whitespace_is_collapsed(self):
+        assert 'Det var en gang' == unwrap('  Det  var\ten gang \n\n')
+
+
+class TestSentences:
+    def test_abbreviation_does_not_end_sentence(self):
+        text = 'Han leser mange bøker om havet, f.eks.\nNansen og Amundsen skrev mye om det.'
+        assert 'Han leser mange bøker om havet, f.eks. Nansen og Amundsen skrev mye om det.' == unwrap(text, 'nor')
+        assert 'Han leser mange bøker om havet, f.eks.\nNansen' == unwrap('Han leser mange bøker om havet, f.eks.\nNansen', 'rus')
+
+    def test_russian_abbreviation_and_initials(self):
+        text = 'Мы часто ходили гулять, т.е.\nПочти каждый день я вспоминал А. С.\nПушкина наизусть и читал вслух.'
+        assert ('Мы часто ходили гулять, т.е. Почти каждый день я вспоминал А. С. Пушкина наизусть и читал вслух.'
+                == unwrap(text, 'rus'))
+
+    def test_sentence_end_before_capital_breaks(self):
+        text = 'Det var en gang en gutt som het Per.\nHan bodde ved fjorden med mora si.'
+        assert text == unwrap(text, 'nor')
+
+    def test_short_line_before_capital_breaks(self):
+        text = 'Kapittel en\nDet var en gang en gutt som het Per og bodde ved fjorden'
+        assert text == unwrap(text)
+
+    def test_languages(self):
+        assert 'f.eks' in abbreviations('nor+eng')
+        assert 'т.е' not in abbreviations('no,en')
+        assert 'т.е' in abbreviations()
+
+
+class TestItems:
+    def test_dialogue_and_list_items_keep_breaks(self):
+        assert '— Hvor skal du?\n— Ned til båten' == unwrap('— Hvor skal du?\n— Ned til båten')
+        assert 'handle\n1. melk\n2. brød' == unwrap('handle\n1. melk\n2. brød')
+
+    def test_empty_line_separates_paragraphs(self):
+        assert 'en to\ntre fire' == unwrap('en\nto\n\ntre\nfire')
+
+
+class TestStreaming:
+    def test_chunks_split_inside_a_line(self):
+        reflow = Reflow('nor')
+        out = reflow.feed('Det var en gang en gutt som het Per og han bodde ved fjor-\nden sam')
+        out += reflow.feed('men med mora si.\n\nNeste avsnitt')
+        out += reflow.close()
+        assert 'Det var en gang en gutt som het Per og han bodde ved fjorden sammen med mora si.\nNeste avsnitt' == out
+
+    def test_paragraph_goes_on_across_pages(self):
+        pages = ['Det var en gang en gutt som het Per og han bodde ved fjor-\n\x0c',
+                 'den sammen med mora si.\n\nSlutt.\n\x0c']
+        out = list(unwrap_pages(pages, 'nor'))
+        assert 'Det var en gang en gutt som het Per og han bodde ved fjorden sammen med mora si.\nSlutt.' == ''.join(out)
+        assert 'Slutt.' == out[-1]
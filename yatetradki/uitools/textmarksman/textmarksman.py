@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 
 import os
-import re
 import sys
 import argparse
 import subprocess
+from io import BytesIO
 from typing import Optional
 import tesserocr
 from tesserocr import PSM, OEM, PyTessBaseAPI, RIL
@@ -12,17 +12,18 @@ from PIL import Image, ImageDraw
 # import pytesseract
 import pyperclip
 
+from yatetradki.uitools.textmarksman.engines import EASYOCR, ENGINES, as_pil
+from yatetradki.uitools.textmarksman.reflow import unwrap
 #from yatetradki.uitools.textmarksman.deskew_wrapper import deskew
 
 EXIT_OK = 0
 EXIT_CANCEL = 1
 
-def capture() -> Optional[str]:
-    filename = '/tmp/textmarksman.png'
-    #filename = '/tmp/textmarksman.jpg'
-    p = subprocess.run(['maim', '-s', '-o', filename])
+def capture() -> Optional[Image.Image]:
+    # bmp is the cheapest format for maim to write and for PIL to read
+    p = subprocess.run(['maim', '-s', '-o', '-f', 'bmp'], stdout=subprocess.PIPE)
     if p.returncode == 0:
-        return filename
+        return Image.open(BytesIO(p.stdout))
     return None
 
 def ensure_dir(name):
@@ -40,7 +41,7 @@ def ensure_dir(name):
 #         SYMBOL: character within a word.
 #     """
 
-def ocr(filename: str, lang: str) -> str:
+def ocr(image, lang: str) -> str:
     # https://github.com/sirfz/tesserocr/blob/master/tesseract.pxd#L293
     # OSD_ONLY,                # Orientation and script detection only.
     # AUTO_OSD,                # Automatic page segmentation with orientation and
@@ -62,26 +63,7 @@ def ocr(filename: str, lang: str) -> str:
     # COUNT                    # Number of enum entries.
     #print(pytesseract.image_to_boxes(Image.open(filename), lang=lang))
     modes = [RIL.BLOCK, RIL.PARA, RIL.TEXTLINE, RIL.WORD, RIL.SYMBOL]
-    with PyTessBaseAPI(lang=lang, psm=PSM.SINGLE_COLUMN) as api:
-        api.SetImageFile(filename)
-        return api.GetUTF8Text()
-
-def unwrap(text: str) -> str:
-    upper = "".join([chr(i) for i in range(sys.maxunicode) if chr(i).isupper()])
-    # remove trailing whitespace
-    text = re.sub(r'\s+$', '', text)
-    text = re.sub(r' +\n', '\n', text)
-    text = re.sub(r'\n +', '\n', text)
-    # join hyphen
-    text = re.sub(r'[-\u2014]\s*\u2029\s*', '', text)
-    expr = r'([^\.\n])\n(?![\n' + upper + '])'
-    text = re.sub(expr, r'\1 ', text)
-    # collapse spaces
-    text = re.sub(r'[ \t]+', ' ', text)
-    #text = re.sub(r'[\n]+', '\n', text)
-    # remove 2 consecutive newlines
-    text = re.sub(r'\n\n', '\n', text)
-    return text
+    return ENGINES.ocr(image, lang, psm=PSM.SINGLE_COLUMN)
 
 def copy(text: str) -> str:
     pyperclip.copy(text)
@@ -98,17 +80,18 @@ def parse_args():
     return parser.parse_args()
 
 def do_generic(engine, filename: Optional[str], lang: str, is_unproject: bool, is_sayit: bool) -> int:
-    filename = filename if filename else capture()
-    if filename:
+    image = as_pil(filename) if filename else capture()
+    if image is not None:
         #deskew(filename, filename)
         #text = ocr(filename, 'nor+rus')
         if is_unproject:
-            dest = '/tmp/unproject.jpg'
-            from yatetradki.uitools.textmarksman.unproject.unproject_text import unproject
-            unproject(filename, dest)
-            filename = dest
-        text = engine(filename, lang)
-        text = unwrap(text)
+            import cv2
+            import numpy as np
+            from yatetradki.uitools.textmarksman.unproject.unproject_text import MAX_SIDE, unproject_image
+            bgr = cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+            image = Image.fromarray(cv2.cvtColor(unproject_image(bgr, MAX_SIDE), cv2.COLOR_BGR2RGB))
+        text = engine(image, lang)
+        text = unwrap(text, lang)
         copy(text)
         notify('OCR', "%s" % (text,))
         print(text)
@@ -121,12 +104,8 @@ def do_generic(engine, filename: Optional[str], lang: str, is_unproject: bool, i
 def do_tesseract(filename: Optional[str], lang: str, is_unproject: bool, is_sayit: bool) -> int:
     return do_generic(ocr, filename, lang, is_unproject, is_sayit)
 
-def engine_easyocr(filename: str, lang: str) -> str:
-    import easyocr
-    reader = easyocr.Reader(lang.split(','))
-    result = reader.readtext(filename, detail=0)
-    text = '\n'.join(result)
-    return text
+def engine_easyocr(image, lang: str) -> str:
+    return ENGINES.ocr(image, lang, engine=EASYOCR)
 
 def do_easyocr(filename: Optional[str], lang: str, is_unproject: bool, is_sayit: bool) -> int:
     return do_generic(engine_easyocr, filename, lang, is_unproject, is_sayit)
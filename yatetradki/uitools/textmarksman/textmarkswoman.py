@@ -83,6 +83,9 @@ from PyQt6.QtWidgets import QMenu
 from PyQt6.QtWidgets import QSystemTrayIcon
 from PyQt6.QtWidgets import QWidget
 
+from tesserocr import PSM
+
+from yatetradki.uitools.textmarksman.engines import EASYOCR, ENGINES, TESSERACT
 from yatetradki.uitools.textmarksman.textmarksman import do_easyocr
 from yatetradki.uitools.textmarksman.textmarksman import do_tesseract
 
@@ -147,7 +150,10 @@ class SystemTrayIcon(QSystemTrayIcon):
         exit = menu.addAction("Exit")
         exit.triggered.connect(app.quit)
 
+        # engines take a while to load, have the selected one ready before the capture
+        menu.triggered.connect(self.warm)
         self.setContextMenu(menu)
+        self.warm()
 
     def langs(self):
         langs = []
@@ -159,19 +165,32 @@ class SystemTrayIcon(QSystemTrayIcon):
             langs.append('ru')
         return langs
 
+    def tesseract_langs(self):
+        mapping = {'en': 'eng', 'no': 'nor', 'ru': 'rus'}
+        return '+'.join(remap(self.langs(), mapping))
+
+    def easyocr_langs(self):
+        return ','.join(self.langs())
+
+    def warm(self):
+        if not self.langs(): return
+        if self.eng_tesseract.isChecked():
+            ENGINES.warm(TESSERACT, self.tesseract_langs(), PSM.SINGLE_COLUMN)
+        if self.eng_easyocr.isChecked():
+            ENGINES.warm(EASYOCR, self.easyocr_langs())
+
     def on_capture(self):
         print("Greet")
         unproject = self.unproject.isChecked()
         pronounce = self.pronounce.isChecked()
         filename = None
         if self.eng_tesseract.isChecked():
-            mapping = {'en': 'eng', 'no': 'nor', 'ru': 'rus'}
             print(self.langs())
-            langs = '+'.join(remap(self.langs(), mapping))
+            langs = self.tesseract_langs()
             print(langs)
             do_tesseract(filename, langs, unproject, pronounce)
         if self.eng_easyocr.isChecked():
-            langs = ','.join(self.langs())
+            langs = self.easyocr_langs()
             do_easyocr(filename, langs, unproject, pronounce)
 
 def main():
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Times the stages of unproject_text on sample photos.
+
+    python -m yatetradki.uitools.textmarksman.unproject.benchmark photo1.jpg photo2.jpg
+    python -m yatetradki.uitools.textmarksman.unproject.benchmark  # synthetic pages
+
+Without arguments it renders pages of text, warps them with a known
+perspective and rotation, and runs on those. Each image is unprojected at
+full resolution and with the coarse orientation and slant search
+(--max-side).
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from yatetradki.uitools.textmarksman.unproject import unproject_text as ut
+
+WORDS = 'det var en gang en gutt som het Per han bodde ved fjorden og likte å lese bøker om havet'.split()
+
+def synthetic_page(width, height, a, b, theta, seed=1):
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 235, np.uint8)
+    size = width / 1500.0
+    for y in range(int(120*size), height - int(80*size), int(56*size)):
+        x = int(100*size)
+        while True:
+            word = WORDS[rng.integers(len(WORDS))]
+            (w, _), _ = cv2.getTextSize(word + ' ', cv2.FONT_HERSHEY_SIMPLEX, size, 3)
+            if x + w > width - 100*size: break
+            cv2.putText(img, word, (x, y), cv2.FONT_HERSHEY_SIMPLEX, size, (20, 20, 20), 3, cv2.LINE_AA)
+            x += w
+    u0, v0 = width/2.0, height/2.0
+    R = np.dot(ut.translation(u0, v0), np.dot(ut.rotation(theta), ut.translation(-u0, -v0)))
+    H = np.dot(ut.centered_warp(u0, v0, a, b), R)
+    img = cv2.warpPerspective(img, H, (width, height), borderMode=cv2.BORDER_REPLICATE)
+    return cv2.GaussianBlur(img, (3, 3), 0)
+
+def samples(paths):
+    if paths:
+        return [(path, cv2.imread(path)) for path in paths]
+    return [
+        ('synthetic 1200x900', synthetic_page(1200, 900, 0.0002, 0.0001, 0.1)),
+        ('synthetic 2400x1800', synthetic_page(2400, 1800, 0.00012, 0.00008, 0.12)),
+        ('synthetic 4000x3000', synthetic_page(4000, 3000, -0.00006, 0.00009, -0.2)),
+    ]
+
+def timed(stages, name, f, *args):
+    started = time.perf_counter()
+    result = f(*args)
+    stages[name] = stages.get(name, 0.0) + time.perf_counter() - started
+    return result
+
+def run(img, max_side):
+    """unproject_image, stage by stage."""
+    stages = {}
+    contours, hierarchy = timed(stages, 'contours', ut.get_contours, img)
+    conics, contours, centroid = timed(stages, 'conics', ut.get_conics, img, contours, hierarchy)
+    H = timed(stages, 'optimize', ut.optimize_conics, conics, centroid)
+    f = 1.0
+    if max_side and max(img.shape[:2]) > max_side:
+        f = float(max_side) / max(img.shape[:2])
+    S = np.diag([f, f, 1.0])
+    Sinv = np.diag([1.0/f, 1.0/f, 1.0])
+    small = [c * np.float32(f) for c in contours]
+    RH = timed(stages, 'orientation', ut.orientation_detect, img, small, np.dot(S, np.dot(H, Sinv)))
+    SRH, pts = timed(stages, 'skew', ut.skew_detect, img, small, RH)
+    SRH = np.dot(Sinv, np.dot(SRH, S))
+    timed(stages, 'warp', ut.warp_containing_points, img, pts / np.float32(f), SRH)
+    return stages, SRH, len(conics)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark unproject_text')
+    parser.add_argument('images', nargs='*', help='Photos to unproject, synthetic pages if none')
+    parser.add_argument('--max-side', type=int, default=ut.MAX_SIDE, help='Size of the coarse search')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per image, the best one is shown')
+    args = parser.parse_args()
+
+    quiet = lambda *a, **k: None
+    ut.print = quiet # the stages report what they found on stdout
+    for name, img in samples(args.images):
+        print('{} ({}x{})'.format(name, img.shape[1], img.shape[0]))
+        for label, max_side in (('full', None), ('coarse', args.max_side)):
+            runs = [run(img, max_side) for _ in range(args.repeat)]
+            stages, SRH, n = min(runs, key=lambda r: sum(r[0].values()))
+            print('  {:6s} total={:.3f}s conics={} {}'.format(
+                label, sum(stages.values()), n,
+                ' '.join('{}={:.3f}'.format(k, v) for k, v in stages.items())))
+            print('         H={}'.format(np.round(SRH / SRH[2, 2], 5).tolist()))
+
+if __name__ == '__main__':
+    main()
@@ -161,7 +161,7 @@ def _gparams_sincos_from_moments(m):
     b *= scl
 
     sincos = numpy.array([C-A-U, B])
-    sincos /= numpy.linalg.norm(sincos)
+    sincos /= numpy.linalg.norm(sincos, axis=0)
 
     s, c = sincos
 
@@ -216,6 +216,24 @@ describe an ellipse, then this returns infinity, infinity.
 
     return k, ab
 
+def conics_area(conics):
+
+    '''The ab of conic_scale for an array of conics, one per row, computed
+for all of them at once. Rows that do not describe an ellipse get
+infinity.
+
+    '''
+
+    A, B, C, D, E, F = numpy.asarray(conics).T
+
+    T = 4*A*C - B*B
+    S = A*E**2 + B**2*F + C*D**2 - B*D*E - 4*A*C*F
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ab = 2.0*S/(T*numpy.sqrt(T))
+
+    return numpy.where((T < 0.0) | (S == 0), numpy.inf, ab)
+
 def conic_from_points(x, y):
 
     '''Fits conic pararameters using homogeneous least squares. The
@@ -259,6 +277,26 @@ https://en.wikipedia.org/wiki/Matrix_representation_of_conic_sections).
 
     return numpy.array((A, B, C, D, E, F))
 
+def conics_transform(conics, H):
+
+    '''conic_transform for an array of conics, one per row: all the
+symmetric matrices go through the homography in one batched product.
+
+    '''
+
+    A, B, C, D, E, F = numpy.asarray(conics).T
+
+    M = numpy.stack((A, 0.5*B, 0.5*D,
+                     0.5*B, C, 0.5*E,
+                     0.5*D, 0.5*E, F), axis=-1).reshape((-1, 3, 3))
+
+    Hinv = numpy.linalg.inv(H)
+
+    M = numpy.matmul(Hinv.T, numpy.matmul(M, Hinv))
+
+    return numpy.stack((M[:, 0, 0], M[:, 0, 1]*2, M[:, 1, 1],
+                        M[:, 0, 2]*2, M[:, 1, 2]*2, M[:, 2, 2]), axis=-1)
+
 def _conic_from_gparams_sincos(gparams_sincos):
 
     x0, y0, a, b, s, c = gparams_sincos
@@ -291,6 +329,17 @@ def conic_from_moments(moments):
     
     return _conic_from_gparams_sincos(g)
 
+def conics_from_moments(moments):
+
+    '''conic_from_moments for an array of moments, one per row. The
+formulas are elementwise, so they run on the columns.
+
+    '''
+
+    g = _gparams_sincos_from_moments(numpy.asarray(moments).T)
+
+    return _conic_from_gparams_sincos(g).T
+
 ######################################################################
 
 MOMENTS_NAMES = ('m00', 'm10', 'm01', 'mu20', 'mu11', 'mu02')
@@ -301,6 +350,32 @@ def moments_from_dict(m):
     '''Create shape moments tuple from a dictionary (i.e. returned by cv2.moments).'''
     return numpy.array([m[n] for n in MOMENTS_NAMES])
 
+RAW_MOMENTS_NAMES = ('m00', 'm10', 'm01', 'm20', 'm11', 'm02')
+
+def raw_moments_from_dict(m):
+
+    '''Raw moments up to order 2 from a dictionary (i.e. returned by
+cv2.moments). Unlike central moments these are additive: the moments
+of a shape with holes are those of its outline minus those of the
+holes.
+
+    '''
+    return numpy.array([m[n] for n in RAW_MOMENTS_NAMES])
+
+def moments_from_raw(raw):
+
+    '''Shape moments from raw moments, for one set or an array of them,
+one per row.
+
+    '''
+
+    m00, m10, m01, m20, m11, m02 = numpy.moveaxis(numpy.asarray(raw), -1, 0)
+
+    return numpy.stack((m00, m10, m01,
+                        m20 - m10*m10/m00,
+                        m11 - m10*m01/m00,
+                        m02 - m01*m01/m00), axis=-1)
+
 def moments_str(m):
     '''Convert shape moments to nice printable string.'''
     return _params_str(MOMENTS_DISPLAY_NAMES, m)
@@ -11,12 +11,17 @@ import cv2
 
 from yatetradki.uitools.textmarksman.unproject import ellipse
 
+DEBUG = False # draw the intermediate images, only the final one is needed otherwise
 DEBUG_IMAGES = []
+MAX_SIDE = 1600 # unproject_image estimates on a copy at most this large
 
 def debug_show(name, src):
 
     global DEBUG_IMAGES
 
+    if not DEBUG and name != 'final':
+        return
+
     filename = 'debug{:02d}_{}.png'.format(len(DEBUG_IMAGES), name)
     #cv2.imwrite(filename, src)
 
@@ -52,13 +57,14 @@ def softmax(x, k=1.0):
     b = x.max()
     return np.log( np.exp(k*(x-b)).sum() ) / k + b
 
-def skewed_widths(contours, H):
-    xvals = []
-    for c in contours:
-        pts = cv2.perspectiveTransform(c, H)
-        x = pts[:,:,0]
-        xvals.append( x.max() - x.min() )
-    xvals = np.array(xvals)
+def stack_contours(contours):
+    # all points in one array, so that each step transforms them in one call
+    starts = np.cumsum([0] + [len(c) for c in contours[:-1]])
+    return np.vstack(tuple(contours)).astype(np.float32), starts
+
+def skewed_widths(points, starts, H):
+    x = cv2.perspectiveTransform(points, H)[:,0,0]
+    xvals = np.maximum.reduceat(x, starts) - np.minimum.reduceat(x, starts)
     return softmax(xvals, 0.1)
 
 def centered_warp(u0, v0, a, b):
@@ -91,17 +97,8 @@ def warp_containing_points(img, pts, H, border=4, shape_only=False):
 
 def conic_area_discrepancy(conics, x, H, opt_results=None):
 
-    areas = []
-
-    for conic in conics:
-        cx = ellipse.conic_transform(conic, H)
-        k, ab = ellipse.conic_scale(cx)
-        if np.isinf(ab):
-            areas.append(1e20)
-        else:
-            areas.append(ab)
-
-    areas = np.array(areas)
+    areas = ellipse.conics_area(ellipse.conics_transform(conics, H))
+    areas[np.isinf(areas)] = 1e20
 
     areas /= areas.mean() # rescale so mean is 1.0
     areas -= 1 # subtract off mean
@@ -114,7 +111,7 @@ def conic_area_discrepancy(conics, x, H, opt_results=None):
 
     return rval
 
-def threshold(img):
+def threshold(img, block_size=101):
 
     if len(img.shape) > 2:
         img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
@@ -124,11 +121,11 @@ def threshold(img):
         img = 255-img
 
     return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
-                                 cv2.THRESH_BINARY_INV, 101, 21)
+                                 cv2.THRESH_BINARY_INV, block_size, 21)
 
-def get_contours(img):
+def get_contours(img, block_size=101):
 
-    work = threshold(img)
+    work = threshold(img, block_size)
 
     debug_show('threshold', work)
 
@@ -142,102 +139,81 @@ def get_conics(img, contours, hierarchy,
 
     hierarchy = hierarchy.reshape((-1, 4))
 
-    conics = []
-    used_contours = []
-    areas = []
-    okcontours = []
-    allchildren = []
-    pts = np.empty((0,1,2), dtype='float32')
-    centroid_accum = np.zeros(2)
-    total_area = 0.0
-
-    centroids = []
-
     abs_area_cutoff *= img.shape[0] * img.shape[1]
     print('abs_area_cutoff = ',abs_area_cutoff)
 
-    for i, (c, h) in enumerate(zip(contours, hierarchy.reshape((-1, 4)))):
+    # moments of every contour at once; an outline with holes (RETR_CCOMP
+    # makes them its children) gets the moments of the holes subtracted
+    raw = np.array([ellipse.raw_moments_from_dict(cv2.moments(c))
+                    for c in contours]).reshape((-1, 6))
+    parent_idx = hierarchy[:,3]
+    big = raw[:,0] > abs_area_cutoff
 
-        next_idx, prev_idx, child_idx, parent_idx = h
+    top = np.where((parent_idx < 0) & big)[0]
+    used = np.zeros(len(contours), dtype=bool)
+    used[top] = True
+    holes = np.where((parent_idx >= 0) & big & used[parent_idx])[0]
 
-        if parent_idx >= 0:
-            continue
+    np.subtract.at(raw, parent_idx[holes], raw[holes])
+    m = ellipse.moments_from_raw(raw[top])
 
-        m = ellipse.moments_from_dict(cv2.moments(c))
+    okcontours = [contours[i] for i in top]
+    allchildren = [contours[i] for i in holes]
+    centroids = m[:,1:3] / m[:,:1]
+    centroid_accum = m[:,1:3].sum(axis=0)
+    total_area = m[:,0].sum()
+    conics = ellipse.conics_from_moments(m)
+    areas = m[:,0]
 
-        if m[0] <= abs_area_cutoff:
-            continue
+    if DEBUG:
 
-        children = []
+        display = img.copy()
+        cv2.drawContours(display, okcontours+allchildren,
+                         -1, (0, 255, 0),
+                         6, cv2.LINE_AA)
 
-        while child_idx >= 0:
-            child_contour = contours[child_idx]
-            cm = cv2.moments(child_contour)
-            if cm['m00'] > abs_area_cutoff:
-                children.append(child_contour)
-                allchildren.append(child_contour)
-            child_idx = hierarchy[child_idx][0]
+        debug_show('contours_only', display)
 
-        if children:
-            work = np.zeros(img.shape[:2], dtype=np.uint8)
-            cv2.drawContours(work, contours, i, (1,1,1), -1)
-            cv2.drawContours(work, children, -1, (0,0,0), -1)
-            m = ellipse.moments_from_dict(cv2.moments(work, True))
+        for c, a in zip(okcontours, areas):
 
-        centroids.append(m[1:3]/m[0])
-        centroid_accum += m[1:3]
-        total_area += m[0]
-        pts = np.vstack((pts, c.astype('float32')))
-        conic = ellipse.conic_from_moments(m)
-        okcontours.append(c)
-        conics.append(conic)
-        areas.append(m[0])
-
-    display = img.copy()
-    cv2.drawContours(display, okcontours+allchildren,
-                     -1, (0, 255, 0),
-                     6, cv2.LINE_AA)
+            x, y, w, h = cv2.boundingRect(c)
 
-    debug_show('contours_only', display)
 
-    for c, a in zip(okcontours, areas):
+            s = str('{:,d}'.format(int(a)))
+            #ctr = (x + w/2 - 15*len(s), y+h/2+10)
+            ctr = (x, y+h+20)
 
-        x, y, w, h = cv2.boundingRect(c)
+            cv2.putText(display, s, ctr,
+                        cv2.FONT_HERSHEY_SIMPLEX, 2.0,
+                        (0, 0, 0), 12, cv2.LINE_AA)
 
+            cv2.putText(display, s, ctr,
+                        cv2.FONT_HERSHEY_SIMPLEX, 2.0,
+                        (0, 255, 0), 6, cv2.LINE_AA)
 
-        s = str('{:,d}'.format(int(a)))
-        #ctr = (x + w/2 - 15*len(s), y+h/2+10)
-        ctr = (x, y+h+20)
+        debug_show('contours', display)
 
-        cv2.putText(display, s, ctr,
-                    cv2.FONT_HERSHEY_SIMPLEX, 2.0,
-                    (0, 0, 0), 12, cv2.LINE_AA)
-
-        cv2.putText(display, s, ctr,
-                    cv2.FONT_HERSHEY_SIMPLEX, 2.0,
-                    (0, 255, 0), 6, cv2.LINE_AA)
-
-    debug_show('contours', display)
-
-    areas = np.array(areas)
     amean = areas.mean()
 
     print('got {} contours with {} small.'.format(
         len(areas), (areas < mean_area_cutoff*amean).sum()))
 
-    idx = np.where(areas > mean_area_cutoff*amean)[0]
+    # a blob with equal second moments along every axis has no orientation,
+    # its conic comes out as nan
+    idx = np.where((areas > mean_area_cutoff*amean) & np.isfinite(conics).all(axis=1))[0]
 
-    conics = np.array(conics)
     conics = conics[idx]
     centroid_accum /= total_area
 
-    display = img.copy()
-    for conic in conics:
-        x0, y0, a, b, theta = ellipse.gparams_from_conic(conic)
-        cv2.ellipse(display, (int(x0), int(y0)), (int(a), int(b)),
-                    theta*180/np.pi, 0, 360, (0,0,255), 6, cv2.LINE_AA)
+    if DEBUG:
 
-    debug_show('conics', display)
+        display = img.copy()
+        for conic in conics:
+            x0, y0, a, b, theta = ellipse.gparams_from_conic(conic)
+            cv2.ellipse(display, (int(x0), int(y0)), (int(a), int(b)),
+                        theta*180/np.pi, 0, 360, (0,0,255), 6, cv2.LINE_AA)
+
+        debug_show('conics', display)
 
     contours = [okcontours[i].astype('float32') for i in idx]
 
@@ -347,9 +323,9 @@ def orientation_detect(img, contours, H, rho=8.0, ntheta=512):
 
     text_edges = np.zeros(shape, dtype=np.uint8)
 
-    for contour in contours:
-        contour = cv2.perspectiveTransform(contour.astype(np.float32), TH)
-        cv2.drawContours(text_edges, [contour.astype(int)], 0, (255,255,255))
+    points, starts = stack_contours(contours)
+    points = cv2.perspectiveTransform(points, TH).astype(int)
+    cv2.drawContours(text_edges, np.split(points, starts[1:]), -1, (255,255,255))
 
     debug_show('edges', text_edges)
 
@@ -414,7 +390,7 @@ def orientation_detect(img, contours, H, rho=8.0, ntheta=512):
     # compose with previous homography
     RH = np.dot(rotation(-theta), H)
 
-    if 1: # just debug visualization
+    if DEBUG: # just debug visualization
 
         debug_hist = (255*hist/hist.max()).astype('uint8')
         debug_hist = cv2.cvtColor(debug_hist, cv2.COLOR_GRAY2RGB)
@@ -454,61 +430,84 @@ def skew_detect(img, contours, RH):
     hulls = [cv2.convexHull(c) for c in contours]
     pts = np.vstack(tuple(hulls))
 
+    if DEBUG:
 
+        display, TRH = warp_containing_points(img, pts, RH)
 
-    display, TRH = warp_containing_points(img, pts, RH)
-
-    for h in hulls:
-        h = cv2.perspectiveTransform(h, TRH).astype(int)
-        cv2.drawContours(display, [h], 0, (255, 0, 255), 6, cv2.LINE_AA)
+        for h in hulls:
+            h = cv2.perspectiveTransform(h, TRH).astype(int)
+            cv2.drawContours(display, [h], 0, (255, 0, 255), 6, cv2.LINE_AA)
 
-    debug_show('convex_hulls_before', display)
+        debug_show('convex_hulls_before', display)
 
-    f = lambda x: skewed_widths(contours, np.dot(slant(x), RH))
+    # the extremes of a contour through a homography are on its hull
+    points, starts = stack_contours(hulls)
+    f = lambda x: skewed_widths(points, starts, np.dot(slant(x), RH))
 
     res = scipy.optimize.minimize_scalar(f, (-2.0, 0.0, 2.0))
 
     SRH = np.dot(slant(res.x), RH)
-    warped, Hfinal = warp_containing_points(img, pts, SRH)
 
-    display = warped.copy()
+    if DEBUG:
 
-    for h in hulls:
-        h = cv2.perspectiveTransform(h, Hfinal).astype(int)
-        cv2.drawContours(display, [h], 0, (255, 0, 255), 6, cv2.LINE_AA)
+        warped, Hfinal = warp_containing_points(img, pts, SRH)
 
-    debug_show('convex_hulls_after', display)
+        display = warped.copy()
 
-    debug_show('final', warped)
+        for h in hulls:
+            h = cv2.perspectiveTransform(h, Hfinal).astype(int)
+            cv2.drawContours(display, [h], 0, (255, 0, 255), 6, cv2.LINE_AA)
+
+        debug_show('convex_hulls_after', display)
 
-    return SRH
+    return SRH, pts
 
 
-def unproject(src, dest):
+def unproject_image(img, max_side=None):
+
+    '''Returns img with the text made horizontal, scaled down to fit the
+debug display size like the other debug images.
+
+The perspective comes from conics fitted at full resolution. With
+max_side, orientation and slant, which only look at the overall layout
+of the contours, are searched on the contours scaled down to fit
+max_side (coarse) and then applied to the full image (fine).
+
+    '''
+
     global DEBUG_IMAGES
     DEBUG_IMAGES = []
-    img = cv2.imread(src)
     debug_show('input', img)
+
     contours, hierarchy = get_contours(img)
     conics, contours, centroid = get_conics(img, contours, hierarchy)
     H = optimize_conics(conics, centroid)
-    RH = orientation_detect(img, contours, H)
-    SRH = skew_detect(img, contours, RH)
-    cv2.imwrite(dest, DEBUG_IMAGES[-1])
 
-def main():
+    f = 1.0
+    if max_side and max(img.shape[:2]) > max_side:
+        f = float(max_side) / max(img.shape[:2])
+    S = np.diag([f, f, 1.0])
+    Sinv = np.diag([1.0/f, 1.0/f, 1.0])
 
-    img = cv2.imread(sys.argv[1])
-    debug_show('input', img)
+    # the image is only drawn on for debugging
+    work = cv2.resize(img, (0, 0), None, f, f, cv2.INTER_AREA) if DEBUG and f < 1.0 else img
+    small = [c * np.float32(f) for c in contours] if f < 1.0 else contours
+    RH = orientation_detect(work, small, np.dot(S, np.dot(H, Sinv)))
+    SRH, pts = skew_detect(work, small, RH)
+    SRH = np.dot(Sinv, np.dot(SRH, S))
 
-    contours, hierarchy = get_contours(img)
+    warped, _ = warp_containing_points(img, pts / np.float32(f), SRH)
+    debug_show('final', warped)
 
-    conics, contours, centroid = get_conics(img, contours, hierarchy)
-    H = optimize_conics(conics, centroid)
-    RH = orientation_detect(img, contours, H)
-    SRH = skew_detect(img, contours, RH)
+    return DEBUG_IMAGES[-1]
+
+def unproject(src, dest, max_side=None):
+    cv2.imwrite(dest, unproject_image(cv2.imread(src), max_side))
+
+def main():
+
+    unproject(sys.argv[1], sys.argv[2])
 
-    cv2.imwrite(sys.argv[2], DEBUG_IMAGES[-1])
     #for img in DEBUG_IMAGES:
     #    cv2.imshow('Debug', img)
     #    while cv2.waitKey(5) < 0:
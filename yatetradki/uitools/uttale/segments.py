@@ -0,0 +1,187 @@
+"""
+Encoded audio segments for uttale, cached in memory and on disk.
+
+SegmentCache.get(path, start, end) returns the ogg bytes of that piece of
+path. Hits come from an in-memory LRU bounded in bytes, then from the disk
+cache, which evicts the least recently used files once it is over its
+budget. Keys include the mtime of path, so a re-encoded source is cut
+again. Misses run ffmpeg in a pool of worker threads. A request for a
+segment that is already being encoded waits for that run, and when too
+many encodes are queued get raises Busy instead of queueing more.
+"""
+
+import hashlib
+import logging
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os.path import abspath, expanduser, join
+
+CACHE_DIR = expanduser('~/.cache/uttale/segments')
+MEMORY_BYTES = 64 * 1024 * 1024
+DISK_BYTES = 1024 * 1024 * 1024
+WORKERS = 4 # concurrent ffmpeg processes
+QUEUE = 32 # encodes running or waiting, more get Busy
+PREFETCH_QUEUE = QUEUE // 2 # prefetches are dropped above that, the rest is left for requests
+
+class Busy(Exception):
+    pass
+
+class SegmentCache:
+    def __init__(self, directory=CACHE_DIR, memory_bytes=MEMORY_BYTES, disk_bytes=DISK_BYTES, workers=WORKERS, queue=QUEUE):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.queue = queue
+        self.memory = OrderedDict() # key -> bytes, least recently used first
+        self.memory_used = 0
+        self.pending = {} # key -> Future of the encode
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='ffmpeg')
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.tmp'):
+                os.remove(entry.path) # left over from a crash
+            elif entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name, st.st_size))
+        self.disk = OrderedDict((name, size) for _, name, size in sorted(entries)) # name -> size, least recently used first
+        self.disk_used = sum(self.disk.values())
+
+    def key(self, path, start, end):
+        path = abspath(path)
+        return path, os.stat(path).st_mtime, start, end
+
+    def name(self, key):
+        return hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest() + '.ogg'
+
+    def get(self, path, start, end):
+        key = self.key(path, start, end)
+        data = self.lookup(key)
+        if data is None:
+            data = self.submit(key, self.queue).result()
+        return data
+
+    def file(self, path, start, end):
+        """Name of the cache file with the segment, for players that want a file."""
+        key = self.key(path, start, end)
+        name = self.name(key)
+        with self.lock:
+            cached = name in self.disk
+            if cached:
+                self.disk.move_to_end(name) # about to be played, evicted last
+                self.hits += 1
+            else:
+                self.misses += 1
+        filename = join(self.directory, name)
+        if cached:
+            try:
+                os.utime(filename)
+            except OSError:
+                cached = False # evicted in the meantime
+        if not cached:
+            self.submit(key, self.queue).result()
+        return filename
+
+    def prefetch(self, path, start, end):
+        """Starts encoding the segment unless it is cached or the queue is busy, does not wait."""
+        key = self.key(path, start, end)
+        with self.lock:
+            if key in self.memory or self.name(key) in self.disk:
+                return
+        try:
+            self.submit(key, PREFETCH_QUEUE)
+        except Busy:
+            pass
+
+    def lookup(self, key):
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return data
+            name = self.name(key)
+            if name not in self.disk:
+                self.misses += 1
+                return None
+            self.disk.move_to_end(name)
+            self.hits += 1
+        try:
+            path = join(self.directory, name)
+            os.utime(path) # the order of the disk cache survives restarts
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None # evicted in the meantime
+        self.remember(key, data)
+        return data
+
+    def submit(self, key, limit):
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                if len(self.pending) >= limit:
+                    raise Busy(f'{len(self.pending)} audio segments are being encoded')
+                future = self.pending[key] = self.pool.submit(self.encode, key)
+            return future
+
+    def encode(self, key):
+        path, _, start, end = key
+        try:
+            proc = subprocess.run(['ffmpeg', '-nostdin', '-ss', str(start), '-t', str(end - start), '-i', path, '-f', 'ogg', 'pipe:1'],
+                                  capture_output=True, check=True)
+            data = proc.stdout
+            name = self.name(key)
+            tmp = join(self.directory, name + '.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, join(self.directory, name))
+            with self.lock:
+                self.disk_used += len(data) - self.disk.pop(name, 0)
+                self.disk[name] = len(data)
+                self.evict_disk()
+            self.remember(key, data)
+            return data
+        except subprocess.CalledProcessError as e:
+            logging.warning('ffmpeg failed on %s %s-%s: %s', path, start, end, e.stderr.decode(errors='replace')[-500:])
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def remember(self, key, data):
+        with self.lock:
+            if key in self.memory or len(data) > self.memory_bytes:
+                return
+            self.memory[key] = data
+            self.memory_used += len(data)
+            while self.memory_used > self.memory_bytes:
+                _, old = self.memory.popitem(last=False)
+                self.memory_used -= len(old)
+
+    def evict_disk(self):
+        # caller holds the lock
+        while self.disk_used > self.disk_bytes and len(self.disk) > 1:
+            name, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            try:
+                os.remove(join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory_used,
+                'disk_entries': len(self.disk),
+                'disk_bytes': self.disk_used,
+                'encoding': len(self.pending),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -1,12 +1,39 @@
-import argparse, subprocess, webvtt, uvicorn, duckdb, multiprocessing as mp, threading, time, os, tempfile
-from fastapi import FastAPI, HTTPException, Response, BackgroundTasks
+import argparse, subprocess, webvtt, uvicorn, duckdb, multiprocessing as mp, threading, os, hashlib, math, re
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import FastAPI, HTTPException, Request, Response, BackgroundTasks
 from typing import List, Dict
 from os.path import join, relpath, exists, splitext
 from tqdm import tqdm
-import polars as pl
+import pyarrow as pa
+from segments import CACHE_DIR, Busy, SegmentCache
 
 app = FastAPI()
 db_duckdb = None
+segments = None
+reindex_lock = threading.Lock()
+
+BATCH_ROWS = 50000 # rows per Arrow batch on the way into DuckDB
+SERIAL_FILES = 16 # fewer changed files than that are parsed without a process pool
+TERM_SPLIT = r'[^\p{L}\p{N}]+' # lines are split into terms on this, in DuckDB's regex syntax
+RX_TERM = re.compile(r'[^\W_]+') # and queries on this, the same in Python's
+MAX_TERMS = 16 # vocabulary terms a query word expands to, whole word first, then the most frequent
+PARTIAL = 0.5 # weight of a query word found inside a longer term
+LOOKUP_ROWS = 2048 # lines fetched by id at once, DuckDB looks up at most that many in an index
+RESORT_FRACTION = 0.1 # terms is re-sorted once that much of it was appended since the last sort
+PREFETCH_LINES = 5 # lines after the one listened to that are encoded in advance
+RX_RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+SCHEMA_VERSION = 2 # stored in state, a database of another version is reindexed from scratch
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lines (id BIGINT, filename VARCHAR, start VARCHAR, end_time VARCHAR, text VARCHAR);
+CREATE INDEX IF NOT EXISTS lines_id ON lines (id);
+CREATE TABLE IF NOT EXISTS files (filename VARCHAR PRIMARY KEY, mtime DOUBLE, size BIGINT, hash VARCHAR, first BIGINT, last BIGINT);
+CREATE TABLE IF NOT EXISTS terms (term VARCHAR, len INTEGER, id BIGINT);
+CREATE TABLE IF NOT EXISTS vocab (term VARCHAR, df BIGINT);
+CREATE TABLE IF NOT EXISTS scopes (scope VARCHAR, files BIGINT, lines BIGINT);
+CREATE TABLE IF NOT EXISTS state (key VARCHAR PRIMARY KEY, value BIGINT);
+"""
 
 def parse_time(t: str) -> float:
     h, m, s = t.split(':')
@@ -26,68 +53,178 @@ def process_vtt(vtt: str, root: str) -> List[tuple]:
     except:
         return []
 
-def reindex_worker_duckdb(vtt_files: List[str], root: str, return_dict, idx: int, counter, lock: mp.Lock):
-    rows = []
-    for vtt in vtt_files:
-        captions = process_vtt(vtt, root)
-        rows.extend(captions)
-        with lock:
-            counter.value +=1
-    return_dict[idx] = rows
-
-def update_progress(total: int, counter, lock: mp.Lock, stop_event: threading.Event, description: str):
-    with tqdm(total=total, desc=description) as pbar:
-        while not stop_event.is_set():
-            with lock:
-                current = counter.value
-            pbar.n = current
-            pbar.refresh()
-            if current >= total:
-                break
-            time.sleep(0.5)
-        pbar.n = total
-        pbar.refresh()
-
-def reindex(root: str):
-    global db_duckdb
-    db_duckdb.execute("DROP TABLE IF EXISTS lines")
-    db_duckdb.execute("CREATE TABLE lines (filename VARCHAR, start VARCHAR, end_time VARCHAR, text VARCHAR)")
+def list_vtt(root: str) -> List[str]:
     try:
         fd = subprocess.run(['fd', '--type', 'f', '--extension', 'vtt', '--base-directory', root], capture_output=True, text=True, check=True)
-        vtt_files = fd.stdout.splitlines()
-    except:
-        vtt_files = []
-    total_files = len(vtt_files)
-    if not vtt_files:
+        return fd.stdout.splitlines()
+    except (OSError, subprocess.CalledProcessError):
+        return [relpath(join(base, f), root) for base, _, files in os.walk(root, followlinks=True) for f in files if f.endswith('.vtt')]
+
+def file_hash(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+def parse_changed(job: tuple) -> tuple:
+    """Runs in the pool: (vtt, root, old hash) -> (vtt, mtime, size, hash, rows), rows is None when the content is the same."""
+    vtt, root, old_hash = job
+    path = join(root, vtt)
+    try:
+        st = os.stat(path)
+        digest = file_hash(path)
+    except OSError:
+        return vtt, None, None, None, None
+    if digest == old_hash:
+        return vtt, st.st_mtime, st.st_size, digest, None
+    return vtt, st.st_mtime, st.st_size, digest, process_vtt(vtt, root)
+
+def parsed(jobs: List[tuple]):
+    if len(jobs) < SERIAL_FILES:
+        yield from map(parse_changed, jobs)
         return
-    manager = mp.Manager()
-    return_dict = manager.dict()
-    counter = manager.Value('i',0)
-    lock = manager.Lock()
-    num_processes = min(mp.cpu_count(),8)
-    chunk_size = (total_files + num_processes -1)//num_processes
-    chunks = [vtt_files[i:i+chunk_size] for i in range(0, total_files, chunk_size)]
-    jobs = []
-    for idx, chunk in enumerate(chunks):
-        p = mp.Process(target=reindex_worker_duckdb, args=(chunk, root, return_dict, idx, counter, lock))
-        jobs.append(p)
-        p.start()
-    stop_event = threading.Event()
-    progress_thread = threading.Thread(target=update_progress, args=(total_files, counter, lock, stop_event, "Reindexing DuckDB"))
-    progress_thread.start()
-    for p in jobs:
-        p.join()
-    stop_event.set()
-    progress_thread.join()
-    all_rows = []
-    for idx in range(len(chunks)):
-        all_rows.extend(return_dict.get(idx, []))
-    if all_rows:
-        df = pl.DataFrame(all_rows, schema=["filename", "start", "end_time", "text"])
-        db_duckdb.register("df", df)
-        db_duckdb.execute("INSERT INTO lines SELECT filename, start, end_time, text FROM df")
-        db_duckdb.unregister("df")
-    db_duckdb.commit()
+    pool = ProcessPoolExecutor(min(mp.cpu_count(), 8))
+    try:
+        yield from pool.map(parse_changed, jobs, chunksize=8)
+    finally:
+        pool.shutdown()
+
+def create_schema(con) -> bool:
+    """Creates the tables, returns True if they are from another version or a reindex that did not finish, and were dropped."""
+    tables = {row[0] for row in con.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+    version = None
+    if 'state' in tables:
+        version = (con.execute("SELECT value FROM state WHERE key = 'schema_version'").fetchone() or [None])[0]
+    # before version 2 lines had no ids, or ids from a sequence that could interleave the ranges of files
+    outdated = bool(tables & {'lines', 'files'}) and version != SCHEMA_VERSION
+    if outdated:
+        con.execute("DROP TABLE IF EXISTS lines; DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS terms; DROP TABLE IF EXISTS vocab; DROP TABLE IF EXISTS scopes")
+    con.execute(SCHEMA)
+    return outdated
+
+def insert_arrow(con, table: str, columns: Dict[str, list]):
+    con.register('arrow_batch', pa.table(columns))
+    con.execute(f"INSERT INTO {table} SELECT * FROM arrow_batch")
+    con.unregister('arrow_batch')
+
+def update_vocab(con, full: bool):
+    """Applies vocab_delta, the df changes of the removed and added lines, to vocab, or rebuilds vocab if full."""
+    if full:
+        con.execute("DELETE FROM vocab; INSERT INTO vocab SELECT term, count(*) FROM terms GROUP BY term")
+        return
+    con.execute("CREATE OR REPLACE TEMP TABLE vocab_delta AS SELECT term, sum(n) AS n FROM vocab_delta GROUP BY term HAVING sum(n) <> 0")
+    con.execute("UPDATE vocab SET df = vocab.df + vocab_delta.n FROM vocab_delta WHERE vocab.term = vocab_delta.term")
+    con.execute("INSERT INTO vocab SELECT term, n FROM vocab_delta WHERE term NOT IN (SELECT term FROM vocab)")
+    con.execute("DELETE FROM vocab WHERE df <= 0")
+
+def update_search_tables(con, appended: int):
+    con.execute("DELETE FROM scopes")
+    con.execute("""
+        INSERT INTO scopes SELECT SPLIT_PART(filename, '/', 1) || '/' || SPLIT_PART(filename, '/', 2) AS scope, count(*), sum(last - first + 1)
+        FROM files WHERE first IS NOT NULL GROUP BY scope""")
+    # lookups by term only skip row groups while terms is sorted, appended rows are not
+    unsorted = appended + (con.execute("SELECT value FROM state WHERE key = 'unsorted_terms'").fetchone() or [0])[0]
+    if unsorted > RESORT_FRACTION * con.execute("SELECT count(*) FROM terms").fetchone()[0]:
+        con.execute("CREATE OR REPLACE TABLE terms AS SELECT * FROM terms ORDER BY term, len, id")
+        unsorted = 0
+    con.execute("INSERT OR REPLACE INTO state VALUES ('unsorted_terms', ?)", (unsorted,))
+
+def reindex(root: str) -> bool:
+    """
+    Brings lines up to date with the .vtt files under root. Files whose
+    mtime and size are as recorded in the files table are skipped, the rest
+    are hashed and, if the hash changed, parsed in a process pool. Rows go
+    to a staging table in Arrow batches and replace the rows of their files
+    in one transaction, so searches see either the old or the new lines.
+    The same transaction keeps the search side tables in step: terms of
+    the new lines, vocab and scopes. Returns False if another reindex is
+    already running.
+    """
+    if not reindex_lock.acquire(blocking=False):
+        return False
+    try:
+        con = db_duckdb.cursor()
+        create_schema(con)
+        known = {row[0]: row[1:] for row in con.execute("SELECT filename, mtime, size, hash FROM files").fetchall()}
+        vtt_files = sorted(list_vtt(root)) # files of a directory get neighbouring ids
+        jobs = []
+        for vtt in vtt_files:
+            try:
+                st = os.stat(join(root, vtt))
+            except OSError:
+                continue
+            old = known.get(vtt)
+            if old is None or (old[0], old[1]) != (st.st_mtime, st.st_size):
+                jobs.append((vtt, root, old[2] if old else None))
+        gone = sorted(set(known) - set(vtt_files))
+        if not jobs and not gone:
+            return True
+
+        con.execute("CREATE OR REPLACE TEMP TABLE lines_stage AS SELECT id AS pos, * EXCLUDE (id) FROM lines LIMIT 0")
+        batch = {'pos': [], 'filename': [], 'start': [], 'end_time': [], 'text': []}
+        pos = 0 # of the row in staging order, lines get last + 1 + pos as id
+        files = {'filename': [], 'mtime': [], 'size': [], 'hash': []}
+        stale = list(gone)
+        for vtt, mtime, size, digest, rows in tqdm(parsed(jobs), total=len(jobs), desc="Reindexing DuckDB"):
+            if mtime is None:
+                continue
+            for key, value in zip(files, (vtt, mtime, size, digest)):
+                files[key].append(value)
+            if rows is None:
+                continue
+            stale.append(vtt)
+            for row in rows:
+                for column, value in zip(batch.values(), (pos,) + row):
+                    column.append(value)
+                pos += 1
+            if len(batch['filename']) >= BATCH_ROWS:
+                insert_arrow(con, 'lines_stage', batch)
+                batch = {key: [] for key in batch}
+        if batch['filename']:
+            insert_arrow(con, 'lines_stage', batch)
+
+        con.execute("BEGIN TRANSACTION")
+        try:
+            # the new lines are the ones above the current maximum, each file gets a contiguous
+            # range of them in staging order, which files.first/last and scopes rely on
+            last = con.execute("SELECT coalesce(max(id), -1) FROM lines").fetchone()[0]
+            con.execute("CREATE OR REPLACE TEMP TABLE vocab_delta (term VARCHAR, n BIGINT)")
+            if not known:
+                con.execute("DELETE FROM lines; DELETE FROM terms") # rows from before files were tracked
+            elif stale:
+                con.register('stale', pa.table({'filename': stale}))
+                con.execute("CREATE OR REPLACE TEMP TABLE stale_ids AS SELECT id FROM lines WHERE filename IN (SELECT filename FROM stale)")
+                con.execute("INSERT INTO vocab_delta SELECT term, -count(*) FROM terms WHERE id IN (SELECT id FROM stale_ids) GROUP BY term")
+                con.execute("DELETE FROM terms WHERE id IN (SELECT id FROM stale_ids)")
+                con.execute("DELETE FROM lines WHERE filename IN (SELECT filename FROM stale)")
+                con.execute("DELETE FROM files WHERE filename IN (SELECT filename FROM stale)")
+                con.execute("DROP TABLE stale_ids")
+                con.unregister('stale')
+            con.execute("INSERT INTO lines SELECT ? + 1 + pos, * EXCLUDE (pos) FROM lines_stage", (last,))
+            added = con.execute(f"""
+                INSERT INTO terms SELECT DISTINCT term, len, id FROM (
+                    SELECT id, length(text)::INTEGER AS len, unnest(string_split_regex(lower(text), '{TERM_SPLIT}')) AS term
+                    FROM lines WHERE id > ?)
+                WHERE term <> '' ORDER BY term, len, id""", (last,)).fetchone()[0]
+            con.execute("INSERT INTO vocab_delta SELECT term, count(*) FROM terms WHERE id > ? GROUP BY term", (last,))
+            if files['filename']:
+                con.register('checked', pa.table(files))
+                con.execute("UPDATE files SET mtime = checked.mtime, size = checked.size FROM checked WHERE files.filename = checked.filename")
+                con.execute("""
+                    INSERT INTO files SELECT checked.*, min(lines.id), max(lines.id)
+                    FROM checked LEFT JOIN lines ON lines.filename = checked.filename AND lines.id > ?
+                    WHERE checked.filename NOT IN (SELECT filename FROM files) GROUP BY ALL""", (last,))
+                con.unregister('checked')
+            update_vocab(con, not known)
+            update_search_tables(con, added if known else 0)
+            con.execute("INSERT OR REPLACE INTO state VALUES ('schema_version', ?)", (SCHEMA_VERSION,)) # the index is complete
+            con.execute("COMMIT")
+        except:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("DROP TABLE lines_stage; DROP TABLE vocab_delta")
+        print(f"Reindexed {len(stale) - len(gone)} changed and {len(gone)} removed of {len(vtt_files)} files")
+        return True
+    finally:
+        reindex_lock.release()
 
 # @app.get("/uttale/Scopes")
 # def scopes(q: str = "") -> List[str]:
@@ -101,22 +238,92 @@ def reindex(root: str):
 @app.get("/uttale/Scopes")
 def scopes(q: str = "", limit: int = 100) -> List[str]:
     try:
-        cursor = db_duckdb.execute("SELECT DISTINCT SPLIT_PART(filename, '/', 1) || '/' || SPLIT_PART(filename, '/', 2) AS scope FROM lines WHERE scope LIKE ? ORDER BY scope DESC LIMIT ?", (f"%{q}%", limit)).fetchall()
+        cursor = db_duckdb.cursor().execute("SELECT scope FROM scopes WHERE scope LIKE ? ORDER BY scope DESC LIMIT ?", (f"%{q}%", limit)).fetchall()
         return [row[0] for row in cursor]
     except:
         return []
 
+def expand_words(con, q: str) -> List[tuple]:
+    """Query words as (df, word, vocabulary terms containing it, idf weight), rarest first, [] if any has no terms."""
+    total = con.execute("SELECT coalesce(sum(lines), 0) FROM scopes").fetchone()[0]
+    words = []
+    for word in dict.fromkeys(RX_TERM.findall(q.lower())):
+        terms = con.execute("SELECT term, df FROM vocab WHERE contains(term, ?) ORDER BY term <> ?, df DESC LIMIT ?", (word, word, MAX_TERMS)).fetchall()
+        if not terms:
+            return []
+        df = sum(row[1] for row in terms)
+        words.append((df, word, [row[0] for row in terms], math.log(1 + total / df)))
+    return sorted(words)
+
+def check_lines(con, ids: List[int], score: float, words: List[tuple], found: List[tuple], limit: int):
+    """Adds the lines of ids that have all of words to found, until there are limit of them."""
+    start, size = 0, limit
+    while start < len(ids) and len(found) < limit:
+        chunk = ids[start:start + size]
+        for id, filename, begin, end, text in con.execute(f"SELECT id, filename, start, end_time, text FROM lines WHERE id IN ({', '.join('?' * len(chunk))})", chunk).fetchall():
+            lower = text.lower()
+            line_terms = set(RX_TERM.findall(lower))
+            total = score
+            for _, word, _, weight in words:
+                if word in line_terms:
+                    total += weight
+                elif word in lower:
+                    total += weight * PARTIAL
+                else:
+                    break
+            else:
+                found.append((-total, len(text), id, filename, begin, end, text))
+        start, size = start + size, min(size * 2, LOOKUP_ROWS)
+
+def find_lines(con, q: str, scope: str, limit: int) -> List[tuple]:
+    """
+    Lines with every word of q in them, as a term of its own or inside a
+    longer one, best first: whole words score more than parts of words,
+    rare words more than frequent ones, and shorter lines come first.
+
+    The rarest word picks the candidates from terms, the whole word before
+    the terms it is a part of. terms is sorted by line length within a
+    term, so a LIMIT per term reads the shortest lines and stops. The other
+    words and the scope are checked on the candidates, and only if too few
+    pass are more of them read.
+    """
+    words = expand_words(con, q)
+    if not words:
+        return []
+    ranges = []
+    if scope:
+        ranges = con.execute("SELECT first, last FROM files WHERE filename LIKE ? AND first IS NOT NULL ORDER BY first", (f"{scope}%",)).fetchall()
+        if not ranges:
+            return []
+    starts = [first for first, _ in ranges]
+    low, high = (ranges[0][0], ranges[-1][1]) if ranges else (0, 2 ** 63 - 1)
+    in_scope = lambda id: not ranges or id <= ranges[bisect_right(starts, id) - 1][1]
+    _, first_word, terms, weight = words[0]
+    seen, found = set(), []
+    for group, score in ([first_word], weight), ([term for term in terms if term != first_word], weight * PARTIAL):
+        group = [term for term in group if term in terms]
+        per_term = limit * 4
+        while group and len(found) < limit:
+            rows = con.execute(' UNION ALL '.join(['(SELECT id, len, term FROM terms WHERE term = ? AND id BETWEEN ? AND ? LIMIT ?)'] * len(group)),
+                               [x for term in group for x in (term, low, high, per_term)]).fetchall()
+            candidates = sorted({(length, id) for id, length, _ in rows if id not in seen and in_scope(id)})
+            seen.update(id for _, id in candidates)
+            check_lines(con, [id for _, id in candidates], score, words[1:], found, limit)
+            counts = Counter(term for _, _, term in rows)
+            if all(counts[term] < per_term for term in group):
+                break
+            per_term *= 8
+    return [row[3:] for row in sorted(found)[:limit]]
+
 @app.get("/uttale/Search")
 def search(q: str, scope: str = "", limit: int = 100) -> List[Dict]:
     try:
-        cursor = db_duckdb.execute(
-            "SELECT filename, start, end_time, text FROM lines WHERE filename LIKE ? AND text LIKE ? LIMIT ?",
-            (f"{scope}%", f"%{q}%", limit)).fetchall()
+        rows = find_lines(db_duckdb.cursor(), q, scope, limit)
     except:
         raise HTTPException(status_code=500, detail="DuckDB search query failed")
-    return [{"filename": row[0], "text": row[3], "start": row[1], "end": row[2]} for row in cursor]
+    return [{"filename": row[0], "text": row[3], "start": row[1], "end": row[2]} for row in rows]
 
-def get_audio_segment(filename: str, start: str, end: str) -> bytes:
+def segment(filename: str, start: str, end: str) -> tuple:
     o = splitext(join(args.root, filename))[0] + '.ogg'
     if not exists(o):
         raise HTTPException(status_code=404, detail="File not found")
@@ -125,49 +332,76 @@ def get_audio_segment(filename: str, start: str, end: str) -> bytes:
         end_sec = parse_time(end)
     except:
         raise HTTPException(status_code=400, detail="Invalid time format")
-    duration = end_sec - start_sec
-    if duration <=0:
+    if end_sec <= start_sec:
         raise HTTPException(status_code=400, detail="End time must be greater than start time")
+    return o, start_sec, end_sec
+
+def get_audio_segment(filename: str, start: str, end: str, as_file: bool = False):
+    """Ogg bytes of the segment, or the name of a cache file with them if as_file."""
+    key = segment(filename, start, end)
     try:
-        proc = subprocess.run(['ffmpeg', '-ss', str(start_sec), '-t', str(duration), '-i', o, '-f', 'ogg', 'pipe:1'], capture_output=True, check=True)
-        return proc.stdout
+        return segments.file(*key) if as_file else segments.get(*key)
+    except Busy:
+        raise HTTPException(status_code=503, detail="Too many audio segments are being encoded", headers={"Retry-After": "1"})
     except:
         raise HTTPException(status_code=500, detail="Audio processing failed")
 
+def prefetch(filename: str, start: str):
+    """Encodes the lines after start in filename, so listening to them in a row does not wait for ffmpeg."""
+    try:
+        con = db_duckdb.cursor()
+        ids = con.execute("SELECT first, last FROM files WHERE filename = ?", (filename,)).fetchone()
+        if not ids or ids[0] is None:
+            return
+        o = splitext(join(args.root, filename))[0] + '.ogg'
+        for begin, end in con.execute("SELECT start, end_time FROM lines WHERE id BETWEEN ? AND ? AND filename = ? AND start > ? ORDER BY start LIMIT ?",
+                                      (*ids, filename, start, args.prefetch)).fetchall():
+            segments.prefetch(o, parse_time(begin), parse_time(end))
+    except (duckdb.Error, OSError, ValueError):
+        pass
+
+def range_response(data: bytes, range_header: str, headers: Dict[str, str]) -> Response:
+    """200 with all of data, or 206 with the part asked for in a single "bytes=first-last" range."""
+    headers = dict(headers, **{"Accept-Ranges": "bytes"})
+    match = RX_RANGE.match(range_header or "")
+    if not match or match.groups() == ("", ""):
+        return Response(content=data, media_type="audio/ogg", headers=headers)
+    first, last = match.groups()
+    size = len(data)
+    if first:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        first, last = max(size - int(last), 0), size - 1
+    if first > last:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    return Response(content=data[first:last + 1], status_code=206, media_type="audio/ogg", headers=headers)
+
 @app.get("/uttale/Play")
 def play(filename: str, start: str, end: str, background_tasks: BackgroundTasks):
+    path = get_audio_segment(filename, start, end, as_file=True)
     try:
-        audio_data = get_audio_segment(filename, start, end)
-    except HTTPException as e:
-        raise e
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as tmp:
-        tmp.write(audio_data)
-        tmp_path = tmp.name
-    try:
-        subprocess.Popen(['play', tmp_path])
+        subprocess.Popen(['play', path])
     except:
         raise HTTPException(status_code=500, detail="Audio playback failed")
-    def cleanup(tmp_file):
-        try:
-            time.sleep(5)
-            if exists(tmp_file):
-                os.remove(tmp_file)
-        except:
-            pass
-    background_tasks.add_task(cleanup, tmp_path)
+    background_tasks.add_task(prefetch, filename, start)
     return {"status": "playing"}
 
 @app.get("/uttale/Audio")
-def audio_endpoint(filename: str, start: str, end: str):
-    try:
-        audio_data = get_audio_segment(filename, start, end)
-    except HTTPException as e:
-        raise e
+def audio_endpoint(filename: str, start: str, end: str, request: Request, background_tasks: BackgroundTasks):
+    audio_data = get_audio_segment(filename, start, end)
+    background_tasks.add_task(prefetch, filename, start)
     headers = {"Cache-Control": "max-age=86400"}
-    return Response(content=audio_data, media_type="application/octet-stream", headers=headers)
+    return range_response(audio_data, request.headers.get("range"), headers)
+
+@app.get("/uttale/Stats")
+def stats() -> Dict:
+    return segments.stats()
 
 @app.post("/uttale/Reindex")
 def trigger_reindex(background_tasks: BackgroundTasks):
+    if reindex_lock.locked():
+        return {"status": "Reindexing is already running"}
     background_tasks.add_task(reindex, args.root)
     return {"status": "Reindexing started in background"}
 
@@ -176,8 +410,14 @@ if __name__ == "__main__":
     parser.add_argument('--root', default='.')
     parser.add_argument('--iface', default='0.0.0.0:7010')
     parser.add_argument('--reindex', action='store_true', default=False)
+    parser.add_argument('--segments', default=CACHE_DIR, help='Directory for cached audio segments')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH_LINES, help='Lines after the one played to encode in advance')
     args = parser.parse_args()
     db_duckdb = duckdb.connect('lines_duckdb.db')
+    segments = SegmentCache(args.segments)
+    if create_schema(db_duckdb) and not args.reindex:
+        print("The index is from an older version of uttale, reindexing")
+        args.reindex = True
     if args.reindex:
         reindex(args.root)
     try:
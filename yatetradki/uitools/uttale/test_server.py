@@ -0,0 +1,115 @@
+import os
+from argparse import Namespace
+from os.path import join
+from tempfile import TemporaryDirectory
+
+import duckdb
+
+import server
+
+WORDS = 'god morgen alle sammen hei hvordan går det bra takk'.split()
+
+
+def write_vtt(root, name, lines, word):
+    os.makedirs(join(root, os.path.dirname(name)), exist_ok=True)
+    with open(join(root, name), 'w') as f:
+        f.write('WEBVTT\n\n')
+        for i in range(lines):
+            t = '{:02d}:{:02d}:{:02d}'.format(i // 3600, i // 60 % 60, i % 60)
+            f.write('{}.000 --> {}.500\n'.format(t, t))
+            f.write('{} {} {}\n\n'.format(word, WORDS[i % len(WORDS)], i))
+
+
+def setup_db(threads=8):
+    server.db_duckdb = duckdb.connect(':memory:')
+    server.db_duckdb.execute('SET threads = {}'.format(threads))
+    server.create_schema(server.db_duckdb)
+    return server.db_duckdb
+
+
+def check_ranges(con):
+    for filename, first, last in con.execute('SELECT filename, first, last FROM files').fetchall():
+        others = con.execute('SELECT count(*) FROM lines WHERE id BETWEEN ? AND ? AND filename <> ?', (first, last, filename)).fetchone()[0]
+        assert 0 == others, filename
+        assert last - first + 1 == con.execute('SELECT count(*) FROM lines WHERE filename = ?', (filename,)).fetchone()[0]
+
+
+def check_vocab(con):
+    vocab = dict(con.execute('SELECT term, df FROM vocab').fetchall())
+    assert vocab == dict(con.execute('SELECT term, count(*) FROM terms GROUP BY term').fetchall())
+
+
+class TestReindex:
+    def test_files_get_contiguous_ids(self):
+        # more lines than a row group, so DuckDB inserts them with several threads
+        with TemporaryDirectory() as root:
+            for i in range(40):
+                write_vtt(root, 's{}/e{}/episode.vtt'.format(i % 4, i), 8000, 'morgen')
+            con = setup_db()
+            assert server.reindex(root)
+            check_ranges(con)
+            check_vocab(con)
+            assert 40 * 8000 == con.execute('SELECT sum(lines) FROM scopes').fetchone()[0]
+
+    def test_scoped_search_stays_in_scope(self):
+        with TemporaryDirectory() as root:
+            for i in range(40):
+                write_vtt(root, 's{}/e{}/episode.vtt'.format(i % 4, i), 300, 'morgen')
+            setup_db()
+            assert server.reindex(root)
+            for scope in ('s1/', 's2/e6/'):
+                rows = server.search('morgen', scope=scope, limit=1000)
+                assert rows
+                assert all(row['filename'].startswith(scope) for row in rows)
+
+    def test_incremental(self):
+        with TemporaryDirectory() as root:
+            for i in range(20):
+                write_vtt(root, 's0/e{}/episode.vtt'.format(i), 50, 'morgen')
+            con = setup_db()
+            assert server.reindex(root)
+            write_vtt(root, 's0/e3/episode.vtt', 80, 'kveld')
+            os.remove(join(root, 's0/e4/episode.vtt'))
+            write_vtt(root, 's1/e0/episode.vtt', 10, 'natt')
+            assert server.reindex(root)
+            check_ranges(con)
+            check_vocab(con)
+            assert 0 == con.execute("SELECT count(*) FROM files WHERE filename = 's0/e4/episode.vtt'").fetchone()[0]
+            assert ['s0/e3/episode.vtt'] == sorted({row['filename'] for row in server.search('kveld', limit=1000)})
+            assert 18 * 50 == len([row for row in server.search('morgen', limit=10000) if row['text'].startswith('morgen')])
+
+    def test_outdated_schema_is_dropped(self):
+        con = duckdb.connect(':memory:')
+        con.execute('CREATE TABLE lines (filename VARCHAR, start VARCHAR, end_time VARCHAR, text VARCHAR)')
+        con.execute('CREATE TABLE files (filename VARCHAR PRIMARY KEY, mtime DOUBLE, size BIGINT, hash VARCHAR)')
+        assert server.create_schema(con)
+        assert 'first' in [row[0] for row in con.execute('DESCRIBE files').fetchall()]
+
+    def test_lines_from_before_files_are_dropped(self):
+        con = duckdb.connect(':memory:')
+        con.execute('CREATE TABLE lines (filename VARCHAR, start VARCHAR, end_time VARCHAR, text VARCHAR)')
+        assert server.create_schema(con)
+        assert 'id' in [row[0] for row in con.execute('DESCRIBE lines').fetchall()]
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def prefetch(self, path, start, end):
+        self.calls.append((path, start, end))
+
+
+class TestPrefetch:
+    def test_only_lines_of_the_file(self):
+        with TemporaryDirectory() as root:
+            for i in range(3):
+                write_vtt(root, 's0/e{}/episode.vtt'.format(i), 20, 'morgen')
+            con = setup_db()
+            assert server.reindex(root)
+            # even if the recorded range of the file covered other files' lines
+            con.execute("UPDATE files SET first = 0, last = 1000 WHERE filename = 's0/e1/episode.vtt'")
+            server.args = Namespace(root=root, prefetch=5)
+            server.segments = Recorder()
+            server.prefetch('s0/e1/episode.vtt', '00:00:03.000')
+            assert [(join(root, 's0/e1/episode.ogg'), float(i), i + 0.5) for i in range(4, 9)] == server.segments.calls